@@ -16,6 +16,67 @@ def interpreter(tape):
 
     return output
 """
+import re
+
+
+# Runs of commands folded into a single operation: increments and
+# decrements, moves of the selector, new cells, outputs and resets.
+_RUNS = re.compile(r'[+-]+|[<>]+|!+|\*+|/+')
+
+_OTHER = re.compile(r'[^<>*+\-/!]+')
+
+
+def compile_tape(tape):
+    """Compile a tape into a list of (command, count) operations.
+
+    Non-command characters are stripped first, then each run of the
+    same kind of command is folded into one operation: + and - into a
+    single + of their total modulo 256, > and < into a single > of the
+    distance moved, and runs of !, * and / into one with their length.
+    Runs that cancel out are dropped.
+    """
+    operations = []
+    for match in _RUNS.finditer(_OTHER.sub('', tape)):
+        run = match.group()
+        command = run[0]
+        if command in '+-':
+            count = (run.count('+') - run.count('-')) % 256
+            command = '+'
+        elif command in '<>':
+            count = run.count('>') - run.count('<')
+            command = '>'
+        else:
+            count = len(run)
+        if count:
+            operations.append((command, count))
+    return operations
+
+
+def run_operations(operations):
+    """Run compiled Ticker operations, returning the output tape."""
+    p, mem, out = 0, [0], []
+    write = out.append
+    for command, count in operations:
+        if command == '>':
+            p += count
+        elif command == '+':
+            try:
+                mem[p] = (mem[p] + count) % 256
+            except IndexError:
+                pass
+        elif command == '*':
+            try:
+                write(chr(mem[p]) * count)
+            except IndexError:
+                write(chr(0) * count)
+        elif command == '!':
+            mem.extend([0] * count)
+        else:
+            try:
+                mem[p] = 0
+            except IndexError:
+                pass
+    return ''.join(out)
 
 
 def interpreter(tape):
@@ -39,25 +100,8 @@ def interpreter(tape):
     it is not added to the memory. If a + or - is made, the value of
     the assumed cell is not changed. It will always stay 0 unless it
     is added to the memory.
+
+    The tape is compiled with compile_tape first, so a long run of the
+    same command costs a single operation.
     """
-    p, mem, out = 0, [0], ''
-    for c in tape:
-        if c == '>':
-            p += 1
-        elif c == '<':
-            p -= 1
-        elif c == '!':
-            mem.append(0)
-        try:
-            if c == '*':
-                out += chr(mem[p])
-            if c == '+':
-                mem[p] = (mem[p] + 1) % 256
-            if c == '-':
-                mem[p] = (mem[p] - 1) % 256
-            if c == '/':
-                mem[p] = 0
-        except IndexError:
-            if c == '*':
-                out += chr(0)
-    return out
+    return run_operations(compile_tape(tape))
@@ -140,3 +140,63 @@ def test_series_sum(tape, result):
     """Test interpreter for proper output."""
     from esolang_ticker import interpreter
     assert interpreter(tape) == result
+
+
+def reference_interpreter(tape):
+    """Interpret a tape one character at a time, as before compiling."""
+    p, mem, out = 0, [0], ''
+    for c in tape:
+        if c == '>':
+            p += 1
+        elif c == '<':
+            p -= 1
+        elif c == '!':
+            mem.append(0)
+        try:
+            if c == '*':
+                out += chr(mem[p])
+            if c == '+':
+                mem[p] = (mem[p] + 1) % 256
+            if c == '-':
+                mem[p] = (mem[p] - 1) % 256
+            if c == '/':
+                mem[p] = 0
+        except IndexError:
+            if c == '*':
+                out += chr(0)
+    return out
+
+
+@pytest.mark.parametrize('tape, result', [
+    ('', []),
+    ('+' * 300, [('+', 44)]),
+    ('-' * 3, [('+', 253)]),
+    ('+-+-', []),
+    ('>>><', [('>', 2)]),
+    ('<<', [('>', -2)]),
+    ('!!!***//', [('!', 3), ('*', 3), ('/', 2)]),
+    ('+ a +\n*b>c>', [('+', 2), ('*', 1), ('>', 2)]),
+])
+def test_compile_tape_folds_runs(tape, result):
+    """Test that runs of commands are folded and other characters dropped."""
+    from esolang_ticker import compile_tape
+    assert compile_tape(tape) == result
+
+
+@pytest.mark.parametrize('seed', range(20))
+def test_compiled_tapes_run_like_the_reference(seed):
+    """Test that random tapes give the same output as running each command."""
+    import random
+    from esolang_ticker import interpreter
+    rng = random.Random(seed)
+    tape = ''.join(rng.choice('<>*+-/!x') * rng.randint(1, 300)
+                   for _ in range(200))
+    assert interpreter(tape) == reference_interpreter(tape)
+
+
+def test_long_tape_compiles_to_one_operation_per_run():
+    """Test that a long generated tape runs one operation per run of commands."""
+    from esolang_ticker import compile_tape, interpreter
+    tape = ('+' * 72 + '*!>') * 10000
+    assert len(compile_tape(tape)) == 40000
+    assert interpreter(tape) == 'H' * 10000
@@ -0,0 +1,473 @@
+"""Benchmarks for the esolang_whitespace module.
+
+Run the suite of workloads with: python bench_esolang_whitespace.py
+Save its results as a baseline with --save FILE and compare later runs
+against it with --baseline FILE, which exits with status 1 if anything
+got slower or bigger by more than the tolerance. Run the benchmarks of
+single features with --micro.
+"""
+from __future__ import print_function
+
+import argparse
+import json
+import operator
+import sys
+import timeit
+from collections import namedtuple
+
+from esolang_whitespace import (InterpreterPool, SpaceInterpreter, SpaceProgram,
+                                _number_string, _parse_number, assemble, run_batch,
+                                scan, whitespace)
+
+try:
+    import tracemalloc
+except ImportError:  # pragma: no cover
+    tracemalloc = None
+
+
+def num_to_space(num):
+    """Transform a number into WhiteSpace."""
+    sign = '\t' if num < 0 else ' '
+    bin_num = bin(abs(num))[2:]
+    return sign + bin_num.replace('0', ' ').replace('1', '\t') + '\n'
+
+
+def counting_loop(n):
+    """Build a program that counts from 0 up to n and outputs n.
+
+    push 0
+    label L
+        push 1, add
+        dup, push n, sub, jn L
+    outn, end
+    """
+    return ''.join([
+        '  ' + num_to_space(0),
+        '\n  \t\n',
+        '  ' + num_to_space(1), '\t   ',
+        ' \n ', '  ' + num_to_space(n), '\t  \t', '\n\t\t\t\n',
+        '\t\n \t',
+        '\n\n\n'
+    ])
+
+
+def label_chain(n):
+    """Build a program of n labels, each jumping on to the next.
+
+    label i
+        push 1, drop, jump i + 1
+    label n
+    end
+    """
+    def label(i):
+        return bin(i)[2:].replace('0', ' ').replace('1', '\t') + '\n'
+
+    return ''.join('\n  ' + label(i) + '   \t\n \n\n\n \n' + label(i + 1)
+                   for i in range(n)) + '\n  ' + label(n) + '\n\n\n'
+
+
+def heap_fill(n):
+    """Build a program that stores every address from 0 up to n at itself.
+
+    push 0
+    label L
+        dup, dup, store
+        push 1, add
+        dup, push n, sub, jn L
+    end
+    """
+    return ''.join([
+        '  ' + num_to_space(0),
+        '\n  \t\n',
+        ' \n  \n \t\t ',
+        '  ' + num_to_space(1), '\t   ',
+        ' \n ', '  ' + num_to_space(n), '\t  \t', '\n\t\t\t\n',
+        '\n\n\n'
+    ])
+
+
+# Read n then count down from it to 0, outputting 0.
+#
+# push 0, inn, push 0, retrieve
+# label L
+#     push 1, sub, dup, jz E, jump L
+# label E
+# outn, end
+COUNT_DOWN = ('   \n\t\n\t\t   \n\t\t\t' + '\n  \t\n' + '   \t\n\t  \t \n ' +
+              '\n\t \t \n' + '\n \n\t\n' + '\n  \t \n' + '\t\n \t\n\n\n')
+
+
+def _eval_arithmetic(op, stack):
+    """Arithmetic as it was done before, compiling the operation each time."""
+    a, b = stack.pop(), stack.pop()
+    stack.append(eval('b{op}a'.format(op=op), {}, {'a': a, 'b': b}))
+
+
+def bench_arithmetic_dispatch(repeat=100000):
+    """Compare eval based arithmetic against operator callables."""
+    i = SpaceInterpreter('')
+    ops = [('+', operator.add), ('-', operator.sub), ('*', operator.mul),
+           ('//', operator.floordiv), ('%', operator.mod)]
+
+    for symbol, func in ops:
+        before = timeit.timeit(lambda: _eval_arithmetic(symbol, [7, 3]),
+                               number=repeat)
+        after = timeit.timeit(lambda: i._stack_artithmetic(func, [7, 3]),
+                              number=repeat)
+        print('{:>2}  eval: {:>12,.0f} ops/s  operator: {:>12,.0f} ops/s'
+              .format(symbol, repeat / before, repeat / after))
+
+
+def bench_counting_loop(n=200000):
+    """Time the counting loop program end to end on each engine, with and
+    without optimizing."""
+    code = counting_loop(n)
+    steps = 6 * n + 3
+
+    for engine in ('interpreter', 'python', 'blocks'):
+        for optimize in (False, True):
+            program = SpaceProgram(code, optimize)
+
+            def run():
+                return whitespace(code, optimize=optimize, engine=engine)
+
+            assert run() == str(n)
+            elapsed = min(timeit.repeat(run, number=1, repeat=3))
+            print('counting loop to {:,} ({}{}): {:.3f}s, {:,.0f} source '
+                  'instructions/s ({} compiled instructions)'.format(
+                      n, engine, '' if optimize else ', unoptimized', elapsed,
+                      steps / elapsed, len(program)))
+
+
+def bench_label_resolution(n=50000):
+    """Time finding labels and compiling a program with n labels."""
+    code = label_chain(n)
+    steps = [
+        ('scan', lambda: scan(code)),
+        ('find_labels', lambda: SpaceInterpreter(code).find_labels()),
+        ('compile (unoptimized)', lambda: SpaceProgram(code, False)),
+        ('compile', lambda: SpaceProgram(code))
+    ]
+
+    for name, func in steps:
+        elapsed = min(timeit.repeat(func, number=1, repeat=3))
+        print('{} with {:,} labels: {:.3f}s, {:,.0f} labels/s'.format(
+            name, n, elapsed, n / elapsed))
+
+
+def bench_profiler(n=200000):
+    """Time the counting loop with and without profiling."""
+    code = counting_loop(n)
+
+    for profile in (False, True):
+        def run():
+            return SpaceInterpreter(code, profile=profile).run()
+
+        elapsed = min(timeit.repeat(run, number=1, repeat=3))
+        print('counting loop to {:,} ({}): {:.3f}s'.format(
+            n, 'profiled' if profile else 'not profiled', elapsed))
+
+
+def bench_batch(n=20000, count=100, workers=None):
+    """Compare looping over whitespace() against run_batch for n inputs."""
+    inputs = ['{}\n'.format(count)] * n
+
+    start = timeit.default_timer()
+    for inp in inputs:
+        assert whitespace(COUNT_DOWN, inp) == '0'
+    looped = timeit.default_timer() - start
+
+    start = timeit.default_timer()
+    results = run_batch(COUNT_DOWN, inputs, workers=workers)
+    batched = timeit.default_timer() - start
+    assert all(result.output == '0' for result in results)
+
+    print('{:,} inputs: loop {:.3f}s, run_batch {:.3f}s'.format(
+        n, looped, batched))
+
+
+def bench_pool(n=20000, count=5):
+    """Compare a new interpreter for each of n inputs against a pool."""
+    inputs = ['{}\n'.format(count)] * n
+
+    start = timeit.default_timer()
+    for inp in inputs:
+        assert whitespace(COUNT_DOWN, inp) == '0'
+    fresh = timeit.default_timer() - start
+
+    pool = InterpreterPool(COUNT_DOWN)
+    start = timeit.default_timer()
+    for inp in inputs:
+        assert pool.run(inp) == '0'
+    pooled = timeit.default_timer() - start
+
+    print('{:,} inputs: new interpreters {:.3f}s, pool {:.3f}s'.format(
+        n, fresh, pooled))
+
+
+def bench_big_numbers(digits=(10 ** 5, 10 ** 6)):
+    """Compare str and int against the fast paths for huge numbers."""
+    set_limit = getattr(sys, 'set_int_max_str_digits', lambda limit: None)
+    for size in digits:
+        value = 7 ** int(size / 0.845)
+        fast_out = min(timeit.repeat(lambda: _number_string(value), number=1, repeat=3))
+        text = _number_string(value)
+        fast_in = min(timeit.repeat(lambda: _parse_number(text), number=1, repeat=3))
+
+        set_limit(0)
+        try:
+            slow_out = min(timeit.repeat(lambda: str(value), number=1, repeat=1))
+            slow_in = min(timeit.repeat(lambda: int(text), number=1, repeat=1))
+        finally:
+            set_limit(4300)
+
+        print('{:,} digits: output str {:.3f}s fast {:.3f}s, '
+              'input int {:.3f}s fast {:.3f}s'.format(
+                  len(text), slow_out, fast_out, slow_in, fast_in))
+
+
+def bench_memory_models(n=200000):
+    """Compare the time and memory of a dense heap in a dict and an array."""
+    code = heap_fill(n)
+
+    for memory in ('dict', 'array'):
+        def run():
+            i = SpaceInterpreter(code, memory=memory, track_memory=True)
+            i.run()
+            return i
+
+        elapsed = min(timeit.repeat(run, number=1, repeat=3))
+        i = run()
+        print('heap of {:,} ({}): {:.3f}s, peak stack {:,}, peak heap {:,}, '
+              'heap {:,} bytes'.format(n, memory, elapsed, i.peak_stack,
+                                       i.peak_heap, i.memory_usage().heap))
+
+
+# A program of the suite, with the input to run it on and its output.
+Workload = namedtuple('Workload', 'name code inp output')
+
+
+def recursion(depth):
+    """Build a program that recurses depth tail calls deep and outputs 0."""
+    return assemble("""
+        push {}
+        call down
+        outn
+        end
+        label down
+            dup
+            jz bottom
+            push 1
+            sub
+            call down
+        label bottom
+            ret
+    """.format(depth))
+
+
+def deep_recursion(depth):
+    """Build a program that recurses depth calls deep, adding one on each
+    return so the calls are not tail calls, and outputs depth."""
+    return assemble("""
+        push {}
+        call down
+        outn
+        end
+        label down
+            dup
+            jz bottom
+            push 1
+            sub
+            call down
+            push 1
+            add
+        label bottom
+            ret
+    """.format(depth))
+
+
+def arithmetic_loop(n):
+    """Build a program that does arithmetic n times and outputs n."""
+    return assemble("""
+        push 0
+        label loop
+            push 1
+            add
+            dup
+            dup
+            mul
+            push 7
+            mod
+            push 3
+            div
+            drop
+            dup
+            push {}
+            sub
+            jn loop
+        outn
+        end
+    """.format(n))
+
+
+def echo():
+    """Build a program that echoes its input up to a newline."""
+    return assemble("""
+        label loop
+            push 0
+            inc
+            push 0
+            retrieve
+            dup
+            outc
+            push 10
+            sub
+            jz done
+            jump loop
+        label done
+        end
+    """)
+
+
+def corpus(scale=1):
+    """Get the workloads of the suite, scaled by the given factor."""
+    n = int(100000 * scale)
+    return [
+        Workload('recursion', recursion(n), '', '0'),
+        Workload('deep_recursion', deep_recursion(n), '', str(n)),
+        Workload('heap', heap_fill(n), '', ''),
+        Workload('arithmetic', arithmetic_loop(n), '', str(n)),
+        Workload('echo', echo(), 'x' * n + '\n', 'x' * n + '\n'),
+        Workload('labels', label_chain(n // 10), '', '')
+    ]
+
+
+def measure(workload, engine, repeat=3):
+    """Time a workload on an engine and find the memory it needs.
+
+    Instructions are those of the unoptimized program, so the rates of
+    runs with and without the optimizer can be compared.
+
+    Returns: a dict of instructions_per_second, parse_seconds and
+             peak_memory in bytes, None if tracemalloc is not available
+    """
+    code, inp = workload.code, workload.inp
+    counter = SpaceInterpreter(code, inp, optimize=False, engine='interpreter')
+    assert counter.run() == workload.output, workload.name
+    instructions = counter.steps
+
+    parse = min(timeit.repeat(lambda: SpaceProgram(code), number=1, repeat=repeat))
+
+    def run():
+        return SpaceInterpreter(code, inp, engine=engine).run()
+
+    elapsed = min(timeit.repeat(run, number=1, repeat=repeat))
+
+    peak = None
+    if tracemalloc is not None:
+        tracemalloc.start()
+        try:
+            SpaceProgram(code)
+            run()
+            peak = tracemalloc.get_traced_memory()[1]
+        finally:
+            tracemalloc.stop()
+
+    return {
+        'instructions_per_second': instructions / elapsed,
+        'parse_seconds': parse,
+        'peak_memory': peak
+    }
+
+
+def run_suite(scale=1, engines=('interpreter', 'python', 'blocks'), repeat=3):
+    """Measure every workload of the suite on every engine.
+
+    Returns: a dict of 'workload/engine' to its measurements
+    """
+    results = {}
+    for workload in corpus(scale):
+        for engine in engines:
+            key = '{}/{}'.format(workload.name, engine)
+            results[key] = result = measure(workload, engine, repeat)
+            print('{:<24} {:>14,.0f} instructions/s  parse {:.4f}s  peak {}'.format(
+                key, result['instructions_per_second'], result['parse_seconds'],
+                'n/a' if result['peak_memory'] is None
+                else '{:,} bytes'.format(result['peak_memory'])))
+    return results
+
+
+def compare(results, baseline, tolerance=0.1):
+    """Find the measurements that got worse than the baseline.
+
+    A measurement regresses when it is worse by more than the tolerance,
+    a fraction of the baseline. Workloads missing from either are skipped.
+
+    Returns: a list of descriptions of the regressions
+    """
+    regressions = []
+    for key in sorted(set(results) & set(baseline)):
+        new, old = results[key], baseline[key]
+        for name, higher_is_better in [('instructions_per_second', True),
+                                       ('parse_seconds', False),
+                                       ('peak_memory', False)]:
+            if new.get(name) is None or not old.get(name):
+                continue
+            change = (new[name] - old[name]) / float(old[name])
+            if higher_is_better:
+                change = -change
+            if change > tolerance:
+                regressions.append('{} {}: {:,.4g} against {:,.4g} ({:+.0%})'.format(
+                    key, name, new[name], old[name],
+                    -change if higher_is_better else change))
+    return regressions
+
+
+def main(args=None):
+    """Run the suite from the command line.
+
+    Returns: the exit status
+    """
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--scale', type=float, default=1,
+                        help='factor for the size of the workloads')
+    parser.add_argument('--repeat', type=int, default=3,
+                        help='times to run each workload, keeping the fastest')
+    parser.add_argument('--save', metavar='FILE', help='save the results as JSON')
+    parser.add_argument('--baseline', metavar='FILE',
+                        help='JSON results to compare against')
+    parser.add_argument('--tolerance', type=float, default=0.1,
+                        help='fraction a result may be worse than the baseline')
+    parser.add_argument('--micro', action='store_true',
+                        help='run the benchmarks of single features instead')
+    options = parser.parse_args(args)
+
+    if options.micro:
+        bench_arithmetic_dispatch()
+        bench_counting_loop()
+        bench_label_resolution()
+        bench_memory_models()
+        bench_profiler()
+        bench_batch()
+        bench_pool()
+        bench_big_numbers()
+        return 0
+
+    results = run_suite(options.scale, repeat=options.repeat)
+    if options.save:
+        with open(options.save, 'w') as f:
+            json.dump(results, f, indent=2, sort_keys=True)
+
+    if options.baseline:
+        with open(options.baseline) as f:
+            regressions = compare(results, json.load(f), options.tolerance)
+        for regression in regressions:
+            print('regression:', regression)
+        if regressions:
+            return 1
+        print('no regressions against', options.baseline)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
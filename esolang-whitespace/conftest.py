@@ -0,0 +1,7 @@
+"""Test configuration for the esolang_whitespace tests."""
+import sys
+
+# The asyncio support is written with async syntax that Python 2 cannot parse.
+collect_ignore = []
+if sys.version_info < (3, 5):
+    collect_ignore.append('test_esolang_whitespace_async.py')
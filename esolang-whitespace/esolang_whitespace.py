@@ -75,28 +75,2668 @@ def whitespace(code, inp=''):
 
     return ''.join(output)
 """
+import binascii
+import codecs
+import contextlib
+import functools
+import hashlib
+import json
+import mmap
+import multiprocessing
+import operator
+import os
+import pickle
+import re
+import struct
+import sys
+import tempfile
+import threading
+import time
+import zlib
+from array import array
+from bisect import bisect_left, bisect_right
+from collections import namedtuple, OrderedDict
+from itertools import repeat
+
+
+# Instruction set: IMP -> (commands, error message for a bad command).
+# Each command maps to its mnemonic and the kind of parameter it takes.
+_INSTRUCTION_SET = {
+    ' ': ({
+        ' ': ('push', 'num'),
+        '\t ': ('copy', 'num'),
+        '\t\n': ('slide', 'num'),
+        '\n ': ('dup', None),
+        '\n\t': ('swap', None),
+        '\n\n': ('drop', None)
+    }, 'Invalid stack manipulation command.'),
+    '\t ': ({
+        '  ': ('add', None),
+        ' \t': ('sub', None),
+        ' \n': ('mul', None),
+        '\t ': ('div', None),
+        '\t\t': ('mod', None)
+    }, 'Invalid arithmetic command.'),
+    '\t\t': ({
+        ' ': ('store', None),
+        '\t': ('retrieve', None)
+    }, 'Invalid heap access command.'),
+    '\t\n': ({
+        '  ': ('outc', None),
+        ' \t': ('outn', None),
+        '\t ': ('inc', None),
+        '\t\t': ('inn', None)
+    }, 'Invalid input/output command.'),
+    '\n': ({
+        '  ': ('label', 'label'),
+        ' \t': ('call', 'label'),
+        ' \n': ('jump', 'label'),
+        '\t ': ('jz', 'label'),
+        '\t\t': ('jn', 'label'),
+        '\t\n': ('ret', None),
+        '\n\n': ('end', None)
+    }, 'Invalid flow control command.')
+}
+
+_JUMPS = frozenset(['call', 'jump', 'jz', 'jn', 'dupjz', 'dupjn'])
+
+_TRANSFERS = frozenset(['jump', 'ret', 'end'])
+
+_FOLDABLE = frozenset(['add', 'sub', 'mul', 'div', 'mod'])
+
+_ARITHMETIC = {
+    'add': operator.add,
+    'sub': operator.sub,
+    'mul': operator.mul,
+    'div': operator.floordiv,
+    'divi': operator.floordiv,
+    'mod': operator.mod,
+    'modi': operator.mod
+}
+
+# Mnemonic -> (the WhiteSpace it is written as, kind of parameter).
+_ENCODINGS = dict(
+    (mnemonic, (imp + cmd, kind))
+    for imp, (commands, _) in _INSTRUCTION_SET.items()
+    for cmd, (mnemonic, kind) in commands.items()
+)
+
+# Super-instructions replacing a pair of instructions.
+_SUPER_INSTRUCTIONS = {
+    ('push', 'add'): 'addi',
+    ('push', 'sub'): 'subi',
+    ('push', 'mul'): 'muli',
+    ('push', 'div'): 'divi',
+    ('push', 'mod'): 'modi',
+    ('push', 'retrieve'): 'load',
+    ('dup', 'jz'): 'dupjz',
+    ('dup', 'jn'): 'dupjn'
+}
+
+
+def whitespace(code, inp='', **options):
+    """Evaluate the given code written in the WhiteSpace esolang.
+
+    Any options, such as limits, are passed on to the SpaceInterpreter.
+    """
+    return SpaceInterpreter(code, inp, **options).run()
+
+
+BatchResult = namedtuple('BatchResult', 'index output error')
+
+
+def run_batch(code, inputs, workers=None, chunksize=None, **options):
+    """Run the same code against many inputs across a pool of processes.
+
+    The code is compiled once and sent to each worker, which runs the
+    inputs it is given in chunks. An error in one input is captured in
+    its result rather than stopping the batch.
+
+    Returns: a list of BatchResult(index, output, error), one for every
+             input in order, where output is all the output written
+             before any error and error is None if the program exited
+    """
+    return list(iter_batch(code, inputs, workers, chunksize, **options))
+
+
+def iter_batch(code, inputs, workers=None, chunksize=None, ordered=True,
+               **options):
+    """Run the same code against many inputs, yielding each result.
+
+    Results are yielded in the order of inputs, or as soon as they are
+    done if ordered is False. workers is the number of processes, by
+    default one per CPU; with one worker or less, the inputs are run in
+    this process. Each worker is sent chunksize inputs at a time.
+
+    Yields: BatchResult(index, output, error) for every input
+    """
+    code = _clean(code)
+    program = program_cache.get(code, options.get('optimize', True))
+
+    if workers is None:
+        workers = multiprocessing.cpu_count()
+    if workers <= 1:
+        for job in enumerate(inputs):
+            yield _run_batch_job(code, options, job)
+        return
+
+    if chunksize is None:
+        try:
+            chunksize = max(1, len(inputs) // (workers * 4))
+        except TypeError:
+            chunksize = 64
 
+    pool = multiprocessing.Pool(workers, _start_batch_worker, (program, options))
+    try:
+        run = pool.imap if ordered else pool.imap_unordered
+        for result in run(_run_batch_worker_job, enumerate(inputs), chunksize):
+            yield result
+        pool.close()
+    finally:
+        pool.terminate()
+        pool.join()
 
-def whitespace(code, inp=''):
-    """Evaluate the given code written in the WhiteSpace esolang."""
-    return SpaceInterpreter(code, inp).run()
 
+# The code and options run by a batch worker process.
+_batch_worker = {}
 
-class SpaceInterpreter(object):
-    """Interpreter for the WhiteSpace esolang."""
 
-    def __init__(self, code='', inp=''):
-        """Create an interpreter for a given code and input."""
-        self.code = ''.join([ch for ch in code if ch == ' ' or ch == '\n' or ch == '\t'])
-        self.input = inp
+def _start_batch_worker(program, options):
+    """Set up a worker process with the compiled program of its batch."""
+    program_cache.add(program)
+    _batch_worker['code'] = program.code
+    _batch_worker['options'] = options
+
+
+def _run_batch_worker_job(job):
+    """Run one input of the batch in a worker process."""
+    return _run_batch_job(_batch_worker['code'], _batch_worker['options'], job)
+
+
+def _run_batch_job(code, options, job):
+    """Run the code for an (index, input) job, capturing any error."""
+    index, inp = job
+    chunks = []
+    try:
+        SpaceInterpreter(code, inp, **options).run(output=chunks.append)
+    except Exception as error:
+        return BatchResult(index, ''.join(chunks), error)
+    return BatchResult(index, ''.join(chunks), None)
+
+
+class ResourceLimitError(RuntimeError):
+    """Raised when a program goes over one of the interpreter's limits.
+
+    limit: the name of the limit exceeded, e.g. 'stack_limit'
+    value: the value of that limit
+    state: the position, call stack, instructions run, stack depth,
+           heap size and call depth at the point execution was cut off
+    """
+
+    def __init__(self, message, limit, value, state):
+        """Create the error for the exceeded limit."""
+        super(ResourceLimitError, self).__init__(message)
+        self.limit = limit
+        self.value = value
+        self.state = state
+
+    def __reduce__(self):
+        """Pickle the error with all its details."""
+        return (type(self), (self.args[0], self.limit, self.value, self.state))
+
+
+# Every byte but those of a space, tab or newline, to delete from sources.
+_OTHER_BYTES = bytes(bytearray(b for b in range(256) if b not in (9, 10, 32)))
+
+_CLEAN_CHUNK_SIZE = 1 << 20
+
+_WHITESPACE_RUN = re.compile(u'[ \t\n]+')
+
+_WHITESPACE_BYTES_RUN = re.compile(b'[ \t\n]+')
+
+
+def _clean(code):
+    """Remove every character that is not a space, tab or newline.
+
+    code may be a string, a SpaceSource or anything bytes-like, such as
+    an mmap. Text is encoded a chunk at a time, so the characters can be
+    deleted in bulk by bytes.translate; multibyte characters never
+    contain the bytes kept.
+    """
+    if isinstance(code, SpaceSource):
+        return code.code
+    chunks = []
+    for start in range(0, len(code), _CLEAN_CHUNK_SIZE):
+        chunk = code[start:start + _CLEAN_CHUNK_SIZE]
+        if not isinstance(chunk, bytes):
+            chunk = (chunk.encode('utf-8', 'surrogatepass') if hasattr(chunk, 'encode')
+                     else _as_bytes(chunk))
+        chunks.append(chunk.translate(None, _OTHER_BYTES).decode('ascii'))
+    return ''.join(chunks)
+
+
+def _as_bytes(data):
+    """Copy anything bytes-like, such as a memoryview or array, into bytes."""
+    if hasattr(data, 'tobytes'):
+        return data.tobytes()
+    return bytes(data if isinstance(data, bytearray) else bytearray(data))
+
+
+def tokenize(code):
+    """Split WhiteSpace code into its instructions in a single pass.
+
+    code must already be cleaned of non-whitespace characters.
+
+    Yields: (position, mnemonic, parameter, end) for every instruction,
+            where position and end are the offsets the instruction
+            starts at and stops before.
+    """
+    position = 0
+    length = len(code)
+
+    while position < length:
+        imp = code[position:position + 2]
+        if imp not in _INSTRUCTION_SET:
+            imp = imp[0]
+        if imp not in _INSTRUCTION_SET:
+            raise SyntaxError('Invalid instruction modification parameter.')
+
+        commands, error = _INSTRUCTION_SET[imp]
+        start = position + len(imp)
+        for size in (1, 2):
+            cmd = code[start:start + size]
+            if len(cmd) == size and cmd in commands:
+                break
+        else:
+            raise SyntaxError(error)
+
+        mnemonic, kind = commands[cmd]
+        end = start + size
+        param = None
+
+        if kind == 'num':
+            param, end = _read_num(code, end)
+        elif kind == 'label':
+            param, end = _read_label(code, end)
+
+        yield position, mnemonic, param, end
+        position = end
+
+
+def scan(code):
+    """Tokenize code, finding its labels in the same pass.
+
+    Returns: the list of (position, mnemonic, parameter, end) tokens,
+             whose positions are the instruction boundaries, and a dict
+             of each label to the offset following its declaration
+    """
+    tokens = []
+    labels = {}
+    position = 0
+    try:
+        for token in tokenize(code):
+            position = token[0]
+            if token[1] == 'label':
+                if token[2] in labels:
+                    raise SyntaxError('Cannot redeclare a label.')
+                labels[token[2]] = token[3]
+            tokens.append(token)
+            position = token[3]
+    except SyntaxError as error:
+        _locate_error(error, code, position)
+        raise
+    return tokens, labels
+
+
+def _locate_error(error, code, position):
+    """Set the line and column of a SyntaxError to an offset of the code.
+
+    The error keeps its message, and the location goes in its arguments
+    so that it survives pickling.
+    """
+    line = code.count('\n', 0, position) + 1
+    column = position - code.rfind('\n', 0, position)
+    error.__init__(error.msg, (None, line, column, None))
+
+
+def _read_num(code, start):
+    """Read the number starting at the given offset.
+
+    Returns: the evaluated number, the offset after its terminal
+    """
+    if start >= len(code):
+        raise SyntaxError('Numbers cannot be empty.')
+
+    if code[start] == '\n':
+        raise SyntaxError('Numbers cannot be only a terminal.')
+
+    terminal = code.find('\n', start)
+    if terminal == -1:
+        raise SyntaxError('Number must end with a terminal.')
+
+    digits = code[start + 1:terminal]
+    num = int(digits.replace(' ', '0').replace('\t', '1') or '0', 2)
+    if code[start] == '\t':
+        num = -num
+    return num, terminal + 1
+
+
+# Numbers with more bits than this are converted to and from decimal by
+# divide and conquer instead of str and int, which take quadratic time and
+# since Python 3.11 refuse numbers of more than 4300 digits by default.
+_BIG_NUMBER_BITS = 8192
+
+_BIG_NUMBER_DIGITS = 2466
+
+# Only plain decimal is read, whatever the length, so the short numbers
+# given to int cannot use the underscores or other digits it allows.
+_DECIMAL = re.compile(r'[-+]?[0-9]+\Z')
+
+try:
+    import _decimal as _fast_decimal
+except ImportError:
+    _fast_decimal = None
+
+
+def _number_string(value):
+    """Write a number in decimal, quickly even if it is huge."""
+    if value.bit_length() <= _BIG_NUMBER_BITS:
+        return str(value)
+    if value < 0:
+        return '-' + _number_string(-value)
+    if _fast_decimal is not None:
+        return _decimal_number_string(value)
+    return _split_number_string(value, {})
+
+
+def _decimal_number_string(value):
+    """Write a number in decimal using the decimal module's fast arithmetic.
+
+    The number is split in halves by bits, each half converted to an exact
+    Decimal and the high half multiplied back by a power of two. The
+    Decimal is then written out in linear time.
+    """
+    context = _fast_decimal.Context(prec=_fast_decimal.MAX_PREC,
+                                    Emax=_fast_decimal.MAX_EMAX,
+                                    Emin=_fast_decimal.MIN_EMIN)
+    context.traps[_fast_decimal.Inexact] = True
+    powers = {}
+
+    def power(bits):
+        if bits not in powers:
+            powers[bits] = context.power(_fast_decimal.Decimal(2), bits)
+        return powers[bits]
+
+    def convert(value, bits):
+        if bits <= _BIG_NUMBER_BITS:
+            return _fast_decimal.Decimal(value)
+        low_bits = bits >> 1
+        high = value >> low_bits
+        low = value - (high << low_bits)
+        return context.add(convert(low, low_bits), context.multiply(
+            convert(high, bits - low_bits), power(low_bits)))
+
+    return '{:f}'.format(convert(value, value.bit_length()))
+
+
+def _split_number_string(value, powers):
+    """Write a non-negative number in decimal by splitting it by powers of ten."""
+    if value.bit_length() <= _BIG_NUMBER_BITS:
+        return str(value)
+
+    digits = int(value.bit_length() * 0.30103) // 2
+    if digits not in powers:
+        powers[digits] = 10 ** digits
+    high, low = divmod(value, powers[digits])
+    low = _split_number_string(low, powers)
+    return (_split_number_string(high, powers) +
+            '0' * (digits - len(low)) + low)
+
+
+def _parse_number(text):
+    """Read a number written in decimal, quickly even if it is huge.
+
+    Raises ValueError if the text is not a number.
+    """
+    text = text.strip()
+    if not _DECIMAL.match(text):
+        raise ValueError('invalid literal for int(): {!r}'.format(text[:20]))
+    if len(text) <= _BIG_NUMBER_DIGITS:
+        return int(text)
+
+    sign, digits = (-1, text[1:]) if text[0] == '-' else (1, text.lstrip('+'))
+    return sign * _parse_digits(digits, {})
+
+
+def _parse_digits(digits, powers):
+    """Read a string of decimal digits by splitting it in halves."""
+    if len(digits) <= _BIG_NUMBER_DIGITS:
+        return int(digits)
+
+    low = len(digits) // 2
+    if low not in powers:
+        powers[low] = 10 ** low
+    return (_parse_digits(digits[:-low], powers) * powers[low] +
+            _parse_digits(digits[-low:], powers))
 
+
+def _read_label(code, start):
+    """Read the label starting at the given offset.
+
+    Returns: the label, the offset after its terminal
+    """
+    if start >= len(code):
+        raise SyntaxError('Labels cannot be empty.')
+
+    terminal = code.find('\n', start)
+    if terminal == -1:
+        raise SyntaxError('Lables must end with a terminal')
+
+    return code[start:terminal], terminal + 1
+
+
+class SpaceSource(object):
+    """WhiteSpace source code, cleaned of everything but its commands.
+
+    The source can be a string or anything bytes-like, such as an mmap,
+    with bytes taken to be UTF-8. If source is None, it is read from the
+    file named filename through mmap and only the cleaned code is held.
+
+    Offsets of the cleaned code can be located in the source, to point
+    errors at their line and column. The map between the two is only
+    built the first time it is needed, from the source or the file.
+    """
+
+    def __init__(self, source='', filename=None):
+        """Clean the given source."""
+        self.filename = filename
+        self._source = source
+        self._runs = None
+        with self._opened() as text:
+            self.code = _clean(text)
+
+    def locate(self, offset):
+        """Find an offset of the cleaned code in the source.
+
+        Returns: the line and column of the offset, counted from 1
+        """
+        with self._opened() as text:
+            line, column, _ = self._find(text, offset)
+        return line, column
+
+    def relocate(self, error):
+        """Point a SyntaxError located in the cleaned code at the source."""
+        if not isinstance(error, SyntaxError) or not error.lineno or error.text is not None:
+            return
+
+        offset = 0
+        for _ in range(error.lineno - 1):
+            offset = self.code.index('\n', offset) + 1
+        with self._opened() as text:
+            line, column, text = self._find(text, offset + (error.offset or 1) - 1)
+        error.__init__(error.msg, (self.filename, line, column, text))
+
+    @contextlib.contextmanager
+    def _opened(self):
+        """Get the source, mapping the file into memory if it is not held."""
+        if self._source is not None:
+            yield self._source
+            return
+
+        with open(self.filename, 'rb') as f:
+            if not os.fstat(f.fileno()).st_size:
+                yield b''
+                return
+            mapped = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+            try:
+                yield mapped
+            finally:
+                mapped.close()
+
+    def _find(self, text, offset):
+        """Find an offset of the cleaned code in the source text.
+
+        Returns: the line and column of the offset, and the line itself
+        """
+        if not hasattr(text, 'rfind'):
+            text = _as_bytes(text)
+        if self._runs is None:
+            self._runs = _source_runs(text)
+        starts, positions = self._runs
+        run = bisect_right(starts, offset) - 1
+        position = positions[run] + offset - starts[run] if run >= 0 else 0
+
+        newline = '\n' if isinstance(text, _STRING_TYPES) else b'\n'
+        start = text.rfind(newline, 0, position) + 1
+        end = text.find(newline, position)
+        line = text[start:len(text) if end == -1 else end]
+        before = text[start:position]
+        if not isinstance(text, _STRING_TYPES):
+            line = line.decode('utf-8', 'replace')
+            before = before.decode('utf-8', 'replace')
+        return self.code.count('\n', 0, offset) + 1, len(before) + 1, line
+
+
+def _source_runs(text):
+    """Find the runs of whitespace in source text.
+
+    Returns: arrays of the offset each run starts at in the cleaned code
+             and in the text
+    """
+    pattern = _WHITESPACE_RUN if isinstance(text, _STRING_TYPES) else _WHITESPACE_BYTES_RUN
+    starts = array(_INT_TYPECODE)
+    positions = array(_INT_TYPECODE)
+    offset = 0
+    for match in pattern.finditer(text):
+        starts.append(offset)
+        positions.append(match.start())
+        offset += match.end() - match.start()
+    return starts, positions
+
+
+class SpaceProgram(object):
+    """WhiteSpace code compiled into a flat array of instructions.
+
+    Every instruction is a (mnemonic, parameter) record. Labels are
+    dropped from the array and the parameters of jumps and calls are
+    resolved to the index of the instruction following the label, or
+    None if the label is never defined. A final 'eof' instruction
+    marks running off the end of the code.
+
+    Unless optimize is False, the instructions first go through the
+    peephole optimizer.
+
+    The program can also be transpiled into a Python function, which is
+    compiled the first time it is needed and kept with the program, or
+    split into basic blocks compiled one at a time as they are first run.
+    Neither checks the stack before instructions analyze proves always
+    have the values they need, so they must only be run on stacks the
+    program itself left.
+    """
+
+    # Attributes compiled when first needed, which are not pickled.
+    _COMPILED = ('entries', '_function', '_profile_function', '_trace_function',
+                 '_track_function', '_decoded', '_blocks', '_block_at')
+
+    def __init__(self, code, optimize=True):
+        """Compile the given cleaned code."""
+        self.code = code
+        self.optimized = optimize
+        self.instructions = []
+        self.positions = []
         self.labels = {}
-        self.stack = []
-        self.heap = {}
+        self.entries = None
+        self._indexes = {}
+        self._function = None
+        self._profile_function = None
+        self._trace_function = None
+        self._track_function = None
+        self._decoded = None
+        self._blocks = None
+        self._block_at = None
+
+        tokens, self.label_positions = scan(code)
+        listing = [(mnemonic, param, position)
+                   for position, mnemonic, param, _ in tokens]
+
+        removable = [position for mnemonic, _, position in listing
+                     if mnemonic in ('label', 'jump')]
+        if optimize:
+            listing = peephole(listing)
+
+        for mnemonic, param, position in listing:
+            self._indexes[position] = len(self.instructions)
+            if mnemonic == 'label':
+                self.labels[param] = len(self.instructions)
+                continue
+
+            self.instructions.append((mnemonic, param))
+            self.positions.append(position)
+
+        self.instructions.append(('eof', None))
+        self.positions.append(len(code))
+        self._indexes[len(code)] = len(self.positions) - 1
+
+        for position in removable:
+            if position not in self._indexes:
+                self._indexes[position] = bisect_left(self.positions, position)
+
+        labels = self.labels
+        self.instructions = [
+            (mnemonic, labels.get(param)) if mnemonic in _JUMPS
+            else (mnemonic, param)
+            for mnemonic, param in self.instructions
+        ]
+
+    def __getstate__(self):
+        """Pickle the program without its compiled functions."""
+        state = self.__dict__.copy()
+        state.update(dict.fromkeys(self._COMPILED))
+        return state
+
+    def __setstate__(self, state):
+        """Unpickle the program, adding any compiled attributes it lacks."""
+        self.__dict__.update(dict.fromkeys(self._COMPILED))
+        self.__dict__.update(state)
 
-        self._call_stack = [0]
+    @property
+    def function(self):
+        """Get the program as a Python function, compiling it the first time."""
+        if self._function is None:
+            self._function = self._transpile(False)
+        return self._function
+
+    @property
+    def profile_function(self):
+        """Get the program as a Python function counting each instruction run."""
+        if self._profile_function is None:
+            self._profile_function = self._transpile(True)
+        return self._profile_function
+
+    @property
+    def trace_function(self):
+        """Get the program as a Python function calling a trace function."""
+        if self._trace_function is None:
+            self._trace_function = self._transpile(False, True)
+        return self._trace_function
+
+    @property
+    def track_function(self):
+        """Get the program as a Python function recording its peak stack."""
+        if self._track_function is None:
+            self._track_function = self._transpile(False, track=True)
+        return self._track_function
+
+    @property
+    def decoded(self):
+        """Get a dict of each instruction's code offset to its mnemonic and
+        parameter as written in the code, with labels and without any
+        optimization."""
+        if self._decoded is None:
+            self._decoded = dict((position, (mnemonic, param))
+                                 for position, mnemonic, param, _ in tokenize(self.code))
+        return self._decoded
+
+    @property
+    def blocks(self):
+        """Get the basic blocks of the program, splitting it the first time."""
+        if self._blocks is None:
+            self._blocks, self._block_at = basic_blocks(self)
+        return self._blocks
+
+    @property
+    def block_at(self):
+        """Get a list of the block starting at each index, or None for
+        indexes within a block."""
+        if self._block_at is None:
+            self._blocks, self._block_at = basic_blocks(self)
+        return self._block_at
+
+    def _transpile(self, profile, trace=False, track=False):
+        """Compile the transpiled source, keeping its line map on the function."""
+        safe = frozenset() if profile or trace else analyze(self).safe
+        source, line_pcs, entries = transpile(self, profile, trace, safe, track)
+        if not trace:
+            self.entries = entries
+        namespace = {'_number_string': _number_string,
+                     '_parse_number': _parse_number}
+        exec(compile(source, '<whitespace>', 'exec'), namespace)
+        function = namespace['run']
+        function.line_pcs = line_pcs
+        return function
+
+    def __len__(self):
+        """Get the number of instructions, including the final 'eof'."""
+        return len(self.instructions)
+
+    def index(self, position):
+        """Get the index of the instruction run from the given code offset."""
+        try:
+            return self._indexes[position]
+        except KeyError:
+            raise ValueError('No instruction starts at that position.')
+
+
+def peephole(listing):
+    """Optimize a listing of (mnemonic, parameter, position) instructions.
+
+    Labels are part of the listing and jumps still refer to them by name.
+    The passes are repeated until none of them changes anything:
+        - jumps to an unconditional jump go straight to its target
+        - jumps to the instruction right after them are removed
+        - code after an unconditional transfer up to a label is removed
+        - labels that are never jumped to are removed
+        - arithmetic on two pushed numbers is done ahead of time
+        - common pairs of instructions become super-instructions
+        - calls returning straight to a ret become jumps
+
+    The optimized listing raises the same errors as the original, though
+    an error may come from a different instruction. Tail calls no longer
+    count towards the call limit.
+    """
+    while True:
+        optimized = _eliminate_tail_calls(listing)
+        optimized = _thread_jumps(optimized)
+        optimized = _remove_unreachable(optimized)
+        optimized = _fold_constants(optimized)
+        optimized = _fuse_instructions(optimized)
+        if optimized == listing:
+            return listing
+        listing = optimized
+
+
+def _jump_destinations(listing):
+    """Map each label to the first instruction after it in the listing."""
+    destinations = {}
+    following = None
+    for instruction in reversed(listing):
+        if instruction[0] == 'label':
+            destinations[instruction[1]] = following
+        else:
+            following = instruction
+    return destinations
+
+
+def _thread_jumps(listing):
+    """Send jumps through chains of unconditional jumps to the final label."""
+    destinations = _jump_destinations(listing)
+    threaded = []
+
+    for mnemonic, param, position in listing:
+        if mnemonic in _JUMPS:
+            seen = set([param])
+            target = destinations.get(param)
+            while (target is not None and target[0] == 'jump' and
+                   target[1] not in seen):
+                param = target[1]
+                seen.add(param)
+                target = destinations.get(param)
+        threaded.append((mnemonic, param, position))
+
+    return threaded
+
+
+def _eliminate_tail_calls(listing):
+    """Turn calls followed by a ret, or a jump to one, into jumps.
+
+    The ret of the subroutine then returns straight to the caller of the
+    call, so tail recursion runs without growing the call stack.
+    """
+    destinations = _jump_destinations(listing)
+    optimized = []
+    following = None
+    for instruction in reversed(listing):
+        mnemonic, param, position = instruction
+        if mnemonic == 'call' and following is not None and (
+                following[0] == 'ret' or following[0] == 'jump' and
+                (destinations.get(following[1]) or ('',))[0] == 'ret'):
+            instruction = ('jump', param, position)
+        if mnemonic != 'label':
+            following = instruction
+        optimized.append(instruction)
+    optimized.reverse()
+    return optimized
+
+
+def _remove_unreachable(listing):
+    """Remove code that can never run and labels that are never used."""
+    kept = []
+    reachable = True
+    for i, instruction in enumerate(listing):
+        mnemonic, param, _ = instruction
+        if mnemonic == 'label':
+            reachable = True
+        elif not reachable:
+            continue
+        elif mnemonic == 'jump' and _falls_to_label(listing, i + 1, param):
+            continue
+        elif mnemonic in _TRANSFERS:
+            reachable = False
+        kept.append(instruction)
+
+    used = set(param for mnemonic, param, _ in kept
+               if mnemonic in _JUMPS)
+    return [instruction for instruction in kept
+            if instruction[0] != 'label' or instruction[1] in used]
+
+
+def _falls_to_label(listing, start, label):
+    """Check if the label is among the labels starting at start."""
+    while start < len(listing) and listing[start][0] == 'label':
+        if listing[start][1] == label:
+            return True
+        start += 1
+    return False
+
+
+def _fold_constants(listing):
+    """Replace arithmetic on two pushed numbers with a push of the result."""
+    folded = []
+    for instruction in listing:
+        mnemonic = instruction[0]
+        if (mnemonic in _FOLDABLE and len(folded) >= 2 and
+                folded[-1][0] == 'push' and folded[-2][0] == 'push' and
+                not (mnemonic in ('div', 'mod') and folded[-1][1] == 0)):
+            a = folded.pop()[1]
+            _, b, position = folded.pop()
+            folded.append(('push', _ARITHMETIC[mnemonic](b, a), position))
+        else:
+            folded.append(instruction)
+    return folded
+
+
+def _fuse_instructions(listing):
+    """Replace common pairs of instructions with a super-instruction.
+
+    Pushing a literal zero before division is left alone so the error is
+    still raised as usual.
+    """
+    fused = []
+    for instruction in listing:
+        mnemonic, param, _ = instruction
+        if fused:
+            previous, value, position = fused[-1]
+            super_instruction = _SUPER_INSTRUCTIONS.get((previous, mnemonic))
+            if (super_instruction is not None and
+                    not (value == 0 and mnemonic in ('div', 'mod'))):
+                fused[-1] = (super_instruction,
+                             value if previous == 'push' else param, position)
+                continue
+        fused.append(instruction)
+    return fused
+
+
+try:
+    _STRING_TYPES = basestring
+except NameError:
+    _STRING_TYPES = str
+
+
+class SpaceInput(object):
+    """Readable input for a WhiteSpace program.
+
+    The source can be a string, a readable file or any iterable of
+    strings. Sources other than strings are read a chunk at a time, so
+    only the part of the input not yet read by the program is held.
+    Files opened in binary mode are decoded as UTF-8.
+    """
+
+    CHUNK_SIZE = 1 << 16
+
+    def __init__(self, source=''):
+        """Wrap the given input source."""
+        self._buffer = ''
+        self._position = 0
+        self._consumed = 0
+
+        if isinstance(source, _STRING_TYPES):
+            self._buffer = source
+            self._chunks = None
+        elif hasattr(source, 'read'):
+            self._chunks = self._read(source)
+        else:
+            self._chunks = iter(source)
+
+    def _read(self, source):
+        """Yield chunks read from a file until it is empty, decoding bytes."""
+        decoder = codecs.getincrementaldecoder('utf-8')()
+        while True:
+            chunk = source.read(self.CHUNK_SIZE)
+            if not chunk:
+                break
+            if not isinstance(chunk, _STRING_TYPES):
+                chunk = decoder.decode(chunk)
+            yield chunk
+        yield decoder.decode(b'', True)
+
+    def _fill(self):
+        """Append the next chunk of the source to the buffer.
+
+        Returns: False if the source is exhausted
+        """
+        if self._chunks is None:
+            return False
+
+        for chunk in self._chunks:
+            if chunk:
+                self._consumed += self._position
+                self._buffer = self._buffer[self._position:] + chunk
+                self._position = 0
+                return True
+
+        self._chunks = None
+        return False
+
+    def read_char(self):
+        """Read the next character."""
+        if self._position >= len(self._buffer) and not self._fill():
+            raise IOError('No more characters in input to read.')
+
+        char = self._buffer[self._position]
+        self._position += 1
+        return char
+
+    def read_line(self):
+        """Read up to the next terminal, which is consumed but not returned."""
+        if self._position >= len(self._buffer) and not self._fill():
+            raise IOError('No more characters in input to read.')
+
+        start = self._position
+        terminal = self._buffer.find('\n', start)
+        while terminal == -1:
+            searched = len(self._buffer) - self._position
+            if not self._fill():
+                raise SyntaxError('Number input must have a terminal.')
+            start = self._position + searched
+            terminal = self._buffer.find('\n', start)
+
+        line = self._buffer[self._position:terminal]
+        self._position = terminal + 1
+        return line
+
+    def skip(self, count):
+        """Discard the next count characters.
+
+        Returns: the number of characters discarded, fewer than count if
+                 the input ran out
+        """
+        skipped = 0
+        while skipped < count:
+            if self._position >= len(self._buffer) and not self._fill():
+                break
+            taken = min(count - skipped, len(self._buffer) - self._position)
+            self._position += taken
+            skipped += taken
+        return skipped
+
+    @property
+    def consumed(self):
+        """Get the number of characters read so far."""
+        return self._consumed + self._position
+
+    @property
+    def streaming(self):
+        """Check if there may be input left that has not been buffered."""
+        return self._chunks is not None
+
+    def remaining(self):
+        """Get the input that has been buffered but not read."""
+        return self._buffer[self._position:]
+
+
+def _output_writer(output):
+    """Get a function writing to a text stream or passing to a callback."""
+    if hasattr(output, 'write'):
+        return output.write
+    if callable(output):
+        return output
+    raise TypeError('Output must be a writable stream or a callable.')
+
+
+# Typecode of arrays of integers. Python 2 has no 'q', so it falls back
+# to 'l', which is 64 bits on most platforms but only 32 on some.
+try:
+    _INT_TYPECODE = array('q').typecode
+except ValueError:  # pragma: no cover
+    _INT_TYPECODE = 'l'
+
+_INT_BITS = 8 * array(_INT_TYPECODE).itemsize
+
+_INT_MIN = -(1 << (_INT_BITS - 1))
+
+_INT_MAX = (1 << (_INT_BITS - 1)) - 1
+
+
+class ArrayHeap(object):
+    """Heap keeping dense addresses in an array of 64 bit integers.
+
+    The array starts at the first address stored and holds the addresses
+    from there up to SPREAD past the highest one it holds so far, in a
+    growable array of _INT_TYPECODE with a bytearray marking which of
+    them are set, as long as at least a quarter of the array stays set.
+    Other addresses, and values too large for the array, go in a dict.
+    It can be used wherever the heap is a dict.
+    """
+
+    SPREAD = 1024
+
+    def __init__(self, items=()):
+        """Create a heap holding the given address to value items."""
+        self._values = array(_INT_TYPECODE)
+        self._used = bytearray()
+        self._base = 0
+        self._sparse = {}
+        self._dense = 0
+        for address, value in sorted(dict(items).items()):
+            self[address] = value
+
+    def __getitem__(self, address):
+        """Get the value at an address, raising KeyError if it is not set."""
+        index = address - self._base
+        if 0 <= index < len(self._used) and self._used[index]:
+            return self._values[index]
+        return self._sparse[address]
+
+    def __setitem__(self, address, value):
+        """Set the value at an address."""
+        used = self._used
+        size = len(used)
+        if not size:
+            self._base = address
+        index = address - self._base
+        if (0 <= index < size + self.SPREAD and
+                _INT_MIN <= value <= _INT_MAX):
+            if index >= size:
+                grow = max(index + 1, 2 * size) - size
+                if (self._dense + 1) * 4 < size + grow:
+                    self._sparse[address] = value
+                    return
+                self._values.extend(repeat(0, grow))
+                used.extend(bytearray(grow))
+            if not used[index]:
+                used[index] = 1
+                self._dense += 1
+                self._sparse.pop(address, None)
+            self._values[index] = value
+            return
+
+        if 0 <= index < size and used[index]:
+            used[index] = 0
+            self._dense -= 1
+        self._sparse[address] = value
+
+    def __contains__(self, address):
+        """Check if a value is set at the address."""
+        index = address - self._base
+        if 0 <= index < len(self._used) and self._used[index]:
+            return True
+        return address in self._sparse
+
+    def __len__(self):
+        """Get the number of addresses set."""
+        return self._dense + len(self._sparse)
+
+    def __iter__(self):
+        """Iterate over the addresses set."""
+        for address, used in enumerate(self._used, self._base):
+            if used:
+                yield address
+        for address in self._sparse:
+            yield address
+
+    def keys(self):
+        """Get a list of the addresses set."""
+        return list(self)
+
+    def items(self):
+        """Get a list of the (address, value) pairs set."""
+        return [(address, self[address]) for address in self]
+
+    def get(self, address, default=None):
+        """Get the value at an address, or default if it is not set."""
+        try:
+            return self[address]
+        except KeyError:
+            return default
+
+    def __eq__(self, other):
+        """Compare the contents with another heap or dict."""
+        if not hasattr(other, 'items'):
+            return NotImplemented
+        return dict(self.items()) == dict(other.items())
+
+    def __ne__(self, other):
+        """Compare the contents with another heap or dict."""
+        equal = self.__eq__(other)
+        return equal if equal is NotImplemented else not equal
+
+    __hash__ = None
+
+    def __repr__(self):
+        """Show the contents as a dict."""
+        return 'ArrayHeap({!r})'.format(dict(self.items()))
+
+    def __sizeof__(self):
+        """Get the bytes used, including values kept as Python ints."""
+        return (object.__sizeof__(self) + sys.getsizeof(self._values) +
+                sys.getsizeof(self._used) + _sizeof_dict(self._sparse))
+
+
+def _sizeof_dict(mapping):
+    """Get the bytes used by a dict along with its keys and values."""
+    return sys.getsizeof(mapping) + sum(
+        sys.getsizeof(key) + sys.getsizeof(value)
+        for key, value in mapping.items())
+
+
+MemoryUsage = namedtuple('MemoryUsage', 'stack heap')
+
+
+CacheInfo = namedtuple('CacheInfo', 'hits misses disk_hits maxsize currsize')
+
+
+class ProgramCache(object):
+    """Least recently used cache of compiled programs.
+
+    Programs are keyed by a hash of their cleaned code. If a directory
+    is given, compiled programs are also pickled there so that a new
+    process can load them instead of compiling again. Unpickling can run
+    arbitrary code, so the directory must be one that only trusted users
+    can write to. Entries that cannot be loaded are compiled again and
+    rewritten.
+    """
+
+    FORMAT = 4
+
+    def __init__(self, maxsize=128, directory=None):
+        """Create a cache holding at most maxsize programs in memory."""
+        self._programs = OrderedDict()
+        self._lock = threading.Lock()
+        self._maxsize = maxsize
+        self.directory = directory
+        self.hits = 0
+        self.misses = 0
+        self.disk_hits = 0
+
+    @property
+    def maxsize(self):
+        """Get the most programs kept in memory."""
+        return self._maxsize
+
+    @maxsize.setter
+    def maxsize(self, value):
+        """Set the most programs kept in memory, evicting any extra."""
+        with self._lock:
+            self._maxsize = value
+            self._evict()
+
+    def __len__(self):
+        """Get the number of programs kept in memory."""
+        return len(self._programs)
+
+    def get(self, code, optimize=True):
+        """Get the compiled program for the cleaned code.
+
+        Compiles the code if it is not cached in memory or on disk.
+        """
+        key = self._key(code, optimize)
+        with self._lock:
+            program = self._programs.pop(key, None)
+            if program is not None:
+                self.hits += 1
+                self._programs[key] = program
+                return program
+            self.misses += 1
+
+        program = self._load(key)
+        if program is None:
+            program = SpaceProgram(code, optimize)
+            self._dump(key, program)
+
+        with self._lock:
+            self._programs[key] = program
+            self._evict()
+        return program
+
+    def add(self, program):
+        """Keep an already compiled program in memory."""
+        key = self._key(program.code, program.optimized)
+        with self._lock:
+            self._programs.pop(key, None)
+            self._programs[key] = program
+            self._evict()
+
+    def info(self):
+        """Get the hit and miss counters along with the size of the cache."""
+        with self._lock:
+            return CacheInfo(self.hits, self.misses, self.disk_hits,
+                             self._maxsize, len(self._programs))
+
+    def clear(self):
+        """Empty the in memory cache and reset the counters."""
+        with self._lock:
+            self._programs.clear()
+            self.hits = self.misses = self.disk_hits = 0
+
+    @staticmethod
+    def _key(code, optimize):
+        """Get the key of the code, hashed, for the optimize flag."""
+        key = hashlib.sha1(code.encode('ascii')).hexdigest()
+        return key if optimize else key + '-raw'
+
+    def _evict(self):
+        """Drop least recently used programs until within maxsize."""
+        while len(self._programs) > max(self._maxsize, 0):
+            self._programs.popitem(last=False)
+
+    def _path(self, key):
+        """Get the path of the on disk entry for the key."""
+        return os.path.join(self.directory,
+                            '{}.v{}.pickle'.format(key, self.FORMAT))
+
+    def _load(self, key):
+        """Load a program from the cache directory, if there is one."""
+        if self.directory is None:
+            return None
+
+        try:
+            with open(self._path(key), 'rb') as f:
+                program = pickle.load(f)
+        except Exception:
+            return None
+        if not isinstance(program, SpaceProgram):
+            return None
+
+        with self._lock:
+            self.disk_hits += 1
+        return program
+
+    def _dump(self, key, program):
+        """Write a program to the cache directory, if there is one.
+
+        Failing to write is not an error, the program is only kept in memory.
+        """
+        if self.directory is None:
+            return
+
+        try:
+            if not os.path.isdir(self.directory):
+                os.makedirs(self.directory)
+            fd, temp = tempfile.mkstemp(dir=self.directory)
+        except (IOError, OSError):
+            return
+
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                pickle.dump(program, f, pickle.HIGHEST_PROTOCOL)
+            getattr(os, 'replace', os.rename)(temp, self._path(key))
+        except (IOError, OSError):
+            os.remove(temp)
+
+
+program_cache = ProgramCache()
+
+
+def _interpret(program, pc, calls, stack, heap, read_char, read_line,
+               output, sink, limit, max_stack, max_heap, max_calls, guarded,
+               counts=None, trace=None, peaks=None):
+    """Run the instructions of a program one at a time.
+
+    pc is the index of the first instruction and calls holds the return
+    indexes of the subroutines being run, which is updated in place.
+
+    If counts is given, one is added to the count of each instruction
+    run. If trace is given, it is called with the same events as by the
+    traced Python function. If peaks is given, peaks[0] is raised to the
+    size of the stack before every instruction.
+
+    Returns: the index execution stopped at, the number of instructions
+             run, whether the program exited and the name of the limit
+             that stopped it, if any
+    """
+    instructions = program.instructions
+    start = pc
+    steps = 0
+
+    push = stack.append
+    pop = stack.pop
+    write = output.append
+    hooked = counts is not None or trace is not None or peaks is not None
+
+    while True:
+        op, arg = instructions[pc]
+        if hooked:
+            if counts is not None and op != 'eof':
+                counts[pc] += 1
+            if peaks is not None and len(stack) > peaks[0]:
+                peaks[0] = len(stack)
+            if trace is not None and op != 'eof':
+                trace(pc, 'instruction', None)
+        pc += 1
+
+        if op == 'push':
+            push(arg)
+
+        elif op == 'addi':
+            try:
+                stack[-1] += arg
+            except IndexError:
+                raise IndexError('Not enough values in stack for operation.')
+
+        elif op == 'subi':
+            try:
+                stack[-1] -= arg
+            except IndexError:
+                raise IndexError('Not enough values in stack for operation.')
+
+        elif op == 'add':
+            try:
+                a = pop()
+                stack[-1] += a
+            except IndexError:
+                raise IndexError('Not enough values in stack for operation.')
+
+        elif op == 'sub':
+            try:
+                a = pop()
+                stack[-1] -= a
+            except IndexError:
+                raise IndexError('Not enough values in stack for operation.')
+
+        elif op == 'dup':
+            if not stack:
+                raise IndexError('Cannot duplicate from empty stack.')
+            push(stack[-1])
+
+        elif op == 'jz':
+            if pop() == 0:
+                if arg is None:
+                    raise NameError('Label is not defined.')
+                if trace is not None:
+                    trace(pc - 1, 'jump', arg)
+                steps += pc - start
+                pc = start = arg
+                if steps >= limit or guarded and (
+                        len(stack) > max_stack or len(heap) > max_heap):
+                    return pc, steps, False, None
+
+        elif op == 'jn':
+            if pop() < 0:
+                if arg is None:
+                    raise NameError('Label is not defined.')
+                if trace is not None:
+                    trace(pc - 1, 'jump', arg)
+                steps += pc - start
+                pc = start = arg
+                if steps >= limit or guarded and (
+                        len(stack) > max_stack or len(heap) > max_heap):
+                    return pc, steps, False, None
+
+        elif op == 'jump':
+            if arg is None:
+                raise NameError('Label is not defined.')
+            if trace is not None:
+                trace(pc - 1, 'jump', arg)
+            steps += pc - start
+            pc = start = arg
+            if steps >= limit or guarded and (
+                    len(stack) > max_stack or len(heap) > max_heap):
+                return pc, steps, False, None
+
+        elif op == 'dupjz':
+            if not stack:
+                raise IndexError('Cannot duplicate from empty stack.')
+            if stack[-1] == 0:
+                if arg is None:
+                    raise NameError('Label is not defined.')
+                if trace is not None:
+                    trace(pc - 1, 'jump', arg)
+                steps += pc - start
+                pc = start = arg
+                if steps >= limit or guarded and (
+                        len(stack) > max_stack or len(heap) > max_heap):
+                    return pc, steps, False, None
+
+        elif op == 'dupjn':
+            if not stack:
+                raise IndexError('Cannot duplicate from empty stack.')
+            if stack[-1] < 0:
+                if arg is None:
+                    raise NameError('Label is not defined.')
+                if trace is not None:
+                    trace(pc - 1, 'jump', arg)
+                steps += pc - start
+                pc = start = arg
+                if steps >= limit or guarded and (
+                        len(stack) > max_stack or len(heap) > max_heap):
+                    return pc, steps, False, None
+
+        elif op == 'load':
+            try:
+                push(heap[arg])
+            except KeyError:
+                raise NameError('Invalid heap address.')
+
+        elif op == 'store':
+            try:
+                value = pop()
+                heap[pop()] = value
+            except IndexError:
+                raise IndexError('Not enough values in stack for heap operation.')
+
+        elif op == 'retrieve':
+            try:
+                push(heap[pop()])
+            except IndexError:
+                raise IndexError('Not enough values in stack for heap operation.')
+            except KeyError:
+                raise NameError('Invalid heap address.')
+
+        elif op == 'muli':
+            try:
+                stack[-1] *= arg
+            except IndexError:
+                raise IndexError('Not enough values in stack for operation.')
+
+        elif op == 'mul':
+            try:
+                a = pop()
+                stack[-1] *= a
+            except IndexError:
+                raise IndexError('Not enough values in stack for operation.')
+
+        elif op == 'divi' or op == 'modi':
+            try:
+                stack[-1] = _ARITHMETIC[op](stack[-1], arg)
+            except IndexError:
+                raise IndexError('Not enough values in stack for operation.')
 
-        # All commands #
+        elif op == 'div' or op == 'mod':
+            try:
+                a = pop()
+                stack[-1] = _ARITHMETIC[op](stack[-1], a)
+            except IndexError:
+                raise IndexError('Not enough values in stack for operation.')
+            except ZeroDivisionError:
+                raise ZeroDivisionError('Cannot divide by zero.')
+
+        elif op == 'swap':
+            if len(stack) < 2:
+                raise IndexError('Not enough values in stack to swap.')
+            stack[-1], stack[-2] = stack[-2], stack[-1]
+
+        elif op == 'drop':
+            if not stack:
+                raise IndexError('Cannot discard from empty stack.')
+            pop()
+
+        elif op == 'copy':
+            if not stack:
+                raise IndexError('Cannot duplicate from empty stack.')
+            if arg < 0 or arg > len(stack):
+                raise IndexError('Duplication value is outside of stack.')
+            push(stack[-(arg + 1)])
+
+        elif op == 'slide':
+            n = arg if 0 <= arg < len(stack) else len(stack) - 1
+            if n > 0:
+                del stack[-(n + 1):-1]
+
+        elif op == 'call':
+            if arg is None:
+                raise NameError('Label is not defined.')
+            if len(calls) >= max_calls:
+                pc -= 1
+                return pc, steps + pc - start, False, 'call_limit'
+            calls.append(pc)
+            if trace is not None:
+                trace(pc - 1, 'call', arg)
+            steps += pc - start
+            pc = start = arg
+            if steps >= limit or guarded and (
+                    len(stack) > max_stack or len(heap) > max_heap):
+                return pc, steps, False, None
+
+        elif op == 'ret':
+            if not calls:
+                raise SyntaxError('Cannot exit subroutine outside of subroutine.')
+            if trace is not None:
+                trace(pc - 1, 'return', calls[-1])
+            steps += pc - start
+            pc = start = calls.pop()
+            if steps >= limit or guarded and (
+                    len(stack) > max_stack or len(heap) > max_heap):
+                return pc, steps, False, None
+
+        elif op == 'outc':
+            try:
+                text = chr(pop())
+            except IndexError:
+                raise IndexError('No values in stack to output.')
+            if trace is not None:
+                trace(pc - 1, 'output', text)
+            write(text)
+            if len(output) >= 4096:
+                sink(''.join(output))
+                del output[:]
+
+        elif op == 'outn':
+            try:
+                text = _number_string(pop())
+            except IndexError:
+                raise IndexError('No values in stack to output.')
+            if trace is not None:
+                trace(pc - 1, 'output', text)
+            write(text)
+            if len(output) >= 4096:
+                sink(''.join(output))
+                del output[:]
+
+        elif op == 'inc':
+            char = read_char()
+            if trace is not None:
+                trace(pc - 1, 'input', char)
+            try:
+                heap[pop()] = ord(char)
+            except IndexError:
+                raise IndexError('Not enough values in stack to acess heap')
+
+        elif op == 'inn':
+            try:
+                num = _parse_number(read_line())
+            except ValueError:
+                raise ValueError('Cannot parse input as a number.')
+            if trace is not None:
+                trace(pc - 1, 'input', num)
+            try:
+                heap[pop()] = num
+            except IndexError:
+                raise IndexError('Not enough values in stack to acess heap')
+
+        elif op == 'end':
+            return pc, steps + pc - start, True, None
+
+        else:
+            pc -= 1
+            raise SyntaxError('Code must terminate with an exit command.')
+
+
+def _fault_state(tb, program, pc):
+    """Find where an engine was when it raised an exception.
+
+    Engines only keep their position in local variables, so they are read
+    from the engine's frame in the traceback. The interpreter's pc is
+    used directly while the Python function's and basic blocks' pc comes
+    from the line that raised.
+
+    Returns: the index execution stopped at, the number of instructions run
+    """
+    while tb is not None:
+        code = tb.tb_frame.f_code
+        if code is _interpret.__code__:
+            local = tb.tb_frame.f_locals
+            return local['pc'], local['steps'] + local['pc'] - local['start']
+        if code is _run_blocks.__code__:
+            local = tb.tb_frame.f_locals
+            block = local['block']
+            pc = block.start
+            inner = tb.tb_next
+            while inner is not None:
+                if (block.function is not None and
+                        inner.tb_frame.f_code is block.function.__code__):
+                    pc = block.line_pcs.get(inner.tb_lineno, pc)
+                    break
+                inner = inner.tb_next
+            return pc, local['steps'] + pc - block.start
+        for function in (program._function, program._profile_function,
+                         program._trace_function, program._track_function):
+            if (function is not None and code is function.__code__ and
+                    'steps' in tb.tb_frame.f_locals):
+                local = tb.tb_frame.f_locals
+                pc = function.line_pcs.get(tb.tb_lineno, local['pc'])
+                return pc, local['steps'] + pc - local['start']
+        tb = tb.tb_next
+    return pc, 0
+
+
+# Python source for each instruction when transpiling. {i} is the index of
+# the instruction, {next} the one after it and {arg} its parameter.
+_STACK_ERROR = "raise IndexError('Not enough values in stack for operation.')"
+
+_PYTHON_TEMPLATES = {
+    'push': ['push({arg})'],
+    'dup': ['if not stack:',
+            "    raise IndexError('Cannot duplicate from empty stack.')",
+            'push(stack[-1])'],
+    'copy': ['if not stack:',
+             "    raise IndexError('Cannot duplicate from empty stack.')",
+             'if {arg} < 0 or {arg} > len(stack):',
+             "    raise IndexError('Duplication value is outside of stack.')",
+             'push(stack[-({arg} + 1)])'],
+    'slide': ['n = {arg} if 0 <= {arg} < len(stack) else len(stack) - 1',
+              'if n > 0:',
+              '    del stack[-(n + 1):-1]'],
+    'swap': ['if len(stack) < 2:',
+             "    raise IndexError('Not enough values in stack to swap.')",
+             'stack[-1], stack[-2] = stack[-2], stack[-1]'],
+    'drop': ['if not stack:',
+             "    raise IndexError('Cannot discard from empty stack.')",
+             'pop()'],
+    'add': ['try:', '    a = pop()', '    stack[-1] += a',
+            'except IndexError:', '    ' + _STACK_ERROR],
+    'sub': ['try:', '    a = pop()', '    stack[-1] -= a',
+            'except IndexError:', '    ' + _STACK_ERROR],
+    'mul': ['try:', '    a = pop()', '    stack[-1] *= a',
+            'except IndexError:', '    ' + _STACK_ERROR],
+    'div': ['try:', '    a = pop()', '    stack[-1] //= a',
+            'except IndexError:', '    ' + _STACK_ERROR,
+            'except ZeroDivisionError:',
+            "    raise ZeroDivisionError('Cannot divide by zero.')"],
+    'mod': ['try:', '    a = pop()', '    stack[-1] %= a',
+            'except IndexError:', '    ' + _STACK_ERROR,
+            'except ZeroDivisionError:',
+            "    raise ZeroDivisionError('Cannot divide by zero.')"],
+    'addi': ['try:', '    stack[-1] += {arg}',
+             'except IndexError:', '    ' + _STACK_ERROR],
+    'subi': ['try:', '    stack[-1] -= {arg}',
+             'except IndexError:', '    ' + _STACK_ERROR],
+    'muli': ['try:', '    stack[-1] *= {arg}',
+             'except IndexError:', '    ' + _STACK_ERROR],
+    'divi': ['try:', '    stack[-1] //= {arg}',
+             'except IndexError:', '    ' + _STACK_ERROR],
+    'modi': ['try:', '    stack[-1] %= {arg}',
+             'except IndexError:', '    ' + _STACK_ERROR],
+    'load': ['try:', '    push(heap[{arg}])',
+             'except KeyError:', "    raise NameError('Invalid heap address.')"],
+    'store': ['try:', '    value = pop()', '    heap[pop()] = value',
+              'except IndexError:',
+              "    raise IndexError('Not enough values in stack for heap operation.')"],
+    'retrieve': ['try:', '    push(heap[pop()])',
+                 'except IndexError:',
+                 "    raise IndexError('Not enough values in stack for heap operation.')",
+                 'except KeyError:', "    raise NameError('Invalid heap address.')"],
+    'outc': ['try:', '    write(chr(pop()))',
+             'except IndexError:', "    raise IndexError('No values in stack to output.')",
+             'if len(output) >= 4096:', "    sink(''.join(output))", '    del output[:]'],
+    'outn': ['try:', '    write(_number_string(pop()))',
+             'except IndexError:', "    raise IndexError('No values in stack to output.')",
+             'if len(output) >= 4096:', "    sink(''.join(output))", '    del output[:]'],
+    'inc': ['char = read_char()',
+            'try:', '    heap[pop()] = ord(char)',
+            'except IndexError:',
+            "    raise IndexError('Not enough values in stack to acess heap')"],
+    'inn': ['try:', '    num = _parse_number(read_line())',
+            'except ValueError:', "    raise ValueError('Cannot parse input as a number.')",
+            'try:', '    heap[pop()] = num',
+            'except IndexError:',
+            "    raise IndexError('Not enough values in stack to acess heap')"],
+    'end': ['return {next}, steps + {next} - start, True, None'],
+    'eof': ["raise SyntaxError('Code must terminate with an exit command.')"]
+}
+
+# Templates of instructions analyze has proven to have the values they
+# need on the stack, without checking for them.
+_PYTHON_UNCHECKED = {
+    'dup': ['push(stack[-1])'],
+    'copy': ['push(stack[-({arg} + 1)])'],
+    'swap': ['stack[-1], stack[-2] = stack[-2], stack[-1]'],
+    'drop': ['pop()']
+}
+
+_PYTHON_UNCHECKED_CONDITIONS = {
+    'dupjz': ['if stack[-1] == 0:'],
+    'dupjn': ['if stack[-1] < 0:']
+}
+
+# Templates of instructions with I/O when tracing, which pass what they
+# read or write to trace.
+_PYTHON_TRACED = {
+    'outc': ['try:', '    text = chr(pop())',
+             'except IndexError:', "    raise IndexError('No values in stack to output.')",
+             "trace({i}, 'output', text)", 'write(text)',
+             'if len(output) >= 4096:', "    sink(''.join(output))", '    del output[:]'],
+    'outn': ['try:', '    text = _number_string(pop())',
+             'except IndexError:', "    raise IndexError('No values in stack to output.')",
+             "trace({i}, 'output', text)", 'write(text)',
+             'if len(output) >= 4096:', "    sink(''.join(output))", '    del output[:]'],
+    'inc': ['char = read_char()',
+            "trace({i}, 'input', char)",
+            'try:', '    heap[pop()] = ord(char)',
+            'except IndexError:',
+            "    raise IndexError('Not enough values in stack to acess heap')"],
+    'inn': ['try:', '    num = _parse_number(read_line())',
+            'except ValueError:', "    raise ValueError('Cannot parse input as a number.')",
+            "trace({i}, 'input', num)",
+            'try:', '    heap[pop()] = num',
+            'except IndexError:',
+            "    raise IndexError('Not enough values in stack to acess heap')"]
+}
+
+_PYTHON_TRANSFER = [
+    'steps += {next} - start',
+    'pc = start = {target}',
+    'if steps >= limit or guarded and (',
+    '        len(stack) > max_stack or len(heap) > max_heap):',
+    '    return pc, steps, False, None',
+    'continue'
+]
+
+_PYTHON_CONDITIONS = {
+    'jz': ['if pop() == 0:'],
+    'jn': ['if pop() < 0:'],
+    'dupjz': ['if not stack:',
+              "    raise IndexError('Cannot duplicate from empty stack.')",
+              'if stack[-1] == 0:'],
+    'dupjn': ['if not stack:',
+              "    raise IndexError('Cannot duplicate from empty stack.')",
+              'if stack[-1] < 0:']
+}
+
+
+def transpile(program, profile=False, trace=False, safe=frozenset(), track=False):
+    """Translate a compiled program into the source of a Python function.
+
+    Every index that can be jumped, called or returned to, along with
+    every call, starts a block of straight line code. The function loops
+    over a binary search of the blocks on pc, so jumps only set pc and
+    continue. It takes the same arguments and behaves the same as the
+    interpreter loop.
+
+    If profile is True, the function also takes a counts list and adds
+    one to the count of each instruction it runs.
+
+    If trace is True, the function also takes a trace function, called
+    as trace(index, event, arg) with the 'instruction' event before each
+    instruction and 'call', 'return', 'jump', 'input' and 'output' events
+    as they happen. Every instruction starts a block, so the function
+    can be entered at any of them.
+
+    If track is True, the function also takes a peaks list and raises
+    peaks[0] to the size of the stack wherever it is higher than before
+    in the block. Blocks are entered with no more values than were last
+    recorded, so peaks[0] ends up the largest stack of the run.
+
+    Instructions whose indexes are in safe, proven by analyze to always
+    have the values they need, do not check the stack first.
+
+    Returns: the source, a map from each line of the source to the pc
+             the interpreter would have on an error raised there, and
+             the block entry indexes
+    """
+    instructions = program.instructions
+    entries = set(range(len(instructions)) if trace else [0])
+    for i, (mnemonic, param) in enumerate(instructions):
+        if mnemonic in _JUMPS and param is not None:
+            entries.add(param)
+        if mnemonic == 'call':
+            entries.update([i, i + 1])
+    entries = sorted(entries)
+
+    lines = [
+        'def run(program, pc, calls, stack, heap, read_char, read_line,',
+        '        output, sink, limit, max_stack, max_heap, max_calls, guarded,',
+        '        counts=None, trace=None, peaks=None):',
+        '    push = stack.append',
+        '    pop = stack.pop',
+        '    write = output.append',
+        '    start = pc',
+        '    steps = 0',
+        '    while True:'
+    ]
+    line_pcs = {}
+
+    def emit(source, indent, pc=None):
+        for line in source:
+            lines.append(' ' * indent + line)
+            if pc is not None:
+                line_pcs[len(lines)] = pc
+
+    def emit_block(entry, stop, indent):
+        # Values on the stack above those at the entry, and the most so far.
+        height = highest = 0
+        i = entry
+        while i < stop:
+            mnemonic, param = instructions[i]
+            values = {'i': i, 'next': i + 1}
+            target = None
+            if mnemonic in _JUMPS:
+                target = 'None' if param is None else str(param)
+            elif param is not None:
+                values['arg'] = hex(param)
+            if profile and mnemonic != 'eof':
+                emit(['counts[{}] += 1'.format(i)], indent, i)
+            if trace and mnemonic != 'eof':
+                emit(["trace({}, 'instruction', None)".format(i)], indent, i)
+
+            if trace and mnemonic in _PYTHON_TRACED:
+                emit([line.format(**values) for line in _PYTHON_TRACED[mnemonic]],
+                     indent, i + 1)
+
+            elif i in safe and mnemonic in _PYTHON_UNCHECKED:
+                emit([line.format(**values) for line in _PYTHON_UNCHECKED[mnemonic]],
+                     indent, i + 1)
+
+            elif mnemonic in _PYTHON_TEMPLATES:
+                source = [line.format(**values)
+                          for line in _PYTHON_TEMPLATES[mnemonic]]
+                emit(source, indent, i if mnemonic == 'eof' else i + 1)
+                if mnemonic in ('end', 'eof'):
+                    return
+
+            elif mnemonic == 'jump':
+                if param is None:
+                    emit(["raise NameError('Label is not defined.')"], indent, i + 1)
+                    return
+                if trace:
+                    emit(["trace({}, 'jump', {})".format(i, target)], indent, i + 1)
+                emit([line.format(next=i + 1, target=target)
+                      for line in _PYTHON_TRANSFER], indent, i + 1)
+                return
+
+            elif mnemonic == 'call':
+                if param is None:
+                    emit(["raise NameError('Label is not defined.')"], indent, i + 1)
+                    return
+                emit(['if len(calls) >= max_calls:',
+                      "    return {0}, steps + {0} - start, False, 'call_limit'".format(i),
+                      'calls.append({})'.format(i + 1)], indent, i + 1)
+                if trace:
+                    emit(["trace({}, 'call', {})".format(i, target)], indent, i + 1)
+                emit([line.format(next=i + 1, target=target)
+                      for line in _PYTHON_TRANSFER], indent, i + 1)
+                return
+
+            elif mnemonic == 'ret':
+                emit(['if not calls:',
+                      "    raise SyntaxError('Cannot exit subroutine outside of subroutine.')"],
+                     indent, i + 1)
+                if trace:
+                    emit(["trace({}, 'return', calls[-1])".format(i)], indent, i + 1)
+                emit([line.format(next=i + 1, target='calls.pop()')
+                      for line in _PYTHON_TRANSFER], indent, i + 1)
+                return
+
+            else:
+                conditions = _PYTHON_CONDITIONS
+                if i in safe and mnemonic in _PYTHON_UNCHECKED_CONDITIONS:
+                    conditions = _PYTHON_UNCHECKED_CONDITIONS
+                emit(conditions[mnemonic], indent, i + 1)
+                if param is None:
+                    emit(["    raise NameError('Label is not defined.')"], indent, i + 1)
+                else:
+                    if trace:
+                        emit(["    trace({}, 'jump', {})".format(i, target)], indent, i + 1)
+                    emit(['    ' + line.format(next=i + 1, target=target)
+                          for line in _PYTHON_TRANSFER], indent, i + 1)
+
+            if track:
+                if mnemonic == 'slide':
+                    height = highest = 0
+                else:
+                    height += 1 if mnemonic == 'copy' else _STACK_EFFECTS[mnemonic][1]
+                    if height > highest:
+                        highest = height
+                        emit(['if len(stack) > peaks[0]:',
+                              '    peaks[0] = len(stack)'], indent, i + 1)
+
+            i += 1
+
+        emit(['pc = {}'.format(stop), 'continue'], indent, stop)
+
+    def emit_dispatch(low, high, indent):
+        if high - low == 1:
+            stop = entries[high] if high < len(entries) else len(instructions)
+            emit_block(entries[low], stop, indent)
+            return
+        middle = (low + high) // 2
+        emit(['if pc < {}:'.format(entries[middle])], indent)
+        emit_dispatch(low, middle, indent + 4)
+        emit(['else:'], indent)
+        emit_dispatch(middle, high, indent + 4)
+
+    emit_dispatch(0, len(entries), 8)
+    return '\n'.join(lines) + '\n', line_pcs, frozenset(entries)
+
+
+# Returned by a block when a call would go over the call limit.
+_CALL_LIMIT = object()
+
+
+class BasicBlock(object):
+    """A run of instructions only entered at its start and left at its end.
+
+    start and stop are the indexes of its first instruction and the one
+    after its last. target is the block its last instruction jumps or
+    calls to, if any, and fall the block it runs on into otherwise.
+
+    run executes the whole block and returns the next block to run, None
+    after an exit or _CALL_LIMIT if a call would go over the limit. It is
+    compiled into a Python closure over target and fall the first time
+    the block runs. line_pcs maps each line of it to the pc the
+    interpreter would have on an error raised there.
+
+    transfers is True if the block ends in a jump, call or ret, which
+    like jumps taken by a condition are where limits are checked.
+    """
+
+    __slots__ = ('program', 'start', 'stop', 'target', 'fall', 'transfers',
+                 'safe', 'function', 'line_pcs', 'run')
+
+    def __init__(self, program, start, stop, safe):
+        """Create the block of the program's instructions start to stop."""
+        self.program = program
+        self.start = start
+        self.stop = stop
+        self.target = None
+        self.fall = None
+        self.transfers = False
+        self.safe = safe
+        self.function = None
+        self.line_pcs = None
+        self.run = self._compile
+
+    def __len__(self):
+        """Get the number of instructions in the block."""
+        return self.stop - self.start
+
+    def _compile(self, *args):
+        """Compile the block, then run it."""
+        source, self.line_pcs = _block_source(self.program, self.start, self.stop,
+                                              self.safe)
+        namespace = {'_number_string': _number_string,
+                     '_parse_number': _parse_number,
+                     '_CALL_LIMIT': _CALL_LIMIT}
+        exec(compile(source, '<whitespace block>', 'exec'), namespace)
+        self.function = self.run = namespace['make'](self.target, self.fall,
+                                                     self.program.block_at)
+        return self.run(*args)
+
+
+def basic_blocks(program):
+    """Split a compiled program into its control flow graph of blocks.
+
+    A block starts at the first instruction, at every jump and call
+    target and after every jump, call, ret and exit. The last
+    instruction of each block holds a direct reference to its target.
+
+    Returns: the list of blocks in order, and a list of the block
+             starting at each index, or None for indexes within a block
+    """
+    instructions = program.instructions
+    leaders = set([0])
+    for i, (mnemonic, param) in enumerate(instructions):
+        if mnemonic in _JUMPS or mnemonic in ('ret', 'end'):
+            leaders.add(i + 1)
+            if param is not None:
+                leaders.add(param)
+    leaders = sorted(leader for leader in leaders if leader < len(instructions))
+
+    safe = analyze(program).safe
+    block_at = [None] * len(instructions)
+    blocks = []
+    for start, stop in zip(leaders, leaders[1:] + [len(instructions)]):
+        block_at[start] = BasicBlock(program, start, stop, safe)
+        blocks.append(block_at[start])
+
+    for block in blocks:
+        mnemonic, param = instructions[block.stop - 1]
+        if mnemonic in _JUMPS and param is not None:
+            block.target = block_at[param]
+        block.transfers = mnemonic in ('jump', 'call', 'ret')
+        if block.stop < len(instructions):
+            block.fall = block_at[block.stop]
+    return blocks, block_at
+
+
+def _block_source(program, start, stop, safe):
+    """Write the Python source of a block of the program.
+
+    The source defines make(target, fall, block_at), returning the block
+    as a closure. Calls push the index they return to, which ret looks
+    up in block_at.
+
+    Returns: the source, and a map from each of its lines to the pc the
+             interpreter would have on an error raised there
+    """
+    instructions = program.instructions
+    lines = []
+    line_pcs = {}
+
+    def emit(source, pc, indent=8):
+        for line in source:
+            lines.append(' ' * indent + line)
+            line_pcs[len(lines)] = pc
+
+    for i in range(start, stop):
+        mnemonic, param = instructions[i]
+        values = {'i': i, 'next': i + 1}
+        if param is not None and mnemonic not in _JUMPS:
+            values['arg'] = hex(param)
+
+        if i in safe and mnemonic in _PYTHON_UNCHECKED:
+            emit([line.format(**values) for line in _PYTHON_UNCHECKED[mnemonic]], i + 1)
+        elif mnemonic == 'end':
+            emit(['return None'], i + 1)
+        elif mnemonic in _PYTHON_TEMPLATES:
+            emit([line.format(**values) for line in _PYTHON_TEMPLATES[mnemonic]],
+                 i if mnemonic == 'eof' else i + 1)
+        elif mnemonic in ('jump', 'call') and param is None:
+            emit(["raise NameError('Label is not defined.')"], i + 1)
+        elif mnemonic == 'jump':
+            emit(['return target'], i + 1)
+        elif mnemonic == 'call':
+            emit(['if len(calls) >= max_calls:', '    return _CALL_LIMIT',
+                  'calls.append({})'.format(i + 1), 'return target'], i + 1)
+        elif mnemonic == 'ret':
+            emit(['if not calls:',
+                  "    raise SyntaxError('Cannot exit subroutine outside of subroutine.')",
+                  'return block_at[calls.pop()]'], i + 1)
+        else:
+            conditions = _PYTHON_CONDITIONS
+            if i in safe and mnemonic in _PYTHON_UNCHECKED_CONDITIONS:
+                conditions = _PYTHON_UNCHECKED_CONDITIONS
+            emit(conditions[mnemonic], i + 1)
+            emit(["    raise NameError('Label is not defined.')" if param is None
+                  else '    return target'], i + 1)
+
+    if mnemonic not in ('jump', 'call', 'ret', 'end', 'eof'):
+        emit(['return fall'], stop)
+
+    # Blocks are often only a few instructions, so only the aliases they
+    # use are bound.
+    body = '\n'.join(lines)
+    header = ['def make(target, fall, block_at):',
+              '    def run(stack, heap, calls, read_char, read_line, output, sink,',
+              '            max_calls):']
+    for alias, method in (('push', 'stack.append'), ('pop', 'stack.pop'),
+                          ('write', 'output.append')):
+        if alias + '(' in body:
+            header.append('        {} = {}'.format(alias, method))
+    line_pcs = dict((line + len(header), pc) for line, pc in line_pcs.items())
+    return '\n'.join(header + lines + ['    return run']) + '\n', line_pcs
+
+
+def _run_blocks(program, pc, calls, stack, heap, read_char, read_line, output,
+                sink, limit, max_stack, max_heap, max_calls, guarded):
+    """Run a compiled program a basic block at a time from a block start.
+
+    Takes the same arguments and behaves the same as the interpreter
+    loop. Each block returns the next one to run, so there is no lookup
+    of pc at all between blocks.
+    """
+    block = program.block_at[pc]
+    steps = 0
+    while True:
+        following = block.run(stack, heap, calls, read_char, read_line, output,
+                              sink, max_calls)
+        steps += block.stop - block.start
+        if following is None:
+            return block.stop, steps, True, None
+        if following is _CALL_LIMIT:
+            return block.stop - 1, steps - 1, False, 'call_limit'
+        if (block.transfers or following is block.target) and (
+                steps >= limit or guarded and (
+                    len(stack) > max_stack or len(heap) > max_heap)):
+            return following.start, steps, False, None
+        block = following
+
+
+# Values each instruction needs on the stack, and how many it adds or
+# removes. copy and slide depend on their parameter.
+_STACK_EFFECTS = {
+    'push': (0, 1), 'dup': (1, 1), 'swap': (2, 0), 'drop': (1, -1),
+    'add': (2, -1), 'sub': (2, -1), 'mul': (2, -1), 'div': (2, -1), 'mod': (2, -1),
+    'addi': (1, 0), 'subi': (1, 0), 'muli': (1, 0), 'divi': (1, 0), 'modi': (1, 0),
+    'load': (0, 1), 'store': (2, -2), 'retrieve': (1, 0),
+    'outc': (1, -1), 'outn': (1, -1), 'inc': (1, -1), 'inn': (1, -1),
+    'jz': (1, -1), 'jn': (1, -1), 'dupjz': (1, 0), 'dupjn': (1, 0),
+    'call': (0, 0), 'jump': (0, 0), 'ret': (0, 0), 'end': (0, 0), 'eof': (0, 0)
+}
+
+# Times the most values on the stack before an instruction can grow before
+# it is taken to be unbounded, so loops pushing values are analyzed quickly.
+_WIDEN_AFTER = 3
+
+# What analyze found out about a program. depths[i] is the (least, most)
+# values on the stack before the i-th instruction, most None if unbounded,
+# or None if the instruction is never run. safe is the set of indexes of
+# instructions that always have the values they need.
+Analysis = namedtuple('Analysis', 'depths safe problems')
+
+# A problem found by analyze. kind is 'underflow', 'undefined label',
+# 'unreachable' or 'missing exit' and position an offset of the code.
+Problem = namedtuple('Problem', 'kind position message')
+
+
+def analyze(code):
+    """Find problems in a program before running it.
+
+    The values on the stack before every instruction are bounded by
+    abstract interpretation over the control flow graph, from an empty
+    stack at the start. Any ret may return after any call. Reported are
+    instructions that can never have the values they need, jumps and
+    calls to labels that are not defined, code that is never run and
+    running off the end of the code.
+
+    code may be a compiled SpaceProgram, or anything SpaceInterpreter
+    takes, which is analyzed without the optimizer so every instruction
+    is seen.
+
+    Returns: an Analysis, with problems in the order of their position
+    """
+    program = code
+    if not isinstance(code, SpaceProgram):
+        program = program_cache.get(_clean(code), optimize=False)
+    instructions = program.instructions
+    returns = [i + 1 for i, (mnemonic, _) in enumerate(instructions) if mnemonic == 'call']
+
+    depths = [None] * len(instructions)
+    growths = [0] * len(instructions)
+    depths[0] = (0, 0)
+    pending = [0]
+
+    while pending:
+        i = pending.pop()
+        mnemonic, param = instructions[i]
+        low, high = depths[i]
+        need, after = _stack_effect(mnemonic, param, low, high)
+        if need is None or high is not None and high < need:
+            continue
+
+        if mnemonic in ('end', 'eof'):
+            successors = []
+        elif mnemonic == 'ret':
+            successors = returns
+        elif mnemonic in ('call', 'jump'):
+            successors = [] if param is None else [param]
+        elif mnemonic in _JUMPS:
+            successors = [i + 1] if param is None else [i + 1, param]
+        else:
+            successors = [i + 1]
+
+        for j in successors:
+            current = depths[j]
+            if current is None:
+                depths[j] = after
+                pending.append(j)
+                continue
+            joined = (min(current[0], after[0]),
+                      None if current[1] is None or after[1] is None
+                      else max(current[1], after[1]))
+            if joined == current:
+                continue
+            if joined[1] != current[1]:
+                growths[j] += 1
+                if growths[j] > _WIDEN_AFTER:
+                    joined = (joined[0], None)
+            depths[j] = joined
+            pending.append(j)
+
+    safe = set()
+    underflows = set()
+    for i, depth in enumerate(depths):
+        if depth is not None:
+            need = _stack_effect(instructions[i][0], instructions[i][1], *depth)[0]
+            if need is None or depth[1] is not None and depth[1] < need:
+                underflows.add(i)
+            elif depth[0] >= need:
+                safe.add(i)
+    return Analysis(depths, frozenset(safe), _problems(program, depths, underflows))
+
+
+def _stack_effect(mnemonic, param, low, high):
+    """Get the values an instruction needs on the stack and the bounds
+    on the stack after it, from the bounds before it.
+
+    Returns: the values needed, None if the instruction always fails, and
+             the (least, most) values after it
+    """
+    if mnemonic == 'copy':
+        if param < 0:
+            return None, (low, high)
+        need, change = param + 1, 1
+    elif mnemonic == 'slide':
+        def slide(depth):
+            return depth - param if 0 <= param < depth else min(depth, 1)
+        return 0, (slide(low), None if high is None else slide(high))
+    else:
+        need, change = _STACK_EFFECTS[mnemonic]
+    return need, (max(low, need) + change, None if high is None else high + change)
+
+
+def _problems(program, depths, underflows):
+    """List the problems found analyzing a program, in order of position."""
+    instructions = program.instructions
+    positions = program.positions
+    problems = []
+    for i, (mnemonic, param) in enumerate(instructions):
+        position = positions[i]
+        if i in underflows:
+            if mnemonic == 'copy' and param < 0:
+                message = 'Duplication value is outside of stack.'
+            else:
+                message = 'Not enough values in stack for {}: at most {}, needs {}.'.format(
+                    mnemonic, depths[i][1], _stack_effect(mnemonic, param, 0, 0)[0])
+            problems.append(Problem('underflow', position, message))
+        if mnemonic in _JUMPS and param is None:
+            problems.append(Problem('undefined label', position, 'Label is not defined.'))
+        if mnemonic == 'eof':
+            if depths[i] is not None:
+                problems.append(Problem('missing exit', position,
+                                        'Code must terminate with an exit command.'))
+        elif depths[i] is None and (i == 0 or depths[i - 1] is not None):
+            problems.append(Problem('unreachable', position, 'Code is never run.'))
+    return problems
+
+
+def visible(code):
+    """Write WhiteSpace code with s, t and n in place of its characters."""
+    return code.replace(' ', 's').replace('\t', 't').replace('\n', 'n')
+
+
+def disassemble(code):
+    """Turn WhiteSpace code into a listing with one instruction a line.
+
+    Numbers are written in decimal, or as 0b followed by their exact
+    binary digits if they are not written the way assemble would write
+    them, e.g. with leading zeros. Labels are written as a dot followed
+    by their characters as s and t, so the empty label is a lone dot.
+    """
+    code = _clean(code)
+    lines = []
+    for position, mnemonic, param, end in tokenize(code):
+        encoding, kind = _ENCODINGS[mnemonic]
+        raw = code[position + len(encoding):end - 1]
+        if kind == 'num':
+            if _encode_number(param) == raw + '\n':
+                lines.append('{} {}'.format(mnemonic, _number_string(param)))
+            else:
+                lines.append('{} {}0b{}'.format(
+                    mnemonic, '-' if raw[0] == '\t' else '',
+                    raw[1:].replace(' ', '0').replace('\t', '1')))
+        elif kind == 'label':
+            lines.append('{} .{}'.format(mnemonic, raw.replace(' ', 's').replace('\t', 't')))
+        else:
+            lines.append(mnemonic)
+    return '\n'.join(lines) + '\n' if lines else ''
+
+
+def assemble(listing):
+    """Turn a listing of mnemonics back into WhiteSpace code.
+
+    Listings are as written by disassemble. Anything after a semicolon
+    is a comment and blank lines are skipped. Labels may also be given
+    names, which are replaced with the shortest labels not already used.
+
+    Raises SyntaxError for lines that cannot be assembled.
+    """
+    instructions = []
+    used = set()
+    for number, line in enumerate(listing.splitlines(), 1):
+        parts = line.split(';', 1)[0].split()
+        if not parts:
+            continue
+
+        mnemonic, operands = parts[0], parts[1:]
+        if mnemonic not in _ENCODINGS:
+            raise SyntaxError('Unknown mnemonic {!r} on line {}.'.format(mnemonic, number))
+        encoding, kind = _ENCODINGS[mnemonic]
+        if len(operands) != (kind is not None):
+            raise SyntaxError('Wrong number of operands on line {}.'.format(number))
+
+        operand = operands[0] if operands else None
+        if kind == 'label' and operand.startswith('.'):
+            if set(operand[1:]) - set('st'):
+                raise SyntaxError('Labels must be s and t after the dot, on line {}.'
+                                  .format(number))
+            operand = operand[1:].replace('s', ' ').replace('t', '\t')
+            used.add(operand)
+        elif kind == 'num':
+            try:
+                operand = _assemble_number(operand)
+            except ValueError:
+                raise SyntaxError('Invalid number on line {}.'.format(number))
+        instructions.append((encoding, kind, operand))
+
+    names = _name_labels(instructions, used)
+    code = []
+    for encoding, kind, operand in instructions:
+        code.append(encoding)
+        if kind == 'label':
+            code.append(names.get(operand, operand) + '\n')
+        elif kind == 'num':
+            code.append(operand)
+    return ''.join(code)
+
+
+def _encode_number(value):
+    """Write a number as WhiteSpace the shortest way, with its terminal."""
+    digits = bin(abs(value))[2:].replace('0', ' ').replace('1', '\t') if value else ''
+    return ('\t' if value < 0 else ' ') + digits + '\n'
+
+
+def _assemble_number(operand):
+    """Write a number operand of a listing as WhiteSpace, with its terminal."""
+    negative = operand.startswith('-')
+    digits = operand[1:] if negative else operand
+    if not digits.startswith('0b'):
+        return _encode_number(_parse_number(operand))
+    if set(digits[2:]) - set('01'):
+        raise ValueError('Binary numbers can only have 0 and 1.')
+    digits = digits[2:].replace('0', ' ').replace('1', '\t')
+    return ('\t' if negative else ' ') + digits + '\n'
+
+
+def _name_labels(instructions, used):
+    """Give each named label the shortest label not used literally."""
+    names = {}
+    candidate = 0
+    for _, kind, operand in instructions:
+        if kind != 'label' or operand in used or operand in names:
+            continue
+        label = None
+        while label is None or label in used:
+            candidate += 1
+            label = bin(candidate)[2:].replace('0', ' ').replace('1', '\t')
+        names[operand] = label
+    return names
+
+
+# An event passed to a trace hook. position is the code offset of the
+# instruction, instruction its (mnemonic, parameter) as written in the code,
+# and depth the number of subroutines being run. arg depends on the event:
+# the offset jumped to for 'call', 'return' and 'jump', the character or
+# number read for 'input', the text written for 'output' and None for
+# 'instruction'. stack and heap are those of the interpreter, not copies.
+TraceEvent = namedtuple('TraceEvent', 'event position instruction arg stack heap depth')
+
+
+class Profile(object):
+    """Counts of the instructions run by a program, to find its hot spots.
+
+    counts[i] is the number of times the i-th instruction of program ran.
+    Every position in the report is an offset into the cleaned code and
+    code is shown in the s/t/n notation. Labels removed by the peephole
+    optimizer are not reported, so profile with optimize=False to see
+    every label.
+    """
+
+    def __init__(self):
+        """Create an empty profile."""
+        self.program = None
+        self.counts = []
+
+    def _bind(self, program):
+        """Get the counts for program, starting over if it is a new program."""
+        current = self.program
+        if (current is None or current.code != program.code or
+                current.optimized != program.optimized):
+            self.counts = [0] * len(program)
+        self.program = program
+        return self.counts
+
+    def report(self, limit=None):
+        """Get the hottest instructions, labels and subroutines.
+
+        Returns: a dict of lists of instructions, labels and calls, each
+                 sorted by count from hottest to coldest and cut to limit
+        """
+        program = self.program
+        if program is None:
+            return {'steps': 0, 'instructions': [], 'labels': [], 'calls': []}
+
+        code = program.code
+        ends = {}
+        starts = {}
+        for position, mnemonic, param, end in tokenize(code):
+            ends[position] = end
+            if mnemonic == 'label':
+                starts[param] = position
+
+        counts = self.counts
+        instructions = []
+        called = {}
+        for i, count in enumerate(counts):
+            if not count:
+                continue
+            mnemonic, param = program.instructions[i]
+            position = program.positions[i]
+            instructions.append({
+                'count': count,
+                'offset': position,
+                'mnemonic': mnemonic,
+                'source': visible(code[position:ends[position]])
+            })
+            if mnemonic == 'call':
+                called[param] = called.get(param, 0) + count
+
+        labels = []
+        calls = []
+        for label, index in program.labels.items():
+            entry = {'offset': starts[label], 'label': visible(label)}
+            if counts[index]:
+                labels.append(dict(entry, count=counts[index]))
+            if called.get(index):
+                calls.append(dict(entry, count=called[index]))
+
+        def hottest(entries):
+            entries.sort(key=lambda entry: (-entry['count'], entry['offset']))
+            return entries[:limit]
+
+        return {
+            'steps': sum(counts),
+            'instructions': hottest(instructions),
+            'labels': hottest(labels),
+            'calls': hottest(calls)
+        }
+
+    def as_json(self, limit=None):
+        """Get the report as JSON."""
+        return json.dumps(self.report(limit), indent=2, sort_keys=True)
+
+    def as_text(self, limit=20):
+        """Get the report as a table of text."""
+        report = self.report(limit)
+        lines = ['{:,} instructions run'.format(report['steps'])]
+
+        lines.extend(['', 'Instructions:', '{:>12}  {:>8}  {:<9} {}'.format(
+            'count', 'offset', 'mnemonic', 'source')])
+        for entry in report['instructions']:
+            lines.append('{count:>12,}  {offset:>8}  {mnemonic:<9} {source}'
+                         .format(**entry))
+
+        for title, entries in (('Labels:', report['labels']),
+                               ('Calls:', report['calls'])):
+            lines.extend(['', title, '{:>12}  {:>8}  {}'.format(
+                'count', 'offset', 'label')])
+            for entry in entries:
+                lines.append('{count:>12,}  {offset:>8}  {label}'.format(**entry))
+
+        return '\n'.join(lines)
+
+
+# Snapshots start with these bytes and their format version, followed by
+# the zlib compressed state. Version 1 snapshots do not say which program
+# the call stack points into, but can still be restored.
+_SNAPSHOT_MAGIC = b'WSSN'
+
+_SNAPSHOT_VERSION = 2
+
+
+def _write_varint(out, value):
+    """Append a non-negative number to a bytearray, seven bits a byte."""
+    while value > 0x7f:
+        out.append(value & 0x7f | 0x80)
+        value >>= 7
+    out.append(value)
+
+
+def _read_varint(data, offset):
+    """Read a number written by _write_varint.
+
+    Returns: the number, the offset after it
+    """
+    value = shift = 0
+    while True:
+        byte = data[offset]
+        offset += 1
+        value |= (byte & 0x7f) << shift
+        if byte < 0x80:
+            return value, offset
+        shift += 7
+
+
+def _write_bytes(out, value):
+    """Append bytes to a bytearray, after their length."""
+    _write_varint(out, len(value))
+    out.extend(value)
+
+
+def _read_bytes(data, offset):
+    """Read bytes written by _write_bytes.
+
+    Returns: the bytes, the offset after them
+    """
+    size, offset = _read_varint(data, offset)
+    return bytes(data[offset:offset + size]), offset + size
+
+
+def _write_ints(out, values):
+    """Append a list of numbers to a bytearray.
+
+    Lists whose numbers all fit in 64 bits are written as a little endian
+    array, where Python has arrays of 64 bit integers. Otherwise each
+    number is written as its sign and size followed by its magnitude,
+    however large.
+    """
+    packed = None
+    if _INT_BITS == 64:
+        try:
+            packed = array(_INT_TYPECODE, values)
+        except OverflowError:
+            pass
+
+    _write_varint(out, len(values))
+    if packed is not None:
+        out.append(0)
+        if sys.byteorder == 'big':
+            packed.byteswap()
+        out.extend(getattr(packed, 'tobytes', getattr(packed, 'tostring', None))())
+        return
+
+    out.append(1)
+    for value in values:
+        digits = '{:x}'.format(abs(value)) if value else ''
+        if len(digits) % 2:
+            digits = '0' + digits
+        magnitude = binascii.unhexlify(digits)
+        _write_varint(out, len(magnitude) << 1 | (value < 0))
+        out.extend(magnitude)
+
+
+def _read_ints(data, offset):
+    """Read a list of numbers written by _write_ints.
+
+    Returns: the list, the offset after it
+    """
+    count, offset = _read_varint(data, offset)
+    kind = data[offset]
+    offset += 1
+
+    if kind == 0:
+        end = offset + 8 * count
+        if _INT_BITS != 64:
+            return list(struct.unpack('<{}q'.format(count), bytes(data[offset:end]))), end
+        packed = array(_INT_TYPECODE)
+        getattr(packed, 'frombytes', getattr(packed, 'fromstring', None))(
+            bytes(data[offset:end]))
+        if sys.byteorder == 'big':
+            packed.byteswap()
+        return packed.tolist(), end
+
+    values = []
+    for _ in range(count):
+        header, offset = _read_varint(data, offset)
+        end = offset + (header >> 1)
+        value = int(binascii.hexlify(data[offset:end]) or b'0', 16)
+        values.append(-value if header & 1 else value)
+        offset = end
+    return values, offset
+
+
+class SpaceInterpreter(object):
+    """Interpreter for the WhiteSpace esolang."""
+
+    SLICE_STEPS = 1000
+    TRANSPILE_LIMIT = 10000
+
+    _COMMAND_TABLES = ('_IMPS', '_STACK_IMP', '_ARITH_IMP', '_HEAP_IMP',
+                       '_IO_IMP', '_FLOW_IMP')
+
+    def __init__(self, code='', inp='', step_limit=None, stack_limit=None,
+                 heap_limit=None, call_limit=None, optimize=True,
+                 engine='python', memory='dict', track_memory=False,
+                 profile=False, trace=None):
+        """Create an interpreter for a given code and input.
+
+        code may be a string, anything bytes-like or a SpaceSource, and is
+        cleaned of everything but spaces, tabs and newlines. Syntax errors
+        give the line and column of the source they were found at.
+
+        Limits on the number of instructions run, values on the stack,
+        addresses used in the heap and nested subroutine calls can be
+        given to stop untrusted programs. A limit of None is unbounded.
+        The optimizer turns tail calls into jumps, which do not nest.
+
+        If optimize is False the program is run without the peephole
+        optimizer. engine is either 'python', to run the program
+        transpiled into a Python function, 'blocks', to run it a basic
+        block at a time with each block compiled when it is first run,
+        or 'interpreter', to run the instructions one at a time. Programs
+        of more than TRANSPILE_LIMIT instructions take longer to transpile
+        than they save, so with 'python' they are always interpreted.
+
+        memory is either 'dict', to keep the heap in a dict, or 'array',
+        to keep it in an ArrayHeap. If track_memory is True the largest
+        stack and heap seen are kept in peak_stack and peak_heap, counted
+        in values. With 'python' or 'blocks' the program is run as a Python
+        function checking the stack wherever it rises within a block, and
+        with 'interpreter' it is checked before every instruction. The
+        optimizer may fold away pushes, so the peaks are those of the
+        program as it is run.
+
+        If profile is True, every instruction run is counted in the
+        Profile kept in profile. Profiling runs the transpiled Python
+        function, with a count added before each instruction, or for
+        programs of more than TRANSPILE_LIMIT instructions the counting
+        interpreter loop.
+
+        trace is a hook called with a TraceEvent before every instruction
+        and on every call, return, jump taken, input and output. It can be
+        changed between runs in the trace attribute. While tracing, the
+        program is run without the optimizer, so every instruction is
+        seen as written, by a transpiled function calling the hook, or for
+        programs of more than TRANSPILE_LIMIT instructions by the
+        interpreter loop; runs without a hook never check for one.
+        """
+        if engine not in ('python', 'blocks', 'interpreter'):
+            raise ValueError('Unknown engine {!r}.'.format(engine))
+        if memory not in ('dict', 'array'):
+            raise ValueError('Unknown memory model {!r}.'.format(memory))
+
+        self._load(code)
+        self._program = None
+        self._run_program = None
+        self._frames = None
+        self.labels = {}
+        self.heap = {} if memory == 'dict' else ArrayHeap()
+
+        self.step_limit = step_limit
+        self.stack_limit = stack_limit
+        self.heap_limit = heap_limit
+        self.call_limit = call_limit
+        self.optimize = optimize
+        self.engine = engine
+        self.track_memory = track_memory
+        self.peak_stack = 0 if track_memory else None
+        self.peak_heap = 0 if track_memory else None
+        self.profile = Profile() if profile else None
+        self.trace = trace
+        self.reset(inp)
+
+    def __getattr__(self, name):
+        """Build the command tables of the exec_ methods on first use."""
+        if name not in self._COMMAND_TABLES:
+            raise AttributeError(name)
+        self._build_command_tables()
+        return self.__dict__[name]
+
+    def _build_command_tables(self):
+        """Map the commands parsed by the exec_ methods to their handlers.
+
+        run never parses the code this way, so interpreters only build
+        these when an exec_ method is called.
+        """
         self._IMPS = {
             ' ': self.exec_manipulate_stack,
             '\t ': self.exec_arithmetic,
@@ -115,11 +2755,11 @@ class SpaceInterpreter(object):
         }
 
         self._ARITH_IMP = {
-            '  ': '+',
-            ' \t': '-',
-            ' \n': '*',
-            '\t ': '//',
-            '\t\t': '%'
+            '  ': operator.add,
+            ' \t': operator.sub,
+            ' \n': operator.mul,
+            '\t ': operator.floordiv,
+            '\t\t': operator.mod
         }
 
         self._HEAP_IMP = {
@@ -144,26 +2784,125 @@ class SpaceInterpreter(object):
             '\n\n': self._exit_program
         }
 
+    def reset(self, inp=''):
+        """Get ready to run the program again from the start on new input.
+
+        The stack, heap, call stack, counters and any profile are cleared,
+        while the code, options and compiled program are kept, so one
+        interpreter can run many inputs without being created again.
+        """
+        self.input = inp
+        self.stack = []
+        self.heap = {} if isinstance(self.heap, dict) else ArrayHeap()
+
+        self._call_stack = [0]
+        self.steps = 0
+        self.exited = False
+        self.input_position = 0
+        self.output_position = 0
+
+        if self.track_memory:
+            self.peak_stack = self.peak_heap = 0
+        if self.profile is not None:
+            self.profile = Profile()
+
+    def _load(self, code):
+        """Clean the code to run, keeping its source to locate errors in.
+
+        code may be a string, anything bytes-like or a SpaceSource.
+        """
+        self.source = code if isinstance(code, SpaceSource) else SpaceSource(code)
+        self.code = self.source.code
+
+    def _compile(self):
+        """Get the compiled program, pointing syntax errors at the source.
+
+        The program is kept until the code or optimization changes, so
+        runs after a reset do not look it up again. A run that has not
+        exited carries on with the program it was started on, even if the
+        optimization has changed since, as its call stack points into it.
+        """
+        program = self._run_program
+        if program is not None and program.code == self.code and not self.exited:
+            return program
+
+        optimize = self.optimize and self.trace is None
+        program = self._program
+        if (program is not None and program.code == self.code and
+                program.optimized == optimize):
+            return program
+
+        try:
+            program = program_cache.get(self.code, optimize)
+        except SyntaxError as error:
+            self._relocate(error)
+            raise
+        self.labels = dict(program.label_positions)
+        self._program = program
+        return program
+
+    def _relocate(self, error):
+        """Point an error located in the code at its source, if it has one."""
+        if self.source.code == self.code:
+            self.source.relocate(error)
+
+    def locate(self, offset=None):
+        """Find an offset of the code in its source, by default the pointer.
+
+        Returns: the line and column of the offset, counted from 1
+        """
+        if self.source.code != self.code:
+            self._load(self.code)
+        return self.source.locate(self.p if offset is None else offset)
+
+    @property
+    def _call_stack(self):
+        """Get the call stack as code positions, with the pointer last.
+
+        Between runs the call stack is kept as instruction indexes of the
+        program it was run on, and only turned into positions when asked
+        for, so resuming a paused run does not convert every frame.
+        """
+        if self._frames is not None:
+            calls, pc = self._frames
+            positions = self._run_program.positions
+            self._positions = [positions[i] for i in calls] + [positions[pc]]
+            self._frames = None
+        return self._positions
+
+    @_call_stack.setter
+    def _call_stack(self, value):
+        """Set the call stack as code positions, with the pointer last."""
+        self._positions = value
+        self._frames = None
+        self._run_program = None
+
     @property
     def p(self):
         """Get the current position of the pointer."""
+        if self._frames is not None:
+            return self._run_program.positions[self._frames[1]]
         return self._call_stack[-1]
 
     @p.setter
     def p(self, value):
         """Set the current position of the pointer."""
+        if self._frames is not None:
+            try:
+                self._frames[1] = self._run_program.index(value)
+                return
+            except ValueError:
+                pass
         self._call_stack[-1] = value
 
     def __str__(self):
         """Print the current state of the code."""
-        vis_code = self.code.replace(' ', 's')
-        vis_code = vis_code.replace('\t', 't')
-        vis_code = vis_code.replace('\n', 'n')
+        vis_code = visible(self.code)
         return '{}[{}]{}'.format(vis_code[:self.p],
                                  vis_code[self.p:self.p + 1],
                                  vis_code[self.p + 1:])
 
-    def run(self, code=None, inp=None):
+    def run(self, code=None, inp=None, output=None):
         """Run the interpreter and get the output.
 
         Command modules:
@@ -173,64 +2912,393 @@ class SpaceInterpreter(object):
             tn - Input/Output
             n - Flow Control
 
-        Raises ValueError for unclean termination.
+        inp may be a string, a readable text file or an iterable of
+        strings. If output is a writable text stream or a callable,
+        output is written to it as the program runs and None is returned.
+
+        Raises SyntaxError for invalid code, including code that runs off
+        its end without an exit, and ResourceLimitError when one of the
+        limits is exceeded. Faults of the program raise IndexError for
+        too few values on the stack, NameError for an undefined label or
+        heap address, ZeroDivisionError, IOError when the input runs out
+        and ValueError for input that is not a number.
         """
-        self.code = self.code if code is None else code
-        self.input = self.input if inp is None else inp
+        if code is not None:
+            self._load(code)
+        if inp is not None:
+            self.input = inp
+            self.input_position = 0
 
-        output = ''
-        self.find_labels()
+        program = self._compile()
 
-        while self.p < len(self.code):
-            imp_string = self.code[self.p:self.p + 2]
-            self.p += 2
+        if output is None:
+            chunks = []
+            self._execute(program, chunks.append)
+            return ''.join(chunks)
 
-            if imp_string not in self._IMPS:
-                imp_string = imp_string[0]
-                self.p -= 1
+        self._execute(program, _output_writer(output))
 
-            try:
-                imp = self._IMPS[imp_string]
+    def run_async(self, code=None, inp=None, output=None, yield_every=None):
+        """Get a coroutine running the interpreter in an asyncio event loop.
 
-            except KeyError:
-                raise SyntaxError('Invalid instruction modification parameter.')
+        The program hands control back to the loop every yield_every
+        instructions and while waiting on asyncio input sources. See
+        esolang_whitespace_async.run, which needs Python 3.5 or newer.
+        """
+        from esolang_whitespace_async import run
+        return run(self, code, inp, output, yield_every)
+
+    def iter_output(self, code=None, inp=None, max_steps=None, timeout=None):
+        """Run the interpreter, yielding output as it is produced.
+
+        Execution pauses every SLICE_STEPS instructions to hand back any
+        output written in the meantime. Once max_steps instructions have
+        run or timeout seconds have passed the generator stops, even if
+        the program has not exited. Calling iter_output again resumes
+        from where it stopped; exited tells the two cases apart.
+
+        Limits are checked when control is transferred, so a run can go
+        over them by one basic block.
+        """
+        if code is not None:
+            self._load(code)
+        if inp is not None:
+            self.input = inp
+            self.input_position = 0
+
+        program = self._compile()
 
-            result = imp()
-            self.p = result[0]
-            if len(result) > 2:
-                _, out, self.input = result
-                output += out
-            exit = result[1] if len(result) == 2 else False
+        chunks = []
+        stop = float('inf') if max_steps is None else self.steps + max_steps
+        deadline = None if timeout is None else time.time() + timeout
 
-            if exit:
+        while not self.exited:
+            # Output written before an error is yielded from the finally
+            # block, as Python 2 forgets the error on yielding in an except.
+            try:
+                self._execute(program, chunks.append,
+                              min(self.SLICE_STEPS, stop - self.steps))
+            finally:
+                if chunks:
+                    yield ''.join(chunks)
+                    del chunks[:]
+
+            if self.steps >= stop:
+                break
+            if deadline is not None and time.time() >= deadline:
                 break
 
+    def _execute(self, program, sink, limit=None):
+        """Execute the compiled program from the current pointer.
+
+        The call stack is worked on as instruction indexes, kept in a
+        typed array so deep recursion takes eight bytes a frame, and kept
+        that way with the program when execution stops for any reason.
+        It is only converted from code positions when it was last run on
+        another program or set as positions. Output is buffered and
+        passed to sink in chunks.
+
+        Instructions are counted a basic block at a time, whenever control
+        is transferred, and execution pauses at the first transfer after
+        limit instructions have run.
+
+        When tracking memory, the stack's peak is recorded by the Python
+        function wherever the stack rises in a block, or by the interpreter
+        loop before every instruction. The heap never shrinks, so its peak
+        is its size when execution stops.
+
+        Returns: True if the program exited, False if it was paused
+        """
+        positions = program.positions
+        reader = self.input if isinstance(self.input, SpaceInput) else SpaceInput(self.input)
+        consumed = reader.consumed
+        if self._frames is not None and self._run_program is program:
+            calls, pc = self._frames
         else:
-            raise SyntaxError('Code must terminate with an exit command.')
+            calls = array(_INT_TYPECODE, [program.index(p) for p in self._call_stack])
+            pc = calls.pop()
+        steps = 0
+        exceeded = None
+        output = []
+
+        inf = float('inf')
+        if self.step_limit is not None:
+            limit = min(inf if limit is None else limit,
+                        self.step_limit - self.steps)
+        limit = inf if limit is None else limit
+        max_stack = inf if self.stack_limit is None else self.stack_limit
+        max_heap = inf if self.heap_limit is None else self.heap_limit
+        max_calls = inf if self.call_limit is None else self.call_limit
+        track = self.track_memory
+        guarded = max_stack != inf or max_heap != inf
+        stack, heap = self.stack, self.heap
+
+        def write(text):
+            self.output_position += len(text)
+            sink(text)
+
+        peaks = None
+        engine = _interpret
+        if track:
+            self._record_peaks()
+            peaks = [self.peak_stack]
+            engine = functools.partial(_interpret, peaks=peaks)
+
+        if self.trace is not None or track and self.profile is not None:
+            tracer = self._tracer(program, calls)
+            engine = functools.partial(_interpret, trace=tracer)
+            if len(program) <= self.TRANSPILE_LIMIT:
+                engine = functools.partial(program.trace_function,
+                                           trace=tracer)
+        elif self.profile is not None:
+            counts = self.profile._bind(program)
+            engine = functools.partial(_interpret, counts=counts)
+            if len(program) <= self.TRANSPILE_LIMIT:
+                function = program.profile_function
+                if pc in program.entries:
+                    engine = functools.partial(function, counts=counts)
+        elif track:
+            if self.engine != 'interpreter' and len(program) <= self.TRANSPILE_LIMIT:
+                function = program.track_function
+                if pc in program.entries:
+                    engine = functools.partial(function, peaks=peaks)
+        elif self.engine == 'python' and len(program) <= self.TRANSPILE_LIMIT:
+            function = program.function
+            if pc in program.entries:
+                engine = function
+        elif self.engine == 'blocks' and program.block_at[pc] is not None:
+            engine = _run_blocks
 
-        return output
+        try:
+            pc, steps, self.exited, exceeded = engine(
+                program, pc, calls, stack, heap,
+                reader.read_char, reader.read_line, output, write,
+                limit, max_stack, max_heap, max_calls, guarded)
+
+        except BaseException as error:
+            pc, ran = _fault_state(sys.exc_info()[2], program, pc)
+            steps += ran
+            self.input = reader if reader.streaming else reader.remaining()
+            if isinstance(error, SyntaxError):
+                _locate_error(error, program.code, positions[pc])
+                self._relocate(error)
+            raise
 
-    def find_labels(self):
-        """Run through the code to define all the labels used."""
-        pointer = 0
+        else:
+            if self.exited and not reader.streaming:
+                self.input = reader.remaining()
+            else:
+                self.input = reader
+
+        finally:
+            self.steps += steps
+            self.input_position += reader.consumed - consumed
+            self._run_program = program
+            self._frames = [calls, pc]
+            if track:
+                self.peak_stack = max(self.peak_stack, peaks[0])
+                self._record_peaks()
+            if output:
+                write(''.join(output))
+
+        if not self.exited:
+            self._check_limits(exceeded)
+        return self.exited
+
+    def _tracer(self, program, calls):
+        """Get a function passing the events of the trace function to the
+        trace hook, counting instructions if profiling and recording the
+        peaks if tracking memory."""
+        hook = self.trace
+        track = self.track_memory
+        positions = program.positions
+        decoded = None if hook is None else program.decoded
+        stack, heap = self.stack, self.heap
+        counts = None if self.profile is None else self.profile._bind(program)
+
+        def trace(index, event, arg):
+            if event == 'instruction':
+                if counts is not None:
+                    counts[index] += 1
+                if track:
+                    self._record_peaks()
+            if hook is None:
+                return
+            if event in ('call', 'return', 'jump'):
+                arg = positions[arg]
+            position = positions[index]
+            hook(TraceEvent(event, position, decoded[position], arg, stack, heap,
+                            len(calls)))
+
+        return trace
+
+    def _record_peaks(self):
+        """Raise the peak stack and heap sizes to the current sizes."""
+        self.peak_stack = max(self.peak_stack, len(self.stack))
+        self.peak_heap = max(self.peak_heap, len(self.heap))
+
+    def memory_usage(self):
+        """Estimate the bytes used by the stack and heap.
+
+        Each is the sys.getsizeof of the container and of every value in
+        it, so values shared by several entries, such as small ints, are
+        counted once for each. Unlike peak_stack and peak_heap, which
+        count values, the result is in bytes.
+        """
+        stack = sys.getsizeof(self.stack) + sum(
+            sys.getsizeof(value) for value in self.stack)
+        if isinstance(self.heap, dict):
+            return MemoryUsage(stack, _sizeof_dict(self.heap))
+        return MemoryUsage(stack, sys.getsizeof(self.heap))
+
+    def snapshot(self):
+        """Save the state of the interpreter as compact binary data.
+
+        The snapshot holds a hash of the code, whether the program run was
+        optimized, the call stack with the pointer, the stack, the heap,
+        the steps run, how many characters have been read and written and,
+        unless the input is streamed, the input not yet read. Restoring it
+        into an interpreter for the same code, in this process or another,
+        carries on from the same point, on a program optimized the same.
+        """
+        remaining = self.input
+        if isinstance(remaining, SpaceInput):
+            remaining = None if remaining.streaming else remaining.remaining()
+        elif not isinstance(remaining, _STRING_TYPES):
+            remaining = None
+
+        call_stack = self._call_stack
+        program = self._run_program
+        if program is None:
+            optimized = bool(self.optimize) and self.trace is None
+        else:
+            optimized = program.optimized
+
+        state = bytearray(hashlib.sha1(self.code.encode('ascii')).digest())
+        state.append(self.exited | (remaining is not None) << 1 | optimized << 2)
+        _write_varint(state, self.steps)
+        _write_varint(state, self.input_position)
+        _write_varint(state, self.output_position)
+        _write_ints(state, call_stack)
+        _write_ints(state, self.stack)
+        heap = sorted(self.heap.items())
+        _write_ints(state, [address for address, _ in heap])
+        _write_ints(state, [value for _, value in heap])
+        if remaining is not None:
+            _write_bytes(state, remaining.encode('utf-8'))
+
+        return (_SNAPSHOT_MAGIC + bytes(bytearray([_SNAPSHOT_VERSION])) +
+                zlib.compress(bytes(state)))
+
+    def restore(self, snapshot, inp=None):
+        """Load the state from a snapshot of an interpreter for the same code.
+
+        The input saved in the snapshot is used unless inp is given. For
+        streamed input, which is not saved, inp must be given and should
+        be the same source as before; the characters already read from it
+        are skipped. output_position tells how much output had been
+        written, so output written since the snapshot can be dropped.
+
+        The rest of the run is on the program as optimized when the
+        snapshot was taken, whatever the interpreter's own options.
+
+        Raises ValueError if the snapshot cannot be read or is of other code.
+        """
+        header = len(_SNAPSHOT_MAGIC) + 1
+        versions = [_SNAPSHOT_MAGIC + bytes(bytearray([version]))
+                    for version in range(1, _SNAPSHOT_VERSION + 1)]
+        if snapshot[:header] not in versions:
+            raise ValueError('Not a snapshot, or of an unsupported version.')
+        version = versions.index(snapshot[:header]) + 1
 
-        while pointer < len(self.code):
-            imp_string = self.code[pointer:pointer + 2]
-            pointer += 2
+        try:
+            state = bytearray(zlib.decompress(snapshot[header:]))
+        except zlib.error:
+            raise ValueError('Snapshot is corrupt.')
 
-            if imp_string not in self._IMPS:
-                imp_string = imp_string[0]
-                pointer -= 1
+        if bytes(state[:20]) != hashlib.sha1(self.code.encode('ascii')).digest():
+            raise ValueError('Snapshot is of a different program.')
 
+        try:
+            flags = state[20]
+            steps, offset = _read_varint(state, 21)
+            input_position, offset = _read_varint(state, offset)
+            output_position, offset = _read_varint(state, offset)
+            call_stack, offset = _read_ints(state, offset)
+            stack, offset = _read_ints(state, offset)
+            addresses, offset = _read_ints(state, offset)
+            values, offset = _read_ints(state, offset)
+            remaining = None
+            if flags & 2:
+                remaining, offset = _read_bytes(state, offset)
+                remaining = remaining.decode('utf-8')
+        except IndexError:
+            raise ValueError('Snapshot is corrupt.')
+
+        if inp is None:
+            if remaining is None:
+                raise ValueError('Snapshot has no input saved, it must be given.')
+            inp = remaining
+        else:
+            inp = SpaceInput(inp)
+            if inp.skip(input_position) < input_position:
+                raise ValueError('Input is shorter than the input already read.')
+
+        program = calls = None
+        if version > 1:
             try:
-                imp = self._IMPS[imp_string]
+                program = program_cache.get(self.code, bool(flags & 4))
+                calls = array(_INT_TYPECODE, [program.index(p) for p in call_stack])
+            except SyntaxError:
+                program = None
+            except ValueError:
+                raise ValueError('Snapshot call stack does not match the program.')
+
+        heap = zip(addresses, values)
+        self.heap = dict(heap) if isinstance(self.heap, dict) else ArrayHeap(heap)
+        self.stack = stack
+        self._call_stack = call_stack
+        if program is not None:
+            self._run_program = program
+            self._frames = [calls, calls.pop()]
+        self.steps = steps
+        self.exited = bool(flags & 1)
+        self.input = inp
+        self.input_position = input_position
+        self.output_position = output_position
+
+    def _check_limits(self, exceeded=None):
+        """Raise ResourceLimitError if any of the limits has been exceeded."""
+        if exceeded is None:
+            if self.step_limit is not None and self.steps >= self.step_limit:
+                exceeded = 'step_limit'
+            elif self.stack_limit is not None and len(self.stack) > self.stack_limit:
+                exceeded = 'stack_limit'
+            elif self.heap_limit is not None and len(self.heap) > self.heap_limit:
+                exceeded = 'heap_limit'
+            else:
+                return
+
+        value = getattr(self, exceeded)
+        state = {
+            'position': self.p,
+            'call_stack': list(self._call_stack),
+            'steps': self.steps,
+            'stack_depth': len(self.stack),
+            'heap_size': len(self.heap),
+            'call_depth': len(self._call_stack) - 1
+        }
+        raise ResourceLimitError(
+            'Exceeded the {} of {}.'.format(exceeded.replace('_', ' '), value),
+            exceeded, value, state)
 
-            except KeyError:
-                raise SyntaxError('Invalid instruction modification parameter.')
+    def find_labels(self):
+        """Find all the labels defined in the code.
 
-            result = imp(code=self.code[pointer:], stack=[1, 1, 1],
-                         heap={1: 1}, call_stack=[pointer], parsing=True)
-            pointer = result[0]
+        The code is only tokenized, so nothing is run and the stack, heap
+        and input are left alone.
+        """
+        self.labels = scan(self.code)[1]
 
     def exec_manipulate_stack(self, code=None, stack=None, call_stack=None, **kwargs):
         """Execute commands for the Stack Manipulation IMP.
@@ -346,8 +3414,7 @@ class SpaceInterpreter(object):
         """Execute operation on the top two values of the stack."""
         try:
             a, b = stack.pop(), stack.pop()
-            result = eval('b{op}a'.format(op=op))
-            stack.append(result)
+            stack.append(op(b, a))
 
         except IndexError:
             raise IndexError('Not enough values in stack for operation.')
@@ -440,7 +3507,7 @@ class SpaceInterpreter(object):
     def _output_number(self, inp, stack, **kwargs):
         """Output the top value on the stack as a number."""
         try:
-            return str(stack.pop()), inp
+            return _number_string(stack.pop()), inp
         except IndexError:
             raise IndexError('No values in stack to output.')
 
@@ -477,7 +3544,7 @@ class SpaceInterpreter(object):
             raise SyntaxError('Number input must have a terminal.')
 
         try:
-            value = int(value)
+            value = _parse_number(value)
             address = stack.pop()
             heap[address] = value
 
@@ -605,30 +3672,11 @@ class SpaceInterpreter(object):
         binary: s = 0, t = 1
         terminal: n
 
-        Raises ValueError for unclean termination.
+        Raises SyntaxError for an empty number or one without a terminal.
 
         Returns: the evaluated number, the change in the pointer's postion
         """
-        if not code:
-            raise SyntaxError('Numbers cannot be empty.')
-
-        if code[0] == '\n':
-            raise SyntaxError('Numbers cannot be only a terminal.')
-
-        sign = 1 if code[0] == ' ' else -1
-        position = 1
-        num = '0'
-        while position < len(code):
-            if code[position] == '\n':
-                break
-            num += '0' if code[position] == ' ' else '1'
-            position += 1
-        else:
-            raise SyntaxError('Number must end with a terminal.')
-
-        num = sign * int(num, 2)
-        position += 1
-        return num, position
+        return _read_num(code, 0)
 
     def parse_label(self, code):
         """Parse and validate the next label in the code.
@@ -648,3 +3696,57 @@ class SpaceInterpreter(object):
         position = len(label) + 1
 
         return label, position
+
+
+class InterpreterPool(object):
+    """Thread-safe pool of interpreters for the same code and options.
+
+    Interpreters are created as they are needed and reset before they
+    are handed out again, so a service running one program for many
+    requests does not create an interpreter for each. At most maxsize
+    idle interpreters are kept.
+    """
+
+    def __init__(self, code, maxsize=8, **options):
+        """Create a pool running the given code with the given options."""
+        self.options = options
+        self.maxsize = maxsize
+        self._idle = []
+        self._lock = threading.Lock()
+        self.code = _clean(code)
+
+    def __len__(self):
+        """Get the number of idle interpreters."""
+        return len(self._idle)
+
+    def acquire(self, inp=''):
+        """Take an interpreter from the pool, reset to run on the input."""
+        with self._lock:
+            interpreter = self._idle.pop() if self._idle else None
+        if interpreter is None:
+            return SpaceInterpreter(self.code, inp, **self.options)
+        interpreter.reset(inp)
+        return interpreter
+
+    def release(self, interpreter):
+        """Give an interpreter back to the pool, if it has room for it."""
+        with self._lock:
+            if len(self._idle) < self.maxsize:
+                self._idle.append(interpreter)
+
+    @contextlib.contextmanager
+    def interpreter(self, inp=''):
+        """Borrow an interpreter for the duration of a with block."""
+        interpreter = self.acquire(inp)
+        try:
+            yield interpreter
+        finally:
+            self.release(interpreter)
+
+    def run(self, inp='', output=None):
+        """Run the code on the input with a pooled interpreter.
+
+        Returns: the output, or None if output was given
+        """
+        with self.interpreter(inp) as interpreter:
+            return interpreter.run(output=output)
@@ -0,0 +1,167 @@
+"""Run WhiteSpace programs in an asyncio event loop.
+
+Programs run a slice of instructions at a time, handing control back to
+the event loop in between, so many programs can share one loop. Input
+can come from asyncio sources and output can go to asyncio sinks.
+
+This module needs Python 3.5 or newer; esolang_whitespace itself does not.
+"""
+import asyncio
+import codecs
+import inspect
+
+from esolang_whitespace import SpaceInput
+
+
+class InputPending(Exception):
+    """Raised when a program needs input that has not arrived yet."""
+
+
+class AsyncInput(SpaceInput):
+    """Input for a WhiteSpace program read from an asyncio source.
+
+    The source can be an async iterable of strings or bytes, or have a
+    coroutine read(size) like asyncio.StreamReader. Bytes are decoded as
+    UTF-8. Reading past the input received so far raises InputPending,
+    after which receive must be awaited before reading again.
+    """
+
+    def __init__(self, source):
+        """Wrap the given asyncio input source."""
+        super(AsyncInput, self).__init__('')
+        self._source = source
+        self._received = []
+        self._chunks = ()
+        self._decoder = codecs.getincrementaldecoder('utf-8')()
+
+    def _fill(self):
+        """Append the input received to the buffer.
+
+        Returns: False if the source is exhausted
+        """
+        if self._received:
+            self._consumed += self._position
+            self._buffer = self._buffer[self._position:] + ''.join(self._received)
+            self._position = 0
+            del self._received[:]
+            return True
+
+        if self._chunks is None:
+            return False
+        raise InputPending()
+
+    async def receive(self):
+        """Wait for the next chunk of the source."""
+        source = self._source
+        if hasattr(source, 'read'):
+            chunk = await source.read(self.CHUNK_SIZE)
+            done = not chunk
+        else:
+            try:
+                chunk = await source.__anext__()
+                done = False
+            except StopAsyncIteration:
+                chunk, done = b'', True
+
+        if isinstance(chunk, bytes):
+            chunk = self._decoder.decode(chunk, final=done)
+        if chunk:
+            self._received.append(chunk)
+        if done:
+            self._chunks = None
+
+
+def is_async_source(source):
+    """Check if an input source has to be awaited."""
+    return (hasattr(source, '__aiter__') or
+            inspect.iscoroutinefunction(getattr(source, 'read', None)))
+
+
+async def run(interpreter, code=None, inp=None, output=None, yield_every=None):
+    """Run an interpreter, yielding to the event loop as it goes.
+
+    Control is handed back to the event loop after every yield_every
+    instructions, SLICE_STEPS by default, and whenever the program waits
+    for input. Like the limits, instructions are counted when control is
+    transferred.
+
+    inp may be anything SpaceInterpreter.run takes, or an asyncio source
+    as taken by AsyncInput. output may be a callable or an object with a
+    write method, either of which may return an awaitable. Output to an
+    object with a drain coroutine, like asyncio.StreamWriter, is encoded
+    as UTF-8 and drained after every write.
+
+    Returns: the output, or None if output was given
+    """
+    if code is not None:
+        interpreter._load(code)
+    if inp is not None:
+        interpreter.input = inp
+        interpreter.input_position = 0
+    if is_async_source(interpreter.input):
+        interpreter.input = AsyncInput(interpreter.input)
+
+    program = interpreter._compile()
+
+    chunks = []
+    result = []
+    write = _async_writer(result.append if output is None else output)
+    steps = interpreter.SLICE_STEPS if yield_every is None else yield_every
+
+    while True:
+        try:
+            interpreter._execute(program, chunks.append, steps)
+        except InputPending:
+            _retry_input(interpreter, program)
+            await _flush(chunks, write)
+            await interpreter.input.receive()
+            continue
+        except BaseException:
+            await _flush(chunks, write)
+            raise
+
+        await _flush(chunks, write)
+        if interpreter.exited:
+            break
+        await asyncio.sleep(0)
+
+    if output is None:
+        return ''.join(result)
+
+
+def _retry_input(interpreter, program):
+    """Move the interpreter back to the input instruction that was cut off.
+
+    Input instructions read before changing anything else, so the
+    instruction can simply be run again once more input has arrived.
+    """
+    index = program.index(interpreter.p) - 1
+    interpreter.p = program.positions[index]
+    interpreter.steps -= 1
+
+
+def _async_writer(output):
+    """Get a coroutine function writing text to the output."""
+    write = getattr(output, 'write', output)
+    if not callable(write):
+        raise TypeError('Output must be callable or have a write method.')
+    drain = getattr(output, 'drain', None)
+
+    async def writer(text):
+        if drain is not None:
+            write(text.encode('utf-8'))
+            await drain()
+            return
+        written = write(text)
+        if inspect.isawaitable(written):
+            await written
+
+    return writer
+
+
+async def _flush(chunks, write):
+    """Pass any output from the chunks list on to write."""
+    if chunks:
+        text = ''.join(chunks)
+        del chunks[:]
+        await write(text)
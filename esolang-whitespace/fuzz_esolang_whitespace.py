@@ -0,0 +1,284 @@
+"""Differential fuzzing of the engines of the esolang_whitespace module.
+
+Random well-formed programs are run on every engine and the output and
+type of any exception raised compared. Programs the engines disagree on
+are shrunk to the fewest lines and input that still disagree.
+
+Run a round with: python fuzz_esolang_whitespace.py
+Choose how many programs with --runs, their size with --size and the
+random seed with --seed. Exits with status 1 if any engines disagreed,
+after printing each shrunk program as an assembler listing.
+"""
+from __future__ import print_function
+
+import argparse
+import itertools
+import random
+import sys
+from collections import namedtuple
+
+from esolang_whitespace import (_STACK_EFFECTS, ResourceLimitError, SpaceInterpreter,
+                                assemble)
+
+try:
+    import asyncio
+    import esolang_whitespace_async
+except (ImportError, SyntaxError):  # pragma: no cover
+    esolang_whitespace_async = None
+
+
+# Programs are stopped after this many instructions, in case a loop never ends.
+STEP_LIMIT = 10000
+
+# Name and SpaceInterpreter options of each engine. Tracing always runs
+# the program without the optimizer.
+ENGINES = [
+    ('interpreter', {'engine': 'interpreter', 'optimize': False}),
+    ('interpreter-optimized', {'engine': 'interpreter'}),
+    ('python', {'engine': 'python', 'optimize': False}),
+    ('python-optimized', {'engine': 'python'}),
+    ('blocks', {'engine': 'blocks', 'optimize': False}),
+    ('blocks-optimized', {'engine': 'blocks'}),
+    ('array-memory', {'memory': 'array'}),
+    ('profile', {'profile': True}),
+    ('trace', {'trace': lambda event: None, 'optimize': False})
+]
+
+if esolang_whitespace_async is not None:
+    ENGINES.append(('async', {'async': True}))
+
+# What running a program on an engine did. error is the name of the type
+# of exception raised, if any, and limited is True if it hit STEP_LIMIT.
+Outcome = namedtuple('Outcome', 'output error limited')
+
+# Programs the engines disagreed on, as a listing and the input given.
+Mismatch = namedtuple('Mismatch', 'listing inp outcomes')
+
+_OPERATIONS = ['dup', 'swap', 'drop', 'add', 'sub', 'mul', 'div', 'mod',
+               'store', 'retrieve', 'outc', 'outn', 'inc', 'inn']
+
+# Heap address of the counter of loops nested that deep. The numbers the
+# programs push are far too small to reach them by chance.
+_COUNTER_ADDRESS = 1 << 20
+
+
+def random_listing(rng, size=20, subroutines=2):
+    """Write a random program as an assembler listing.
+
+    The main code ends in an exit, followed by subroutines ending in a
+    ret. Jumps only go forwards, subroutines only call those after them
+    and loops count down a counter on the heap, so programs finish
+    unless other instructions overwrite a counter. Instructions mostly
+    have the values they need on the stack, but any may fault, and now
+    and then a program jumps to a label never defined, returns outside
+    of a subroutine or is missing its exit.
+
+    Returns: the lines of the listing
+    """
+    labels = itertools.count()
+
+    def body(size, depth, nesting, callable_):
+        # depth is the least values on the stack, as far as is known.
+        lines = []
+        while len(lines) < size:
+            choice = rng.random()
+            if choice < 0.6:
+                mnemonic = rng.choice(_OPERATIONS)
+                needed, effect = _STACK_EFFECTS[mnemonic]
+                if depth < needed and rng.random() < 0.9:
+                    lines.append('push {}'.format(rng.randint(-3, 80)))
+                    depth += 1
+                    continue
+                lines.append(mnemonic)
+                depth = max(depth + effect, 0)
+            elif choice < 0.66:
+                lines.append('{} {}'.format(rng.choice(['copy', 'slide']),
+                                            rng.randint(-1, 3)))
+            elif choice < 0.8:
+                mnemonic = rng.choice(['jz', 'jn', 'jump'])
+                label = 'f{}'.format(next(labels))
+                if mnemonic != 'jump':
+                    depth = max(depth - 1, 0)
+                lines.append('{} {}'.format(mnemonic, label))
+                skipped = body(rng.randint(0, 4), depth, nesting, callable_)
+                lines.extend(skipped)
+                lines.append('label ' + label)
+            elif choice < 0.88 and callable_:
+                lines.append('call s{}'.format(rng.choice(callable_)))
+            elif choice < 0.96 and nesting < 2:
+                address = _COUNTER_ADDRESS + nesting
+                top, done = next(labels), next(labels)
+                lines.extend(['push {}'.format(address),
+                              'push {}'.format(rng.randint(0, 3)), 'store',
+                              'label l{}'.format(top),
+                              'push {}'.format(address), 'retrieve',
+                              'jz l{}'.format(done)])
+                lines.extend(body(rng.randint(1, 5), depth, nesting + 1, callable_))
+                lines.extend(['push {}'.format(address),
+                              'push {}'.format(address), 'retrieve',
+                              'push 1', 'sub', 'store',
+                              'jump l{}'.format(top), 'label l{}'.format(done)])
+            elif choice < 0.97:
+                lines.append('{} nowhere'.format(rng.choice(['jump', 'call'])))
+            elif choice < 0.98:
+                lines.append('ret')
+        return lines
+
+    lines = body(size, 0, 0, list(range(subroutines)))
+    if rng.random() < 0.95:
+        lines.append('end')
+    for k in range(subroutines):
+        lines.append('label s{}'.format(k))
+        lines.extend(body(size // 2, 0, 0, list(range(k + 1, subroutines))))
+        lines.append('ret')
+    return lines
+
+
+def random_input(rng, length=12):
+    """Get random input of numbers, newlines and other characters."""
+    return ''.join(rng.choice('0123456789-\n\nab ')
+                   for _ in range(rng.randint(0, length)))
+
+
+def run_engine(code, inp, options, step_limit=STEP_LIMIT):
+    """Run a program on the engine with the given options.
+
+    Returns: an Outcome
+    """
+    options = dict(options)
+    use_async = options.pop('async', False)
+    chunks = []
+    interpreter = SpaceInterpreter(code, inp, step_limit=step_limit, **options)
+    try:
+        if use_async:
+            loop = asyncio.new_event_loop()
+            try:
+                loop.run_until_complete(esolang_whitespace_async.run(
+                    interpreter, output=chunks.append, yield_every=7))
+            finally:
+                loop.close()
+        else:
+            interpreter.run(output=chunks.append)
+    except ResourceLimitError:
+        return Outcome(''.join(chunks), 'ResourceLimitError', True)
+    except Exception as error:
+        return Outcome(''.join(chunks), type(error).__name__, False)
+    return Outcome(''.join(chunks), None, False)
+
+
+def run_everywhere(code, inp, engines=None, step_limit=STEP_LIMIT):
+    """Run a program on every engine.
+
+    Returns: a dict of the name of each engine to its Outcome
+    """
+    return dict((name, run_engine(code, inp, options, step_limit))
+                for name, options in (ENGINES if engines is None else engines))
+
+
+def disagreements(outcomes, engines=None):
+    """Find the engines whose outcome differs from the first engine's.
+
+    The optimizer changes how many instructions are counted, so if any
+    engine hit the step limit, engines are only compared with those
+    running the program with the same optimization.
+
+    Returns: a sorted list of the names of the engines that disagree
+    """
+    engines = ENGINES if engines is None else engines
+    limited = any(outcome.limited for outcome in outcomes.values())
+    references = {}
+    names = []
+    for name, options in engines:
+        group = limited and _optimized(options)
+        reference = references.setdefault(group, outcomes[name])
+        if outcomes[name] != reference:
+            names.append(name)
+    return sorted(names)
+
+
+def _optimized(options):
+    """Check if an engine runs programs through the optimizer."""
+    return options.get('optimize', True) and options.get('trace') is None
+
+
+def minimize(lines, inp, failing):
+    """Shrink a failing program and its input.
+
+    Runs of lines, then characters of the input, are removed for as long
+    as failing(lines, inp) stays True, trying long runs first.
+
+    Returns: the shrunk lines and input
+    """
+    lines = _shrink(list(lines), lambda lines: failing(lines, inp))
+    inp = ''.join(_shrink(list(inp), lambda chars: failing(lines, ''.join(chars))))
+    return lines, inp
+
+
+def _shrink(items, failing):
+    """Remove runs of items while failing stays True of what is left."""
+    size = len(items) // 2
+    while size >= 1:
+        start = 0
+        while start < len(items):
+            candidate = items[:start] + items[start + size:]
+            if failing(candidate):
+                items = candidate
+            else:
+                start += size
+        size //= 2
+    return items
+
+
+def check(lines, inp, engines=None):
+    """Check if the engines disagree on a program given as listing lines."""
+    try:
+        code = assemble('\n'.join(lines))
+    except SyntaxError:
+        return False
+    return bool(disagreements(run_everywhere(code, inp, engines), engines))
+
+
+def fuzz(runs=100, seed=0, size=20, engines=None):
+    """Run random programs on every engine and shrink any they disagree on.
+
+    Returns: a list of a Mismatch for each program the engines disagreed on
+    """
+    rng = random.Random(seed)
+    mismatches = []
+    for _ in range(runs):
+        lines, inp = random_listing(rng, size), random_input(rng)
+        if not check(lines, inp, engines):
+            continue
+        lines, inp = minimize(lines, inp,
+                              lambda lines, inp: check(lines, inp, engines))
+        listing = '\n'.join(lines)
+        mismatches.append(Mismatch(listing, inp,
+                                   run_everywhere(assemble(listing), inp, engines)))
+    return mismatches
+
+
+def main(args=None):
+    """Fuzz the engines from the command line.
+
+    Returns: the exit status
+    """
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--runs', type=int, default=1000,
+                        help='number of random programs to run')
+    parser.add_argument('--seed', type=int, default=0, help='seed of the programs')
+    parser.add_argument('--size', type=int, default=20,
+                        help='instructions in the main code of each program')
+    options = parser.parse_args(args)
+
+    mismatches = fuzz(options.runs, options.seed, options.size)
+    for mismatch in mismatches:
+        print('engines disagree on input {!r}:'.format(mismatch.inp))
+        print(mismatch.listing)
+        for name, outcome in sorted(mismatch.outcomes.items()):
+            print('  {:<24} {}'.format(name, outcome))
+    print('{} of {} programs disagreed'.format(len(mismatches), options.runs))
+    return 1 if mismatches else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
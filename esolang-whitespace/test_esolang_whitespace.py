@@ -1,4 +1,9 @@
+# -*- coding: utf-8 -*-
 """Tests for the esolang_whitespace module."""
+import array
+import functools
+import pickle
+
 import pytest
 
 
@@ -19,9 +24,21 @@ FILL_STACK = '   \n   \t\n   \t \n   \t\t\n   \t  \n'
 TERMINATE = '\n\n\n'
 
 
-def test_unclean_termination_raises_exception():
-    """Test that unclean termination of the code raises a SyntaxError."""
+@pytest.fixture(params=[(True, 'python'), (False, 'python'),
+                        (True, 'blocks'), (False, 'blocks'),
+                        (True, 'interpreter'), (False, 'interpreter')],
+                ids=['optimized-python', 'unoptimized-python',
+                     'optimized-blocks', 'unoptimized-blocks',
+                     'optimized-interpreter', 'unoptimized-interpreter'])
+def whitespace(request):
+    """Run programs with and without the optimizer on every engine."""
     from esolang_whitespace import whitespace
+    optimize, engine = request.param
+    return functools.partial(whitespace, optimize=optimize, engine=engine)
+
+
+def test_unclean_termination_raises_exception(whitespace):
+    """Test that unclean termination of the code raises a SyntaxError."""
     with pytest.raises(SyntaxError):
         whitespace('')
 
@@ -34,9 +51,8 @@ CODES = [
 
 
 @pytest.mark.parametrize('code, output', CODES)
-def test_pushing_positive_numbers_with_whitespace(code, output):
+def test_pushing_positive_numbers_with_whitespace(code, output, whitespace):
     """Test that pushing and outputing positive numbers works."""
-    from esolang_whitespace import whitespace
     assert whitespace(code) == output
 
 
@@ -48,9 +64,8 @@ CODES = [
 
 
 @pytest.mark.parametrize('code, output', CODES)
-def test_pushing_negative_numbers_with_whitespace(code, output):
+def test_pushing_negative_numbers_with_whitespace(code, output, whitespace):
     """Test that pushing and outputing negative numbers works."""
-    from esolang_whitespace import whitespace
     assert whitespace(code) == output
 
 
@@ -62,9 +77,8 @@ CODES = [
 
 
 @pytest.mark.parametrize('code, output', CODES)
-def test_output_of_letters_with_whitespace(code, output):
+def test_output_of_letters_with_whitespace(code, output, whitespace):
     """Test that outputing letters works."""
-    from esolang_whitespace import whitespace
     assert whitespace(code) == output
 
 
@@ -76,9 +90,8 @@ CODES = [
 
 
 @pytest.mark.parametrize('code, output', CODES)
-def test_output_of_letters_with_commented_whitespace(code, output):
+def test_output_of_letters_with_commented_whitespace(code, output, whitespace):
     """Test that outputing letters works with inline comments."""
-    from esolang_whitespace import whitespace
     assert whitespace(code) == output
 
 
@@ -95,9 +108,8 @@ CODES = [
 
 
 @pytest.mark.parametrize('code, output', CODES)
-def test_stack_functionality(code, output):
+def test_stack_functionality(code, output, whitespace):
     """Test that stack functionality works properly."""
-    from esolang_whitespace import whitespace
     assert whitespace(code) == output
 
 
@@ -109,9 +121,8 @@ CODES = [
 
 
 @pytest.mark.parametrize('code, output', CODES)
-def test_stack_edge_cases(code, output):
+def test_stack_edge_cases(code, output, whitespace):
     """Test that stack edge cases work properly."""
-    from esolang_whitespace import whitespace
     assert whitespace(code) == output
 
 
@@ -127,9 +138,8 @@ CODES = [
 
 
 @pytest.mark.parametrize('code, error', CODES)
-def test_stack_edge_cases_raise_errors(code, error):
+def test_stack_edge_cases_raise_errors(code, error, whitespace):
     """Test that stack edge cases work properly."""
-    from esolang_whitespace import whitespace
     with pytest.raises(error):
         whitespace(code)
 
@@ -142,9 +152,8 @@ CODES = [
 
 
 @pytest.mark.parametrize('code, output', CODES)
-def test_heap_functionality(code, output):
+def test_heap_functionality(code, output, whitespace):
     """Test that heap works properly."""
-    from esolang_whitespace import whitespace
     assert whitespace(code) == output
 
 
@@ -156,9 +165,8 @@ CODES = [
 
 
 @pytest.mark.parametrize('code, error', CODES)
-def test_heap_edge_cases_raise_errors(code, error):
+def test_heap_edge_cases_raise_errors(code, error, whitespace):
     """Test that heap edge cases work properly."""
-    from esolang_whitespace import whitespace
     with pytest.raises(error):
         whitespace(code)
 
@@ -174,9 +182,8 @@ CODES = [
 
 
 @pytest.mark.parametrize('code, output', CODES)
-def test_arithmetic_functionality(code, output):
+def test_arithmetic_functionality(code, output, whitespace):
     """Test that arithmetic works properly."""
-    from esolang_whitespace import whitespace
     assert whitespace(code) == output
 
 
@@ -193,9 +200,8 @@ CODES = [
 
 
 @pytest.mark.parametrize('code, output', CODES)
-def test_arithmetic_edge_cases(code, output):
+def test_arithmetic_edge_cases(code, output, whitespace):
     """Test that arithmetic edge cases work properly."""
-    from esolang_whitespace import whitespace
     assert whitespace(code) == output
 
 
@@ -216,9 +222,8 @@ CODES = [
 
 
 @pytest.mark.parametrize('code, error', CODES)
-def test_arithmetic_edge_cases_raise_errors(code, error):
+def test_arithmetic_edge_cases_raise_errors(code, error, whitespace):
     """Test that arithmetic edge cases work properly."""
-    from esolang_whitespace import whitespace
     with pytest.raises(error):
         whitespace(code)
 
@@ -236,9 +241,8 @@ CODES = [
 
 
 @pytest.mark.parametrize('code, inp, output', CODES)
-def test_input_functionality(code, inp, output):
+def test_input_functionality(code, inp, output, whitespace):
     """Test that input works properly."""
-    from esolang_whitespace import whitespace
     assert whitespace(code, inp) == output
 
 
@@ -251,9 +255,8 @@ CODES = [
 
 
 @pytest.mark.parametrize('code, inp, error', CODES)
-def test_input_edge_cases_raise_errors(code, inp, error):
+def test_input_edge_cases_raise_errors(code, inp, error, whitespace):
     """Test that input edge cases work properly."""
-    from esolang_whitespace import whitespace
     with pytest.raises(error):
         whitespace(code, inp)
 
@@ -269,9 +272,8 @@ CODES = [
 
 
 @pytest.mark.parametrize('code, output', CODES)
-def test_conditional_unconditional_jump_functionality(code, output):
+def test_conditional_unconditional_jump_functionality(code, output, whitespace):
     """Test that conditional and unconditional jump works properly."""
-    from esolang_whitespace import whitespace
     assert whitespace(code) == output
 
 
@@ -281,9 +283,8 @@ CODES = [
 
 
 @pytest.mark.parametrize('code, output', CODES)
-def test_conditional_unconditional_jump_edge_cases(code, output):
+def test_conditional_unconditional_jump_edge_cases(code, output, whitespace):
     """Test conditional and unconditional jump edge cases work properly."""
-    from esolang_whitespace import whitespace
     assert whitespace(code) == output
 
 
@@ -298,9 +299,8 @@ CODES = [
 
 
 @pytest.mark.parametrize('code, error', CODES)
-def test_conditional_unconditional_jump_edge_cases_raise_errors(code, error):
+def test_conditional_unconditional_jump_edge_cases_raise_errors(code, error, whitespace):
     """Test conditional and unconditional jump edge cases work properly."""
-    from esolang_whitespace import whitespace
     with pytest.raises(error):
         whitespace(code)
 
@@ -313,9 +313,8 @@ CODES = [
 
 
 @pytest.mark.parametrize('code, output', CODES)
-def test_subroutine_functionality(code, output):
+def test_subroutine_functionality(code, output, whitespace):
     """Test that subroutine works properly."""
-    from esolang_whitespace import whitespace
     assert whitespace(code) == output
 
 
@@ -327,9 +326,8 @@ CODES = [
 
 
 @pytest.mark.parametrize('code, error', CODES)
-def test_subroutine_edge_cases_raise_errors(code, error):
+def test_subroutine_edge_cases_raise_errors(code, error, whitespace):
     """Test that subroutine edge cases work properly."""
-    from esolang_whitespace import whitespace
     with pytest.raises(error):
         whitespace(code)
 
@@ -348,9 +346,8 @@ CODES = [
 
 
 @pytest.mark.parametrize('code', CODES)
-def test_invalid_commands_raise_error(code):
+def test_invalid_commands_raise_error(code, whitespace):
     """Test that invalid commands raise SyntaxError."""
-    from esolang_whitespace import whitespace
     with pytest.raises(SyntaxError):
         whitespace(code)
 
@@ -523,6 +520,24 @@ def test_find_labels_raises_error_for_redefining_label():
         i.find_labels()
 
 
+def test_find_labels_does_not_run_conditional_jumps():
+    """Test that find_labels finds labels after jumps that would pop."""
+    from esolang_whitespace import SpaceInterpreter
+    i = SpaceInterpreter('\n\t \t\n' * 4 + '\n  \t\n' + TERMINATE)
+    i.find_labels()
+    assert i.labels == {'\t': 25}
+    assert i.stack == []
+
+
+def test_find_labels_can_be_called_again():
+    """Test that finding labels twice does not redeclare them."""
+    from esolang_whitespace import SpaceInterpreter
+    i = SpaceInterpreter('\n  \t\n' + TERMINATE)
+    i.find_labels()
+    i.find_labels()
+    assert i.labels == {'\t': 5}
+
+
 def test_parse_num_empty_number_raises_error():
     """Test that parsing empty number raises a SyntaxError."""
     from esolang_whitespace import SpaceInterpreter
@@ -1263,3 +1278,2090 @@ def test_exec_flow_control_exit_command_ends_program():
     i = SpaceInterpreter('\n\n')
     _, exit = i.exec_flow_control('\n\n', {}, [], [0])
     assert exit is True
+
+# Tests for the compiled program
+
+
+def test_tokenize_splits_code_into_instructions():
+    """Test that tokenize yields every instruction with its parameter."""
+    from esolang_whitespace import tokenize
+    tokens = list(tokenize('   \t\n\n  \t\n\t   \n \n\t\n\n\n\n'))
+    assert tokens == [(0, 'push', 1, 5), (5, 'label', '\t', 10),
+                      (10, 'add', None, 14), (14, 'jump', '\t', 19),
+                      (19, 'end', None, 22)]
+
+
+CODES = [
+    '\t\n\n\n',
+    '   \t',
+    '\n  \t',
+    ' \t\t\n\n\n',
+    ' '
+]
+
+
+@pytest.mark.parametrize('code', CODES)
+def test_tokenize_raises_error_for_invalid_code(code):
+    """Test that tokenize raises SyntaxError for malformed instructions."""
+    from esolang_whitespace import tokenize
+    with pytest.raises(SyntaxError):
+        list(tokenize(code))
+
+
+def test_compiling_program_drops_labels_from_instructions():
+    """Test that labels are not part of the instruction array."""
+    from esolang_whitespace import SpaceProgram
+    program = SpaceProgram('\n  \t\n   \t\n\n\n\n')
+    assert program.instructions == [('push', 1), ('end', None),
+                                    ('eof', None)]
+
+
+def test_compiling_program_resolves_labels_to_instruction_indexes():
+    """Test that jumps hold the index of the instruction after the label."""
+    from esolang_whitespace import SpaceProgram
+    program = SpaceProgram('\n \n\t\n   \t\n\n  \t\n\n\n\n', optimize=False)
+    assert program.labels == {'\t': 2}
+    assert program.instructions[0] == ('jump', 2)
+
+
+def test_compiling_program_leaves_undefined_labels_unresolved():
+    """Test that jumps to an undefined label hold None."""
+    from esolang_whitespace import SpaceProgram
+    program = SpaceProgram('\n \n\t\n\n\n\n')
+    assert program.instructions[0] == ('jump', None)
+
+
+def test_compiling_program_raises_error_for_redefining_label():
+    """Test that compiling raises SyntaxError for a duplicate label."""
+    from esolang_whitespace import SpaceProgram
+    with pytest.raises(SyntaxError):
+        SpaceProgram('\n  \t\n\n  \t\n\n\n\n')
+
+
+def test_compiling_program_maps_instructions_to_code_positions():
+    """Test that the program can map code offsets to instructions."""
+    from esolang_whitespace import SpaceProgram
+    program = SpaceProgram('   \t\n\n  \t\n\n\n\n', optimize=False)
+    assert program.positions == [0, 10, 13]
+    assert program.index(5) == 1
+    assert program.index(10) == 1
+    with pytest.raises(ValueError):
+        program.index(3)
+
+
+def test_run_leaves_pointer_at_exit_position():
+    """Test that run writes the final position back to the pointer."""
+    from esolang_whitespace import SpaceInterpreter
+    i = SpaceInterpreter(FILL_STACK + TERMINATE)
+    i.run()
+    assert i._call_stack == [31]
+
+
+CODES = [
+    ('\t   ', 'addi'),
+    ('\t  \t', 'subi'),
+    ('\t  \n', 'muli'),
+    ('\t \t ', 'divi'),
+    ('\t \t\t', 'modi')
+]
+
+
+@pytest.mark.parametrize('command, mnemonic', CODES)
+def test_compiling_program_fuses_push_and_arithmetic(command, mnemonic):
+    """Test that a push followed by arithmetic becomes one instruction."""
+    from esolang_whitespace import SpaceProgram
+    program = SpaceProgram(' \n    \t \n' + command + TERMINATE)
+    assert program.instructions == [('dup', None), (mnemonic, 2),
+                                    ('end', None), ('eof', None)]
+
+
+def test_compiling_program_does_not_fuse_division_by_literal_zero():
+    """Test that dividing by a pushed zero still raises at runtime."""
+    from esolang_whitespace import SpaceProgram
+    program = SpaceProgram('   \t\n    \n\t \t \n\n\n')
+    assert program.instructions[:3] == [('push', 1), ('push', 0), ('div', None)]
+
+
+def test_compiling_program_does_not_fuse_across_a_label():
+    """Test that a label between push and arithmetic prevents fusing."""
+    from esolang_whitespace import SpaceProgram
+    program = SpaceProgram(' \n    \t \n\n  \t\n\t   \n\t \t\n' + TERMINATE)
+    assert program.instructions[1:3] == [('push', 2), ('add', None)]
+    assert program.labels == {'\t': 2}
+
+
+def test_fused_arithmetic_keeps_jump_targets_after_it():
+    """Test that labels after a fused pair point at the right instruction."""
+    from esolang_whitespace import SpaceProgram, whitespace
+    code = '   \t\n   \t \n\t   \n \n\t\n\n  \t\n\t\n \t\n\n\n'
+    program = SpaceProgram(code, optimize=False)
+    assert program.instructions[program.labels['\t']] == ('outn', None)
+    assert whitespace(code) == '3'
+
+def test_scan_finds_labels_and_instruction_boundaries():
+    """Test that scan gives the tokens and where each label ends."""
+    from esolang_whitespace import scan
+    tokens, labels = scan('   \t\n\n  \t\n' + TERMINATE)
+    assert [token[0] for token in tokens] == [0, 5, 10]
+    assert labels == {'\t': 10}
+
+
+def test_scan_raises_error_for_redeclared_label():
+    """Test that scan raises SyntaxError for a label declared twice."""
+    from esolang_whitespace import scan
+    with pytest.raises(SyntaxError):
+        scan('\n  \t\n\n  \t\n')
+
+
+def test_program_with_many_labels_compiles_and_runs(whitespace):
+    """Test that a program with thousands of labels compiles and runs."""
+    from bench_esolang_whitespace import label_chain
+    from esolang_whitespace import SpaceProgram
+    code = label_chain(5000)
+    assert len(SpaceProgram(code, optimize=False).labels) == 5001
+    assert whitespace(code) == ''
+
+# Tests for the program cache
+
+
+def test_program_cache_counts_hits_and_misses():
+    """Test that the cache counts a miss and then a hit for the same code."""
+    from esolang_whitespace import ProgramCache
+    cache = ProgramCache()
+    first = cache.get(FILL_STACK + TERMINATE)
+    second = cache.get(FILL_STACK + TERMINATE)
+    assert first is second
+    assert cache.info() == (1, 1, 0, 128, 1)
+
+
+def test_program_cache_evicts_least_recently_used_program():
+    """Test that the least recently used program is dropped when full."""
+    from esolang_whitespace import ProgramCache
+    cache = ProgramCache(maxsize=2)
+    first = cache.get('\n\n\n')
+    cache.get(TERMINATE * 2)
+    cache.get('\n\n\n')
+    cache.get(TERMINATE * 3)
+    assert len(cache) == 2
+    assert cache.get('\n\n\n') is first
+    assert cache.info().misses == 3
+
+
+def test_program_cache_shrinking_maxsize_evicts_programs():
+    """Test that lowering maxsize evicts programs right away."""
+    from esolang_whitespace import ProgramCache
+    cache = ProgramCache()
+    cache.get('\n\n\n')
+    cache.get(TERMINATE * 2)
+    cache.maxsize = 1
+    assert len(cache) == 1
+
+
+def test_program_cache_with_zero_maxsize_keeps_nothing():
+    """Test that a maxsize of zero disables the in memory cache."""
+    from esolang_whitespace import ProgramCache
+    cache = ProgramCache(maxsize=0)
+    cache.get('\n\n\n')
+    cache.get('\n\n\n')
+    assert cache.info().misses == 2
+    assert len(cache) == 0
+
+
+def test_program_cache_does_not_cache_invalid_code():
+    """Test that code that does not compile raises and is not cached."""
+    from esolang_whitespace import ProgramCache
+    cache = ProgramCache()
+    with pytest.raises(SyntaxError):
+        cache.get('\t\n\n\n')
+    assert len(cache) == 0
+
+
+def test_program_cache_loads_programs_from_directory(tmpdir):
+    """Test that a new cache loads programs compiled by another from disk."""
+    from esolang_whitespace import ProgramCache
+    ProgramCache(directory=str(tmpdir)).get(FILL_STACK + TERMINATE)
+    assert len(tmpdir.listdir()) == 1
+
+    cache = ProgramCache(directory=str(tmpdir))
+    program = cache.get(FILL_STACK + TERMINATE)
+    assert cache.info().disk_hits == 1
+    assert program.instructions[-2:] == [('end', None), ('eof', None)]
+
+
+@pytest.mark.parametrize('data', [b'', b'nonsense', pickle.dumps(1),
+                                  pickle.dumps(ValueError)[:-1]])
+def test_program_cache_rebuilds_unreadable_entries(tmpdir, data):
+    """Test that an entry on disk that cannot be loaded is a miss and is
+    compiled and written again."""
+    from esolang_whitespace import ProgramCache
+    ProgramCache(directory=str(tmpdir)).get(FILL_STACK + TERMINATE)
+    entry, = tmpdir.listdir()
+    entry.write_binary(data)
+
+    cache = ProgramCache(directory=str(tmpdir))
+    program = cache.get(FILL_STACK + TERMINATE)
+    assert cache.info().disk_hits == 0
+    assert program.instructions[-2:] == [('end', None), ('eof', None)]
+    assert entry.read_binary() != data
+
+
+def test_program_cache_clear_resets_counters():
+    """Test that clear empties the cache and resets the counters."""
+    from esolang_whitespace import ProgramCache
+    cache = ProgramCache()
+    cache.get('\n\n\n')
+    cache.get('\n\n\n')
+    cache.clear()
+    assert cache.info() == (0, 0, 0, 128, 0)
+
+
+def test_run_uses_the_module_program_cache():
+    """Test that running the same code twice hits the module cache."""
+    from esolang_whitespace import program_cache, whitespace
+    hits = program_cache.info().hits
+    whitespace('   \t\n\t\n \t' + TERMINATE)
+    whitespace('   \t\n\t\n \t' + TERMINATE)
+    assert program_cache.info().hits >= hits + 1
+
+# Tests for streaming input and output
+
+ECHO_NUMBERS = '   \n\t\n\t\t   \n\t\t\t\t\n \t' * 3 + TERMINATE
+
+
+def test_run_writes_output_to_a_stream():
+    """Test that run writes to a given stream and returns None."""
+    from esolang_whitespace import SpaceInterpreter
+    try:
+        from StringIO import StringIO
+    except ImportError:
+        from io import StringIO
+    stream = StringIO()
+    i = SpaceInterpreter('   \t\n\t\n \t   \t \n\t\n \t' + TERMINATE)
+    assert i.run(output=stream) is None
+    assert stream.getvalue() == '12'
+
+
+def test_run_passes_output_to_a_callback():
+    """Test that run passes output to a callable sink."""
+    from esolang_whitespace import SpaceInterpreter
+    chunks = []
+    i = SpaceInterpreter('   \t\n\t\n \t' + TERMINATE)
+    i.run(output=chunks.append)
+    assert ''.join(chunks) == '1'
+
+
+def test_run_raises_error_for_invalid_output_sink():
+    """Test that run raises TypeError for an output that cannot be written."""
+    from esolang_whitespace import SpaceInterpreter
+    with pytest.raises(TypeError):
+        SpaceInterpreter(TERMINATE).run(output=5)
+
+
+def test_run_flushes_output_written_before_an_error():
+    """Test that output produced before an error still reaches the sink."""
+    from esolang_whitespace import SpaceInterpreter
+    chunks = []
+    i = SpaceInterpreter('   \t\n\t\n \t\t\n \t')
+    with pytest.raises(IndexError):
+        i.run(output=chunks.append)
+    assert chunks == ['1']
+
+
+def test_run_reads_input_from_a_file():
+    """Test that run reads input from a readable text stream."""
+    from esolang_whitespace import SpaceInterpreter
+    from io import StringIO
+    i = SpaceInterpreter(ECHO_NUMBERS, StringIO(u'12\n-3\n40\n'))
+    assert i.run() == '12-340'
+
+
+def test_run_reads_input_from_chunks_splitting_numbers():
+    """Test that numbers split across input chunks are read whole."""
+    from esolang_whitespace import SpaceInterpreter
+    i = SpaceInterpreter(ECHO_NUMBERS, iter(['1', '2\n-', '3', '\n40\n']))
+    assert i.run() == '12-340'
+
+
+def test_run_raises_error_for_unterminated_number_in_stream():
+    """Test that a stream ending mid number raises a SyntaxError."""
+    from esolang_whitespace import SpaceInterpreter
+    i = SpaceInterpreter(ECHO_NUMBERS, iter(['12\n', '3']))
+    with pytest.raises(SyntaxError):
+        i.run()
+
+
+def test_run_keeps_unread_string_input():
+    """Test that input left unread by the program stays on the interpreter."""
+    from esolang_whitespace import SpaceInterpreter
+    i = SpaceInterpreter('   \t\n\t\n\t\t' + TERMINATE, '12\n34\n')
+    i.run()
+    assert i.input == '34\n'
+    assert i.heap == {1: 12}
+
+
+def test_space_input_reads_characters_and_lines():
+    """Test that SpaceInput reads characters and lines across chunks."""
+    from esolang_whitespace import SpaceInput
+    reader = SpaceInput(iter(['ab', 'c\nd', 'e\n']))
+    assert reader.read_char() == 'a'
+    assert reader.read_line() == 'bc'
+    assert reader.read_line() == 'de'
+    with pytest.raises(IOError):
+        reader.read_char()
+    assert not reader.streaming
+
+
+def test_space_input_reads_binary_files():
+    """Test that a file opened in binary mode is decoded and ends at EOF."""
+    import io
+    from esolang_whitespace import SpaceInput
+    reader = SpaceInput(io.BytesIO(b'ab\ncd\ne'))
+    reader.CHUNK_SIZE = 2
+    assert reader.read_char() == 'a'
+    assert reader.read_line() == 'b'
+    assert reader.read_line() == 'cd'
+    assert reader.read_char() == 'e'
+    with pytest.raises(IOError):
+        reader.read_char()
+
+# Tests for stepping through output
+
+FOREVER = '\n  \n   \t\n\t\n \t\n \n\n'
+
+
+def test_iter_output_yields_output_of_program():
+    """Test that iter_output yields all the output of a program."""
+    from esolang_whitespace import SpaceInterpreter
+    i = SpaceInterpreter('   \t\n\t\n \t   \t \n\t\n \t' + TERMINATE)
+    assert ''.join(i.iter_output()) == '12'
+    assert i.exited
+
+
+def test_iter_output_yields_output_before_program_ends():
+    """Test that output is yielded while the program is still running."""
+    from esolang_whitespace import SpaceInterpreter
+    i = SpaceInterpreter(FOREVER)
+    chunk = next(i.iter_output())
+    assert set(chunk) == {'1'}
+    assert not i.exited
+
+
+def test_iter_output_stops_after_max_steps():
+    """Test that iter_output stops once the step budget is used."""
+    from esolang_whitespace import SpaceInterpreter
+    i = SpaceInterpreter(FOREVER)
+    output = ''.join(i.iter_output(max_steps=30))
+    assert not i.exited
+    assert 30 <= i.steps <= 33
+    assert output == '1' * (i.steps // 3)
+
+
+def test_iter_output_resumes_where_it_stopped():
+    """Test that calling iter_output again carries on from the same point."""
+    from esolang_whitespace import SpaceInterpreter
+    code = ('   \t\t\n\n  \n \n \t\n \t   \t\n\t  \t \n \n\t \t\n\n \n\n'
+            '\n  \t\n' + TERMINATE)
+    whole = SpaceInterpreter(code).run()
+    assert whole == '321'
+    i = SpaceInterpreter(code)
+    parts = []
+    while not i.exited:
+        parts.extend(i.iter_output(max_steps=2))
+    assert ''.join(parts) == whole
+
+
+def test_iter_output_stops_after_timeout():
+    """Test that iter_output stops a program that never exits on timeout."""
+    from esolang_whitespace import SpaceInterpreter
+    i = SpaceInterpreter(FOREVER)
+    for _ in i.iter_output(timeout=0.01):
+        pass
+    assert not i.exited
+    assert i.steps > 0
+
+
+def test_iter_output_yields_output_before_an_error():
+    """Test that output produced before an error is yielded first."""
+    from esolang_whitespace import SpaceInterpreter
+    i = SpaceInterpreter('   \t\n\t\n \t\t\n \t')
+    gen = i.iter_output()
+    assert next(gen) == '1'
+    with pytest.raises(IndexError):
+        next(gen)
+
+
+def test_iter_output_keeps_input_between_slices():
+    """Test that input is read in order across paused slices."""
+    from esolang_whitespace import SpaceInterpreter
+    i = SpaceInterpreter(ECHO_NUMBERS, '12\n-3\n40\n')
+    parts = []
+    while not i.exited:
+        parts.extend(i.iter_output(max_steps=1))
+    assert ''.join(parts) == '12-340'
+    assert i.input == ''
+
+# Tests for resource limits
+
+GROW_STACK = '\n  \n   \t\n\n \n\n'
+
+GROW_HEAP = '   \n\n  \n \n    \t\n\t\t    \t\n\t   \n \n\n'
+
+RECURSE = '\n  \n\n \t\n'
+
+
+def test_step_limit_stops_program_that_never_exits():
+    """Test that a program running forever raises ResourceLimitError."""
+    from esolang_whitespace import ResourceLimitError, whitespace
+    with pytest.raises(ResourceLimitError) as error:
+        whitespace(FOREVER, step_limit=100)
+    assert error.value.limit == 'step_limit'
+    assert 100 <= error.value.state['steps'] <= 103
+
+
+def test_step_limit_does_not_stop_program_within_it():
+    """Test that a program finishing within the step limit runs normally."""
+    from esolang_whitespace import whitespace
+    assert whitespace('   \t\n\t\n \t' + TERMINATE, step_limit=2) == '1'
+
+
+def test_stack_limit_stops_growing_stack():
+    """Test that going over the stack limit raises ResourceLimitError."""
+    from esolang_whitespace import ResourceLimitError, SpaceInterpreter
+    i = SpaceInterpreter(GROW_STACK, stack_limit=50)
+    with pytest.raises(ResourceLimitError) as error:
+        i.run()
+    assert error.value.limit == 'stack_limit'
+    assert error.value.state['stack_depth'] == 51
+    assert len(i.stack) == 51
+
+
+def test_heap_limit_stops_growing_heap():
+    """Test that going over the heap limit raises ResourceLimitError."""
+    from esolang_whitespace import ResourceLimitError, whitespace
+    with pytest.raises(ResourceLimitError) as error:
+        whitespace(GROW_HEAP, heap_limit=20)
+    assert error.value.limit == 'heap_limit'
+    assert error.value.state['heap_size'] == 21
+
+
+def test_call_limit_stops_deep_recursion():
+    """Test that nesting calls past the call limit raises ResourceLimitError."""
+    from esolang_whitespace import ResourceLimitError, SpaceInterpreter
+    i = SpaceInterpreter(RECURSE, call_limit=10)
+    with pytest.raises(ResourceLimitError) as error:
+        i.run()
+    assert error.value.limit == 'call_limit'
+    assert error.value.state['call_depth'] == 10
+    assert error.value.state['position'] == 4
+
+
+def test_resource_limit_error_is_a_runtime_error():
+    """Test that ResourceLimitError can be caught as a RuntimeError."""
+    from esolang_whitespace import SpaceInterpreter
+    i = SpaceInterpreter(FOREVER, step_limit=10)
+    with pytest.raises(RuntimeError):
+        i.run()
+
+
+def test_iter_output_raises_error_at_step_limit():
+    """Test that iter_output yields output then raises at the step limit."""
+    from esolang_whitespace import ResourceLimitError, SpaceInterpreter
+    i = SpaceInterpreter(FOREVER, step_limit=30)
+    gen = i.iter_output()
+    assert set(next(gen)) == {'1'}
+    with pytest.raises(ResourceLimitError):
+        next(gen)
+
+# Tests for the peephole optimizer
+
+
+def test_peephole_folds_arithmetic_on_pushed_numbers():
+    """Test that arithmetic on pushed numbers is done ahead of time."""
+    from esolang_whitespace import SpaceProgram
+    code = '   \t\n   \t \n\t   ' + '   \t\t\n\t  \n' + '\t\n \t' + TERMINATE
+    program = SpaceProgram(code)
+    assert program.instructions[:2] == [('push', 9), ('outn', None)]
+
+
+def test_peephole_does_not_fold_division_by_zero():
+    """Test that folding leaves a division by a pushed zero to raise."""
+    from esolang_whitespace import SpaceProgram, whitespace
+    code = '   \t\n    \n\t \t\t' + TERMINATE
+    assert ('mod', None) in SpaceProgram(code).instructions
+    with pytest.raises(ZeroDivisionError):
+        whitespace(code)
+
+
+def test_peephole_fuses_dup_and_conditional_jump():
+    """Test that dup followed by a conditional jump becomes one instruction."""
+    from esolang_whitespace import SpaceProgram
+    code = '\n  \t\n \n \n\t \t\n \n \n\t\t\t\n' + TERMINATE
+    program = SpaceProgram(code)
+    assert program.instructions[:2] == [('dupjz', 0), ('dupjn', 0)]
+
+
+def test_peephole_fuses_push_and_retrieve():
+    """Test that pushing an address and retrieving it becomes a load."""
+    from esolang_whitespace import SpaceProgram
+    program = SpaceProgram('   \t \n\t\t\t' + TERMINATE)
+    assert program.instructions[0] == ('load', 2)
+
+
+def test_peephole_removes_unreachable_code():
+    """Test that code after an unconditional jump up to a label is removed."""
+    from esolang_whitespace import SpaceProgram
+    code = '\n \n\t\n' + '   \t\n\t\n \t' + '\n  \t\n' + TERMINATE
+    program = SpaceProgram(code)
+    assert program.instructions == [('end', None), ('eof', None)]
+
+
+def test_peephole_threads_chains_of_jumps():
+    """Test that a jump to another jump goes straight to the final label."""
+    from esolang_whitespace import SpaceProgram
+    code = ('\n\t \t\n' + '\n\n\n' + '\n  \t\n\n \n\t \n' + '\n  \t \n' +
+            '   \t\n\t\n \t' + TERMINATE)
+    program = SpaceProgram(code)
+    assert program.instructions[0] == ('jz', 2)
+    assert sorted(program.labels) == ['\t ']
+
+
+def test_peephole_keeps_jump_loops_without_exit():
+    """Test that a jump to itself is left alone by jump threading."""
+    from esolang_whitespace import SpaceProgram
+    program = SpaceProgram('\n  \t\n\n \n\t\n')
+    assert program.instructions == [('jump', 0), ('eof', None)]
+
+
+def test_peephole_removes_unused_labels():
+    """Test that labels that are never jumped to do not block fusing."""
+    from esolang_whitespace import SpaceProgram
+    program = SpaceProgram(' \n    \t \n\n  \t\n\t   ' + TERMINATE)
+    assert program.instructions[:2] == [('dup', None), ('addi', 2)]
+    assert program.labels == {}
+
+
+def test_compiling_without_optimizing_keeps_every_instruction():
+    """Test that optimize=False compiles the instructions as written."""
+    from esolang_whitespace import SpaceProgram
+    code = '   \t\n   \t \n\t   ' + TERMINATE
+    program = SpaceProgram(code, optimize=False)
+    assert program.instructions == [('push', 1), ('push', 2), ('add', None),
+                                    ('end', None), ('eof', None)]
+
+
+def test_program_cache_keeps_optimized_and_unoptimized_apart():
+    """Test that the cache compiles code separately for each optimize flag."""
+    from esolang_whitespace import ProgramCache
+    cache = ProgramCache()
+    assert cache.get('\n\n\n').optimized
+    assert not cache.get('\n\n\n', optimize=False).optimized
+    assert cache.info().misses == 2
+
+
+CODES = [
+    ('   \t\t\n\n  \t\n \n \n\t  \n \n \t\n \t   \t\n\t  \t\n \n\t\t\n' +
+     '\n  \t\t\n\n \n\t\n\n   \n' + TERMINATE, '321'),
+    ('   \t \n\t\n\t\t' + '   \t \n\t\t\t\t\n \t' + '\n \n\t\n\n  \t\n' + TERMINATE,
+     '7'),
+    (' \n \n\t \t\n' + TERMINATE, IndexError),
+    ('   \t\n\t\t\t' + TERMINATE, NameError)
+]
+
+
+@pytest.mark.parametrize('code, result', CODES)
+def test_optimized_programs_behave_as_unoptimized(code, result):
+    """Test that optimized and unoptimized runs give the same result."""
+    from esolang_whitespace import whitespace
+    for optimize in (True, False):
+        if isinstance(result, str):
+            assert whitespace(code, '7\n', optimize=optimize) == result
+        else:
+            with pytest.raises(result):
+                whitespace(code, optimize=optimize)
+
+# Tests for the Python engine
+
+
+def test_transpile_gives_source_of_a_function():
+    """Test that transpile writes the source of a run function."""
+    from esolang_whitespace import SpaceProgram, transpile
+    program = SpaceProgram('   \t\n\t\n \t' + TERMINATE)
+    source, line_pcs, entries = transpile(program)
+    assert source.startswith('def run(')
+    assert entries == frozenset([0])
+    compile(source, '<test>', 'exec')
+
+
+def test_transpile_starts_blocks_at_jump_targets_and_returns():
+    """Test that every jump target and return address starts a block."""
+    from esolang_whitespace import SpaceProgram, transpile
+    program = SpaceProgram('\n \t\t\n' + TERMINATE + '\n  \t\n\n\t\n',
+                           optimize=False)
+    assert transpile(program)[2] == frozenset([0, 1, 2])
+
+
+def test_program_function_is_compiled_once():
+    """Test that the Python function is kept with the program."""
+    from esolang_whitespace import SpaceProgram
+    program = SpaceProgram(FOREVER)
+    assert program.function is program.function
+
+
+def test_pickled_program_leaves_out_function():
+    """Test that pickling a program drops its compiled function."""
+    import pickle
+    from esolang_whitespace import SpaceProgram
+    program = SpaceProgram(FOREVER)
+    program.function
+    copy = pickle.loads(pickle.dumps(program))
+    assert copy._function is None
+    assert copy.function is not None
+
+
+def test_unpickled_program_fills_in_missing_attributes():
+    """Test that a program pickled before blocks were kept can be run."""
+    from esolang_whitespace import SpaceProgram
+    program = SpaceProgram(FOREVER)
+    state = program.__getstate__()
+    del state['_blocks'], state['_block_at']
+    copy = SpaceProgram.__new__(SpaceProgram)
+    copy.__setstate__(state)
+    assert copy.block_at[0] is not None
+
+
+def test_unknown_engine_raises_error():
+    """Test that asking for an engine that does not exist is an error."""
+    from esolang_whitespace import SpaceInterpreter
+    with pytest.raises(ValueError):
+        SpaceInterpreter('', engine='fortran')
+
+
+def test_python_engine_handles_huge_numbers():
+    """Test that number literals too long for str are transpiled."""
+    from esolang_whitespace import whitespace
+    big = '  ' + num_to_space(2 ** 20000)
+    code = big + big + '\t  \t\t\n \t' + TERMINATE
+    assert whitespace(code, engine='python') == '0'
+
+
+def test_python_engine_resumes_after_call_limit():
+    """Test that a run stopped inside a block can be picked up again."""
+    from esolang_whitespace import ResourceLimitError, SpaceInterpreter
+    i = SpaceInterpreter(RECURSE, call_limit=10, engine='python')
+    with pytest.raises(ResourceLimitError):
+        i.run()
+    i.call_limit = 20
+    with pytest.raises(ResourceLimitError) as error:
+        i.run()
+    assert error.value.state['call_depth'] == 20
+
+
+FAULTS = [
+    ('   \t\n\t\n \t\t\n  ', ''),
+    ('   \t\n\t\n \t \n\n', ''),
+    ('   \t\n \n\t', ''),
+    ('   \t\n    \n\t \t ', ''),
+    ('   \t\n\t\n \t\n\t\n', ''),
+    ('   \t\n\t\n \t', ''),
+    ('   \t\n\n \n\t\n', ''),
+    ('   \t\n\t\t\t', ''),
+    ('   \t\n\t\n\t ', ''),
+    ('   \t\n\t\n\t\t   \t\n\t\n\t\t', '7\nx\n'),
+    ('\n  \n   \t\n\t\n \t   \t \n\t  \n \n\n', ''),
+]
+
+
+@pytest.mark.parametrize('code, inp', FAULTS)
+def test_engines_fail_the_same_way(code, inp):
+    """Test that every engine raises the same error from the same state."""
+    from esolang_whitespace import SpaceInterpreter
+    results = []
+    for engine in ('python', 'blocks', 'interpreter'):
+        i = SpaceInterpreter(code, inp, engine=engine)
+        chunks = []
+        with pytest.raises(Exception) as error:
+            i.run(output=chunks.append)
+        results.append((type(error.value), str(error.value), ''.join(chunks),
+                        i.p, i.steps, i.stack, i.heap))
+    assert results[0] == results[1] == results[2]
+
+
+def test_large_programs_are_not_transpiled():
+    """Test that programs over the transpile limit are interpreted."""
+    from bench_esolang_whitespace import label_chain
+    from esolang_whitespace import SpaceInterpreter, program_cache
+    i = SpaceInterpreter(label_chain(10), optimize=False)
+    i.TRANSPILE_LIMIT = 10
+    assert i.run() == ''
+    assert program_cache.get(i.code, optimize=False)._function is None
+
+# Tests for the memory model
+
+
+def test_array_heap_stores_dense_addresses_in_array():
+    """Test that small non-negative addresses go in the array."""
+    from esolang_whitespace import ArrayHeap
+    heap = ArrayHeap()
+    heap[0] = 5
+    heap[3] = -7
+    assert heap[0] == 5
+    assert heap[3] == -7
+    assert len(heap) == 2
+    assert heap._sparse == {}
+
+
+def test_array_heap_raises_key_error_for_unset_address():
+    """Test that reading an address never set raises KeyError."""
+    from esolang_whitespace import ArrayHeap
+    heap = ArrayHeap({0: 1})
+    with pytest.raises(KeyError):
+        heap[1]
+    with pytest.raises(KeyError):
+        heap[-1]
+
+
+@pytest.mark.parametrize('address, value', [
+    (-1, 1), (10 ** 6, 1), (5, 2 ** 63), (5, -2 ** 63 - 1)
+])
+def test_array_heap_falls_back_to_dict(address, value):
+    """Test that addresses below or far past the array and huge values use
+    a dict."""
+    from esolang_whitespace import ArrayHeap
+    heap = ArrayHeap({0: 0})
+    heap[address] = value
+    assert heap._sparse == {address: value}
+    assert heap[address] == value
+    assert len(heap) == 2
+
+
+def test_array_heap_starts_at_first_address():
+    """Test that a dense heap far from address 0 is kept in the array."""
+    from esolang_whitespace import ArrayHeap
+    heap = ArrayHeap()
+    for address in range(10 ** 6, 10 ** 6 + 100):
+        heap[address] = address
+    assert heap._sparse == {}
+    assert len(heap._used) < 200
+    assert heap[10 ** 6 + 99] == 10 ** 6 + 99
+    assert sorted(heap) == list(range(10 ** 6, 10 ** 6 + 100))
+
+
+def test_array_heap_moves_address_between_array_and_dict():
+    """Test that an address is only ever kept in one place."""
+    from esolang_whitespace import ArrayHeap
+    heap = ArrayHeap()
+    heap[2] = 1
+    heap[2] = 2 ** 70
+    assert len(heap) == 1
+    heap[2] = 3
+    assert len(heap) == 1
+    assert heap == {2: 3}
+
+
+def test_array_heap_does_not_grow_for_sparse_addresses():
+    """Test that the array stays small when addresses are spread out."""
+    from esolang_whitespace import ArrayHeap
+    heap = ArrayHeap({0: 0})
+    for value in range(40):
+        heap[len(heap._used) + heap.SPREAD // 2 + value] = value
+    assert len(heap) == 41
+    assert len(heap._used) <= 4 * len(heap)
+    assert heap.get(heap.SPREAD // 2 + 40) == 39
+
+
+def test_array_heap_compares_equal_to_dict():
+    """Test that a heap equals a dict with the same contents."""
+    from esolang_whitespace import ArrayHeap
+    heap = ArrayHeap({1: 2, -4: 8})
+    assert heap == {1: 2, -4: 8}
+    assert heap != {1: 2}
+    assert sorted(heap.items()) == [(-4, 8), (1, 2)]
+
+
+def test_unknown_memory_model_raises_error():
+    """Test that asking for a memory model that does not exist is an error."""
+    from esolang_whitespace import SpaceInterpreter
+    with pytest.raises(ValueError):
+        SpaceInterpreter('', memory='disk')
+
+
+@pytest.mark.parametrize('engine', ['python', 'blocks', 'interpreter'])
+def test_array_memory_runs_programs_the_same(engine):
+    """Test that programs give the same results with an ArrayHeap."""
+    from esolang_whitespace import ArrayHeap, SpaceInterpreter
+    i = SpaceInterpreter(ECHO_NUMBERS, '12\n-3\n40\n', memory='array',
+                         engine=engine)
+    assert i.run() == '12-340'
+    assert isinstance(i.heap, ArrayHeap)
+    assert i.heap == {0: 40}
+
+
+@pytest.mark.parametrize('engine', ['python', 'blocks', 'interpreter'])
+def test_track_memory_records_peak_stack(engine):
+    """Test that the largest stack is kept even after it shrinks."""
+    from esolang_whitespace import SpaceInterpreter
+    code = ('\n  \n' + '   \t\n' * 3 + '\n \n\t\n' +
+            '\n  \t\n' + ' \n\n' * 3 + TERMINATE)
+    i = SpaceInterpreter(code, track_memory=True, engine=engine,
+                         optimize=False)
+    i.run()
+    assert i.peak_stack == 3
+    assert i.stack == []
+
+
+@pytest.mark.parametrize('engine', ['python', 'blocks', 'interpreter'])
+def test_track_memory_records_peak_in_straight_line_code(engine):
+    """Test that the peak is recorded without any control transfer."""
+    from esolang_whitespace import SpaceInterpreter, assemble
+    i = SpaceInterpreter(assemble('push 1\npush 2\nadd\noutn\nend'),
+                         track_memory=True, engine=engine, optimize=False)
+    assert i.run() == '3'
+    assert i.peak_stack == 2
+
+
+def test_track_memory_runs_without_the_trace_function():
+    """Test that tracking memory records peaks on the fast engine."""
+    from esolang_whitespace import SpaceInterpreter, program_cache
+    i = SpaceInterpreter('   \t\n' * 5 + TERMINATE, track_memory=True, optimize=False)
+    i.run()
+    assert i.peak_stack == 5
+    program = program_cache.get(i.code, optimize=False)
+    assert program._trace_function is None
+    assert program._track_function is not None
+
+
+def test_track_memory_records_peak_heap():
+    """Test that the largest heap is recorded over a run."""
+    from esolang_whitespace import ResourceLimitError, SpaceInterpreter
+    i = SpaceInterpreter(GROW_HEAP, track_memory=True, step_limit=200)
+    with pytest.raises(ResourceLimitError):
+        i.run()
+    assert i.peak_heap == len(i.heap) > 1
+
+
+def test_track_memory_keeps_step_counts():
+    """Test that pausing to record peaks does not change the steps run."""
+    from esolang_whitespace import ResourceLimitError, SpaceInterpreter
+    steps = []
+    for track in (False, True):
+        i = SpaceInterpreter(GROW_STACK, track_memory=track, stack_limit=50)
+        with pytest.raises(ResourceLimitError):
+            i.run()
+        steps.append(i.steps)
+    assert steps[0] == steps[1]
+
+
+def test_peaks_are_none_without_tracking():
+    """Test that peaks are not kept unless asked for."""
+    from esolang_whitespace import SpaceInterpreter
+    i = SpaceInterpreter(GROW_STACK, step_limit=100)
+    with pytest.raises(RuntimeError):
+        i.run()
+    assert i.peak_stack is None
+
+
+def test_memory_usage_is_smaller_for_array_heap():
+    """Test that a dense heap takes less memory in an ArrayHeap."""
+    from esolang_whitespace import SpaceInterpreter
+    usage = []
+    for memory in ('dict', 'array'):
+        i = SpaceInterpreter(GROW_HEAP, memory=memory, heap_limit=1000)
+        with pytest.raises(RuntimeError):
+            i.run()
+        usage.append(i.memory_usage())
+    assert usage[1].heap < usage[0].heap
+    assert usage[1].stack == usage[0].stack
+
+# Tests for the profiler
+
+COUNT_TO_THREE = ('   \n' + '\n  \t\n' + '   \t\n\t   ' + ' \n ' +
+                  '   \t\t\n\t  \t' + '\n\t\t\t\n' + '\t\n \t' + TERMINATE)
+
+
+def test_profile_is_none_unless_asked_for():
+    """Test that no profile is kept by default."""
+    from esolang_whitespace import SpaceInterpreter
+    i = SpaceInterpreter(COUNT_TO_THREE)
+    assert i.run() == '3'
+    assert i.profile is None
+
+
+def test_profile_counts_every_instruction_run():
+    """Test that the profile counts add up to the steps run."""
+    from esolang_whitespace import SpaceInterpreter
+    i = SpaceInterpreter(COUNT_TO_THREE, profile=True, optimize=False)
+    assert i.run() == '3'
+    report = i.profile.report()
+    assert report['steps'] == i.steps == 21
+    assert report['instructions'][0] == {
+        'count': 3, 'offset': 9, 'mnemonic': 'push', 'source': 'ssstn'}
+
+
+def test_profile_counts_large_programs_in_interpreter():
+    """Test that programs over the transpile limit are profiled the same
+    without transpiling them."""
+    from esolang_whitespace import SpaceInterpreter
+    reports = []
+    for limit in (1000, 10):
+        i = SpaceInterpreter(COUNT_TO_THREE, profile=True, optimize=False)
+        i.TRANSPILE_LIMIT = limit
+        assert i.run() == '3'
+        reports.append(i.profile.report())
+    assert reports[0] == reports[1]
+    assert reports[1]['steps'] == 21
+
+
+def test_profile_counts_labels():
+    """Test that the profile counts how often the code after a label ran."""
+    from esolang_whitespace import SpaceInterpreter
+    i = SpaceInterpreter(COUNT_TO_THREE, profile=True, optimize=False)
+    i.run()
+    assert i.profile.report()['labels'] == [
+        {'count': 3, 'offset': 4, 'label': 't'}]
+
+
+def test_profile_counts_calls_to_each_subroutine():
+    """Test that the profile counts the calls made to each subroutine."""
+    from esolang_whitespace import SpaceInterpreter
+    code = ('\n \t\t\n\n \t\t\n\n \t\n' + TERMINATE +
+            '\n  \t\n\n\t\n' + '\n  \n\n\t\n')
+    i = SpaceInterpreter(code, profile=True, optimize=False)
+    i.run()
+    assert i.profile.report()['calls'] == [
+        {'count': 2, 'offset': 17, 'label': 't'},
+        {'count': 1, 'offset': 25, 'label': ''}]
+
+
+def test_profile_sorts_and_limits_report():
+    """Test that the report lists the hottest instructions first."""
+    from esolang_whitespace import SpaceInterpreter
+    i = SpaceInterpreter(COUNT_TO_THREE, profile=True)
+    i.run()
+    instructions = i.profile.report(limit=2)['instructions']
+    assert len(instructions) == 2
+    assert instructions[0]['count'] >= instructions[1]['count']
+
+
+def test_profile_counts_up_to_an_error():
+    """Test that instructions run before an error are counted."""
+    from esolang_whitespace import SpaceInterpreter
+    i = SpaceInterpreter('   \t\n\t\n \t\t\n  ', profile=True)
+    with pytest.raises(IndexError):
+        i.run()
+    assert i.profile.report()['steps'] == i.steps == 3
+
+
+def test_profile_counts_across_slices():
+    """Test that counts carry on when the program is stepped through."""
+    from esolang_whitespace import SpaceInterpreter
+    i = SpaceInterpreter(COUNT_TO_THREE, profile=True, optimize=False)
+    while not i.exited:
+        list(i.iter_output(max_steps=2))
+    assert i.profile.report()['steps'] == i.steps == 21
+
+
+def test_profile_report_as_json_and_text():
+    """Test that the report can be written as JSON and text."""
+    import json
+    from esolang_whitespace import SpaceInterpreter
+    i = SpaceInterpreter(COUNT_TO_THREE, profile=True, optimize=False)
+    i.run()
+    assert json.loads(i.profile.as_json()) == i.profile.report()
+    text = i.profile.as_text()
+    assert text.startswith('21 instructions run')
+    assert 'ssstn' in text
+
+
+def test_visible_writes_code_in_s_t_n():
+    """Test that visible swaps whitespace for the letters s, t and n."""
+    from esolang_whitespace import visible
+    assert visible(' \t\n') == 'stn'
+
+# Tests for snapshots
+
+ECHO_UNTIL_ZERO = ('\n  \t\n' + '   \n\t\n\t\t' + '   \n\t\t\t' + ' \n ' +
+                   '\n\t \t \n' + '\t\n \t' + '\n \n\t\n' + '\n  \t \n' +
+                   TERMINATE)
+
+
+def test_snapshot_is_compact_bytes():
+    """Test that a snapshot is binary data starting with its magic bytes."""
+    from esolang_whitespace import SpaceInterpreter
+    i = SpaceInterpreter(FOREVER)
+    list(i.iter_output(max_steps=30))
+    snapshot = i.snapshot()
+    assert isinstance(snapshot, bytes)
+    assert snapshot.startswith(b'WSSN')
+    assert len(snapshot) < 100
+
+
+def test_restore_carries_on_from_snapshot():
+    """Test that a restored interpreter finishes the run the same way."""
+    from esolang_whitespace import SpaceInterpreter
+    code = ECHO_UNTIL_ZERO
+    whole = SpaceInterpreter(code, '12\n-3\n40\n0\n').run()
+    assert whole == '12-340'
+    i = SpaceInterpreter(code, '12\n-3\n40\n0\n')
+    first = ''.join(i.iter_output(max_steps=4))
+    restored = SpaceInterpreter(code)
+    restored.restore(i.snapshot())
+    assert first == '12'
+    assert restored.output_position == len(first)
+    assert first + restored.run() == whole
+    assert restored.input == ''
+
+
+def test_snapshot_saves_full_state():
+    """Test that every part of the state survives a snapshot."""
+    from esolang_whitespace import SpaceInterpreter
+    i = SpaceInterpreter(RECURSE, call_limit=5)
+    with pytest.raises(RuntimeError):
+        i.run()
+    i.stack = [1, -2 ** 100, 2 ** 70, 0]
+    i.heap = {-5: 3, 7: 2 ** 80}
+    restored = SpaceInterpreter(RECURSE)
+    restored.restore(i.snapshot())
+    for attr in ('_call_stack', 'stack', 'heap', 'steps', 'exited',
+                 'input_position', 'output_position'):
+        assert getattr(restored, attr) == getattr(i, attr)
+    assert restored.input == i.input.remaining()
+
+
+def test_restore_keeps_memory_model():
+    """Test that the heap is restored into the interpreter's heap type."""
+    from esolang_whitespace import ArrayHeap, SpaceInterpreter
+    i = SpaceInterpreter(GROW_HEAP, heap_limit=10)
+    with pytest.raises(RuntimeError):
+        i.run()
+    restored = SpaceInterpreter(GROW_HEAP, memory='array')
+    restored.restore(i.snapshot())
+    assert isinstance(restored.heap, ArrayHeap)
+    assert restored.heap == i.heap
+
+
+def test_restore_skips_streamed_input_already_read():
+    """Test that streamed input is given again and read from where it was."""
+    import io
+    from esolang_whitespace import SpaceInterpreter
+    text = u'12\n-3\n40\n0\n'
+    i = SpaceInterpreter(ECHO_UNTIL_ZERO, io.StringIO(text))
+    first = ''.join(i.iter_output(max_steps=4))
+    snapshot = i.snapshot()
+    restored = SpaceInterpreter(ECHO_UNTIL_ZERO)
+    with pytest.raises(ValueError):
+        restored.restore(snapshot)
+    restored.restore(snapshot, io.StringIO(text))
+    assert restored.input_position == i.input_position > 0
+    assert first + restored.run() == '12-340'
+
+
+def test_restore_rejects_input_shorter_than_read():
+    """Test that restoring with too little input raises ValueError."""
+    import io
+    from esolang_whitespace import SpaceInterpreter
+    i = SpaceInterpreter(ECHO_UNTIL_ZERO, io.StringIO(u'12\n-3\n40\n0\n'))
+    list(i.iter_output(max_steps=4))
+    with pytest.raises(ValueError):
+        SpaceInterpreter(ECHO_UNTIL_ZERO).restore(i.snapshot(), io.StringIO(u'1'))
+
+
+def test_restore_rejects_snapshot_of_other_code():
+    """Test that a snapshot only restores into the same program."""
+    from esolang_whitespace import SpaceInterpreter
+    snapshot = SpaceInterpreter(FOREVER).snapshot()
+    with pytest.raises(ValueError):
+        SpaceInterpreter(RECURSE).restore(snapshot)
+
+
+def test_snapshot_numbers_read_without_64_bit_arrays(monkeypatch):
+    """Test that numbers packed in a snapshot are read where Python has no
+    array of 64 bit integers, and written there by size instead."""
+    import esolang_whitespace
+    from esolang_whitespace import _read_ints, _write_ints
+    packed = bytearray()
+    _write_ints(packed, [1, -2, 2 ** 40])
+    monkeypatch.setattr(esolang_whitespace, '_INT_BITS', 32)
+    assert _read_ints(packed, 0) == ([1, -2, 2 ** 40], len(packed))
+    written = bytearray()
+    _write_ints(written, [1, -2, 2 ** 40])
+    assert written != packed
+    assert _read_ints(written, 0) == ([1, -2, 2 ** 40], len(written))
+
+
+def test_restore_runs_on_the_program_of_the_snapshot():
+    """Test that a snapshot of an unoptimized run resumes in an optimizing
+    interpreter, even returning to a ret the optimizer removes."""
+    from esolang_whitespace import SpaceInterpreter, assemble
+    code = assemble(LOOP_IN_TAIL_CALL)
+    i = SpaceInterpreter(code, optimize=False)
+    list(i.iter_output(max_steps=10))
+    restored = SpaceInterpreter(code)
+    restored.restore(i.snapshot())
+    assert restored._call_stack == i._call_stack
+    assert restored.run() == '0'
+
+
+@pytest.mark.parametrize('snapshot', [b'', b'nonsense', b'WSSN\x01corrupt'])
+def test_restore_rejects_bad_snapshot(snapshot):
+    """Test that data that is not a snapshot raises ValueError."""
+    from esolang_whitespace import SpaceInterpreter
+    with pytest.raises(ValueError):
+        SpaceInterpreter(FOREVER).restore(snapshot)
+
+# Tests for batches
+
+BATCH_INPUTS = ['1\n0\n', 'x\n', '5\n-2\n0\n', '', '7\n0\n']
+
+
+def check_batch_results(results):
+    """Check the results of running ECHO_UNTIL_ZERO on BATCH_INPUTS."""
+    assert [result.index for result in results] == [0, 1, 2, 3, 4]
+    assert [result.output for result in results] == ['1', '', '5-2', '', '7']
+    assert [type(result.error) for result in results] == [
+        type(None), ValueError, type(None), IOError, type(None)]
+
+
+def test_run_batch_gives_results_in_order():
+    """Test that run_batch runs every input across processes in order."""
+    from esolang_whitespace import run_batch
+    check_batch_results(run_batch(ECHO_UNTIL_ZERO, BATCH_INPUTS, workers=2,
+                                  chunksize=2))
+
+
+def test_run_batch_in_process():
+    """Test that run_batch with one worker runs the inputs in this process."""
+    from esolang_whitespace import run_batch
+    check_batch_results(run_batch(ECHO_UNTIL_ZERO, BATCH_INPUTS, workers=1))
+
+
+def test_iter_batch_streams_results_as_done():
+    """Test that unordered results cover every input once."""
+    from esolang_whitespace import iter_batch
+    results = sorted(iter_batch(ECHO_UNTIL_ZERO, iter(BATCH_INPUTS),
+                                workers=2, ordered=False))
+    check_batch_results(results)
+
+
+def test_run_batch_passes_options():
+    """Test that limits are applied to every input of a batch."""
+    from esolang_whitespace import ResourceLimitError, run_batch
+    results = run_batch(FOREVER, ['', ''], workers=2, step_limit=50)
+    assert all(isinstance(result.error, ResourceLimitError)
+               for result in results)
+    assert results[0].error.limit == 'step_limit'
+    assert results[0].output == results[1].output != ''
+
+
+def test_resource_limit_error_can_be_pickled():
+    """Test that ResourceLimitError keeps its details through pickling."""
+    import pickle
+    from esolang_whitespace import ResourceLimitError
+    error = ResourceLimitError('Too much.', 'step_limit', 5, {'steps': 6})
+    copy = pickle.loads(pickle.dumps(error))
+    assert str(copy) == 'Too much.'
+    assert (copy.limit, copy.value, copy.state) == ('step_limit', 5, {'steps': 6})
+
+
+def test_program_cache_add_keeps_compiled_program():
+    """Test that a program added to the cache is used instead of compiling."""
+    from esolang_whitespace import ProgramCache, SpaceProgram
+    cache = ProgramCache()
+    program = SpaceProgram(FOREVER, optimize=False)
+    cache.add(program)
+    assert cache.get(FOREVER, optimize=False) is program
+    assert cache.info().misses == 0
+
+# Tests for huge numbers
+
+
+@pytest.mark.parametrize('value', [
+    0, 7, -7, 2 ** 8192, -(2 ** 8192) - 1, 3 ** 6000, -(10 ** 4000)
+])
+def test_number_string_matches_str(value):
+    """Test that huge numbers are written the same as by str."""
+    from esolang_whitespace import _number_string, _split_number_string
+    assert _number_string(value) == str(value)
+    if value > 0:
+        assert _split_number_string(value, {}) == str(value)
+
+
+def test_number_string_writes_numbers_past_str_limit():
+    """Test that numbers with more digits than str allows can be written."""
+    from esolang_whitespace import _number_string, _split_number_string
+    assert _number_string(10 ** 6000) == '1' + '0' * 6000
+    assert _split_number_string(10 ** 6000 - 1, {}) == '9' * 6000
+
+
+@pytest.mark.parametrize('text', [
+    '12', ' -12 ', '9' * 6000, '-' + '1' * 6000, '+' + '5' * 3000
+])
+def test_parse_number_reads_decimal(text):
+    """Test that numbers of any length are read from decimal."""
+    from esolang_whitespace import _number_string, _parse_number
+    assert _number_string(_parse_number(text)) == text.strip().lstrip('+')
+
+
+@pytest.mark.parametrize('text', ['', 'x', '1' * 3000 + 'x', '--' + '1' * 3000,
+                                  '1' * 3000 + '-1', '1_0', '1_' + '0' * 3000,
+                                  '+-1', u'\u0661'])
+def test_parse_number_rejects_other_text(text):
+    """Test that text that is not a number raises ValueError."""
+    from esolang_whitespace import _parse_number
+    with pytest.raises(ValueError):
+        _parse_number(text)
+
+
+def test_program_outputs_huge_number(whitespace):
+    """Test that a pushed literal of thousands of digits is output in full."""
+    code = '  ' + num_to_space(10 ** 6000) + '\t\n \t' + TERMINATE
+    assert whitespace(code) == '1' + '0' * 6000
+
+
+def test_program_reads_and_outputs_huge_number(whitespace):
+    """Test that a number input of thousands of digits is read in full."""
+    code = '   \n   \n\t\n\t\t\t\t\t\t\n \t' + TERMINATE
+    inp = '-' + '9' * 6000 + '\n'
+    assert whitespace(code, inp) == inp[:-1]
+
+# Tests for the disassembler and assembler
+
+
+def suite_programs():
+    """Gather every valid program used by the tests above."""
+    from bench_esolang_whitespace import label_chain
+    from esolang_whitespace import _clean, tokenize
+    candidates = [label_chain(20)]
+    for name, value in sorted(globals().items()):
+        if name.isupper() and isinstance(value, str):
+            candidates.append(value)
+        for mark in getattr(value, 'pytestmark', []):
+            if mark.name == 'parametrize' and mark.args[0].split(',')[0] == 'code':
+                candidates.extend(params[0] if isinstance(params, tuple) else params
+                                  for params in mark.args[1])
+
+    programs = []
+    for code in candidates:
+        try:
+            list(tokenize(_clean(code)))
+        except SyntaxError:
+            continue
+        if code not in programs:
+            programs.append(code)
+    return programs
+
+
+@pytest.mark.parametrize('code', suite_programs())
+def test_assemble_disassembled_program_is_identical(code):
+    """Test that assembling the listing of a program gives back its code."""
+    from esolang_whitespace import _clean, assemble, disassemble
+    assert assemble(disassemble(code)) == _clean(code)
+
+
+def test_disassemble_writes_listing():
+    """Test that disassemble writes one mnemonic and parameter a line."""
+    from esolang_whitespace import disassemble
+    code = ('   \t \t\n' + ' \n ' + '\t   ' + '\n  \t \n' + '\n\t \n' +
+            '\t\n \t' + '\n \t\t\n' + '\n\t\n' + '\n\n\n')
+    assert disassemble(code) == ('push 5\ndup\nadd\nlabel .ts\njz .\noutn\n'
+                                 'call .t\nret\nend\n')
+
+
+@pytest.mark.parametrize('code, operand', [
+    ('  \t\n', '-0b'), ('   \n', '0'), ('    \n', '0b0'), ('    \t \n', '0b010'),
+    ('  \t\t\n', '-1'), ('  \t \t\n', '-0b01')
+])
+def test_disassemble_keeps_exact_numbers(code, operand):
+    """Test that numbers not written the shortest way keep their digits."""
+    from esolang_whitespace import assemble, disassemble
+    assert disassemble(code) == 'push {}\n'.format(operand)
+    assert assemble('push ' + operand) == code
+
+
+def test_assemble_names_labels():
+    """Test that named labels are given labels not used by the listing."""
+    from esolang_whitespace import assemble, whitespace
+    listing = """
+        push 3          ; count down from three
+        label loop
+            dup
+            outn
+            push 1
+            sub
+            dup
+            jz done
+            jump loop
+        label .t        ; taken, so loop and done cannot use it
+        label done
+        end
+    """
+    code = assemble(listing)
+    assert whitespace(code) == '321'
+    assert code.count('\n  \t\n') == 1
+
+
+def test_assemble_reads_huge_numbers():
+    """Test that numbers of thousands of digits assemble and run."""
+    from esolang_whitespace import assemble, disassemble, whitespace
+    code = assemble('push {}\noutn\nend'.format('9' * 6000))
+    assert whitespace(code) == '9' * 6000
+    assert disassemble(code).split()[1] == '9' * 6000
+
+
+@pytest.mark.parametrize('listing', [
+    'hop', 'push', 'push 1 2', 'dup 1', 'jump', 'label .sx', 'push 0b12',
+    'push five', 'end\nlabel .s .t'
+])
+def test_assemble_rejects_bad_listings(listing):
+    """Test that listings that cannot be assembled raise SyntaxError."""
+    from esolang_whitespace import assemble
+    with pytest.raises(SyntaxError):
+        assemble(listing)
+
+# Tests for source loading
+
+# push 1, outn, end, with comments. Comments cannot have spaces in them.
+COMMENTED = u'push→1:   \t\n' + 'outn:\t\n \tend:\n' + '\n\n'
+
+
+@pytest.mark.parametrize('source', [
+    COMMENTED, COMMENTED.encode('utf-8'), bytearray(COMMENTED.encode('utf-8')),
+    memoryview(COMMENTED.encode('utf-8'))
+])
+def test_source_cleans_text_and_bytes(source):
+    """Test that sources are cleaned the same whether text or bytes."""
+    from esolang_whitespace import SpaceSource
+    assert SpaceSource(source).code == '   \t\n\t\n \t\n\n\n'
+
+
+def test_clean_removes_non_whitespace_in_chunks(monkeypatch):
+    """Test that cleaning across chunk boundaries keeps every command."""
+    import esolang_whitespace
+    monkeypatch.setattr(esolang_whitespace, '_CLEAN_CHUNK_SIZE', 3)
+    text = u'a é\tb€\n\U0001f600 '
+    assert esolang_whitespace._clean(text) == ' \t\n '
+    assert esolang_whitespace._clean(text.encode('utf-8')) == ' \t\n '
+
+
+def test_run_cleans_code_given_to_it():
+    """Test that code given to run is cleaned like code given to the
+    constructor."""
+    from esolang_whitespace import SpaceInterpreter
+    i = SpaceInterpreter()
+    assert i.run(code=COMMENTED) == '1'
+    assert i.code == '   \t\n\t\n \t\n\n\n'
+
+
+def test_iter_output_cleans_code_given_to_it():
+    """Test that code given to iter_output is cleaned."""
+    from esolang_whitespace import SpaceInterpreter
+    assert ''.join(SpaceInterpreter().iter_output(code=COMMENTED)) == '1'
+
+
+def test_locate_finds_offsets_in_source():
+    """Test that offsets of the cleaned code are found in the source."""
+    from esolang_whitespace import SpaceSource
+    source = SpaceSource(COMMENTED)
+    assert source.locate(0) == (1, 8)
+    assert source.locate(3) == (1, 11)
+    assert source.locate(5) == (2, 6)
+    assert source.locate(9) == (3, 7)
+    assert source.locate(11) == (5, 1)
+
+
+def test_locate_defaults_to_pointer():
+    """Test that the interpreter locates its pointer in the source."""
+    from esolang_whitespace import SpaceInterpreter
+    i = SpaceInterpreter('push1:   \t\n' + 'swap: \n\t' + 'end:\n\n\n')
+    with pytest.raises(IndexError):
+        i.run()
+    assert i.p == 8
+    assert i.locate() == (3, 6)
+    assert i.locate(5) == (2, 6)
+
+
+def test_syntax_error_points_at_source():
+    """Test that syntax errors give the line and column in the source."""
+    from esolang_whitespace import SpaceInterpreter
+    with pytest.raises(SyntaxError) as error:
+        SpaceInterpreter(u'push1:   \t\nbad:üb\t\t\n').run()
+    assert error.value.msg == 'Invalid heap access command.'
+    assert (error.value.lineno, error.value.offset) == (2, 7)
+    assert error.value.text == u'bad:üb\t\t'
+
+
+@pytest.mark.parametrize('source', [
+    memoryview(b'   \t\n\t\n \t\n\n'), array.array('B', b'   \t\n\t\n \t\n\n')
+])
+def test_syntax_error_points_at_buffer_source(source):
+    """Test that syntax errors in memoryview and array sources are located."""
+    from esolang_whitespace import whitespace
+    with pytest.raises(SyntaxError) as error:
+        whitespace(source)
+    assert error.value.lineno == 3
+
+
+def test_runtime_syntax_error_points_at_source():
+    """Test that syntax errors raised running the program are located."""
+    from esolang_whitespace import SpaceInterpreter
+    with pytest.raises(SyntaxError) as error:
+        SpaceInterpreter('push1:   \t\ndone?').run()
+    assert error.value.msg == 'Code must terminate with an exit command.'
+    assert (error.value.lineno, error.value.offset) == (2, 1)
+
+
+def test_located_syntax_error_pickles():
+    """Test that the location of a syntax error survives pickling."""
+    import pickle
+    from esolang_whitespace import SpaceInterpreter
+    with pytest.raises(SyntaxError) as error:
+        SpaceInterpreter('x\t\t\n').run()
+    copy = pickle.loads(pickle.dumps(error.value))
+    assert (copy.msg, copy.lineno, copy.offset) == (error.value.msg, 1, 2)
+
+
+def test_source_reads_file(tmpdir):
+    """Test that a source is read from a memory mapped file and errors in
+    it name the file."""
+    from esolang_whitespace import SpaceInterpreter, SpaceSource
+    path = tmpdir.join('program.ws')
+    path.write_binary(COMMENTED.encode('utf-8'))
+    assert SpaceInterpreter(SpaceSource(None, str(path))).run() == '1'
+
+    path.write_binary(b'push1:   \t\nbad:\t\t\n')
+    with pytest.raises(SyntaxError) as error:
+        SpaceInterpreter(SpaceSource(None, str(path))).run()
+    assert error.value.filename == str(path)
+    assert (error.value.lineno, error.value.offset) == (2, 5)
+
+
+def test_source_reads_empty_file(tmpdir):
+    """Test that an empty file is an empty source."""
+    from esolang_whitespace import SpaceSource
+    path = tmpdir.join('empty.ws')
+    path.write('')
+    assert SpaceSource(None, str(path)).code == ''
+
+# Tests for tracing
+
+# push 2, call S, end, label S, outn, push 0, push 0, inc, ret
+TRACED = ('   \t \n' + '\n \t\t\n' + '\n\n\n' + '\n  \t\n' + '\t\n \t' +
+          '   \n' + '   \n' + '\t\n\t ' + '\n\t\n')
+
+
+def record_trace(code, inp='', **options):
+    """Run code, recording the event, position, instruction, arg, a copy
+    of the stack and the depth of every trace event."""
+    from esolang_whitespace import SpaceInterpreter
+    events = []
+
+    def hook(event):
+        events.append((event.event, event.position, event.instruction, event.arg,
+                       list(event.stack), event.depth))
+
+    i = SpaceInterpreter(code, inp, trace=hook, **options)
+    return i, i.run(), events
+
+
+def test_trace_reports_every_event():
+    """Test that the hook is called on instructions, calls, returns and I/O."""
+    i, output, events = record_trace(TRACED, 'x')
+    assert output == '2'
+    assert events == [
+        ('instruction', 0, ('push', 2), None, [], 0),
+        ('instruction', 6, ('call', '\t'), None, [2], 0),
+        ('call', 6, ('call', '\t'), 19, [2], 1),
+        ('instruction', 19, ('outn', None), None, [2], 1),
+        ('output', 19, ('outn', None), '2', [], 1),
+        ('instruction', 23, ('push', 0), None, [], 1),
+        ('instruction', 27, ('push', 0), None, [0], 1),
+        ('instruction', 31, ('inc', None), None, [0, 0], 1),
+        ('input', 31, ('inc', None), 'x', [0, 0], 1),
+        ('instruction', 35, ('ret', None), None, [0], 1),
+        ('return', 35, ('ret', None), 11, [0], 1),
+        ('instruction', 11, ('end', None), None, [0], 0)
+    ]
+
+
+def test_trace_reports_jumps_taken():
+    """Test that jumps are reported only when they are taken."""
+    _, output, events = record_trace(COUNT_TO_THREE)
+    jumps = [(event[1], event[3]) for event in events if event[0] == 'jump']
+    conditions = [event for event in events
+                  if event[0] == 'instruction' and event[2][0] == 'jn']
+    assert output == '3'
+    assert jumps == [(31, 9)] * 2
+    assert len(jumps) == len(conditions) - 1 == 2
+
+
+def test_trace_sees_every_instruction_as_written():
+    """Test that tracing runs the program unoptimized, one instruction
+    event per instruction counted."""
+    i, output, events = record_trace(COUNT_TO_THREE, optimize=True)
+    assert output == '3'
+    assert len([event for event in events if event[0] == 'instruction']) == i.steps
+    assert set(event[2][0] for event in events) <= set(
+        ['push', 'dup', 'add', 'sub', 'outn', 'label', 'jn', 'jump', 'end'])
+
+
+def test_untraced_runs_do_not_compile_trace_function():
+    """Test that runs without a hook never use the tracing function."""
+    from esolang_whitespace import SpaceInterpreter, program_cache
+    i = SpaceInterpreter('   \t\t\t\t\t\t\t\n \n\n' + TERMINATE)
+    i.run()
+    assert program_cache.get(i.code)._trace_function is None
+    assert program_cache.get(i.code, optimize=False)._trace_function is None
+
+
+def test_trace_hook_error_stops_before_instruction():
+    """Test that a hook raising an error stops before the instruction and
+    the run can be resumed from there."""
+    from esolang_whitespace import SpaceInterpreter
+
+    def hook(event):
+        if event.instruction[0] == 'outn':
+            raise KeyboardInterrupt()
+
+    i = SpaceInterpreter(TRACED, 'x', trace=hook)
+    with pytest.raises(KeyboardInterrupt):
+        i.run()
+    assert (i.p, i.steps, i.stack) == (19, 2, [2])
+    i.trace = None
+    assert i.run() == '2'
+    assert i.steps == 8
+
+
+@pytest.mark.parametrize('code, inp', [(TRACED, 'x'), (COUNT_TO_THREE, '')])
+def test_trace_large_programs_in_interpreter(code, inp):
+    """Test that programs over the transpile limit are traced the same
+    without transpiling them."""
+    from esolang_whitespace import SpaceInterpreter, program_cache
+    _, output, expected = record_trace(code, inp)
+    events = []
+    i = SpaceInterpreter(code + '\n\n\n', inp, trace=lambda event: events.append(
+        (event.event, event.position, event.instruction, event.arg,
+         list(event.stack), event.depth)))
+    i.TRANSPILE_LIMIT = 5
+    assert i.run() == output
+    assert events == expected
+    assert program_cache.get(i.code, optimize=False)._trace_function is None
+
+
+def test_trace_hook_error_stops_before_instruction_in_interpreter():
+    """Test that a hook raising an error in the interpreter loop stops
+    before the instruction."""
+    from esolang_whitespace import SpaceInterpreter
+
+    def hook(event):
+        if event.instruction[0] == 'outn':
+            raise KeyboardInterrupt()
+
+    i = SpaceInterpreter(TRACED, 'x', trace=hook)
+    i.TRANSPILE_LIMIT = 5
+    with pytest.raises(KeyboardInterrupt):
+        i.run()
+    assert (i.p, i.steps, i.stack) == (19, 2, [2])
+    i.trace = None
+    assert i.run() == '2'
+    assert i.steps == 8
+
+
+def test_trace_pauses_and_resumes_with_limits():
+    """Test that a traced run stopped by iter_output gives the same events."""
+    from esolang_whitespace import SpaceInterpreter
+    _, _, expected = record_trace(COUNT_TO_THREE)
+    events = []
+    i = SpaceInterpreter(COUNT_TO_THREE, trace=lambda event: events.append(event.event))
+    assert ''.join(i.iter_output(max_steps=1)) == ''
+    assert not i.exited
+    assert ''.join(i.iter_output()) == '3'
+    assert events == [event[0] for event in expected]
+
+
+def test_trace_counts_profile():
+    """Test that a traced run can also be profiled."""
+    from esolang_whitespace import SpaceInterpreter
+    i = SpaceInterpreter(COUNT_TO_THREE, profile=True, trace=lambda event: None)
+    i.run()
+    assert i.profile.report()['steps'] == i.steps
+
+
+@pytest.mark.parametrize('code, inp', FAULTS)
+def test_traced_runs_fail_the_same_way(code, inp):
+    """Test that tracing raises the same error from the same state."""
+    from esolang_whitespace import SpaceInterpreter
+    results = []
+    for trace in (None, lambda event: None):
+        i = SpaceInterpreter(code, inp, optimize=False, engine='interpreter', trace=trace)
+        chunks = []
+        with pytest.raises(Exception) as error:
+            i.run(output=chunks.append)
+        results.append((type(error.value), str(error.value), ''.join(chunks),
+                        i.p, i.steps, i.stack, i.heap))
+    assert results[0] == results[1]
+
+# Tests for static analysis
+
+
+def test_analyze_bounds_stack_depths():
+    """Test that the values on the stack are bounded before every
+    instruction."""
+    from esolang_whitespace import analyze, assemble
+    analysis = analyze(assemble('push 1\ndup\nadd\nslide 0\nend'))
+    assert analysis.depths == [(0, 0), (1, 1), (2, 2), (1, 1), (1, 1), None]
+    assert analysis.safe == frozenset(range(5))
+    assert analysis.problems == []
+
+
+def test_analyze_joins_paths():
+    """Test that the bounds of every path to an instruction are joined."""
+    from esolang_whitespace import analyze, assemble
+    analysis = analyze(assemble("""
+        push 0
+        inn
+        push 0
+        retrieve
+        jz skip
+        push 1
+        push 2
+        label skip
+        drop
+        end
+    """))
+    assert analysis.depths[7] == (0, 2)
+    assert 7 not in analysis.safe
+    assert analysis.problems == []
+
+
+def test_analyze_widens_growing_loops():
+    """Test that a loop pushing values ends analysis with no upper bound."""
+    from esolang_whitespace import analyze, assemble
+    analysis = analyze(assemble('label loop\npush 1\njump loop'))
+    assert analysis.depths[:2] == [(0, None), (1, None)]
+
+
+def test_analyze_returns_to_every_call():
+    """Test that rets go back after every call."""
+    from esolang_whitespace import analyze, assemble
+    analysis = analyze(assemble("""
+        call two
+        call one
+        add
+        outn
+        end
+        label one
+            push 1
+            ret
+        label two
+            push 2
+            ret
+    """))
+    assert analysis.depths[1][0] == analysis.depths[2][0] == 1
+    assert analysis.depths[5:7] == [(1, None), (2, None)]
+    assert 2 not in analysis.safe
+    assert analysis.problems == []
+
+
+def test_analyze_reports_guaranteed_underflow():
+    """Test that instructions that can never have enough values are
+    reported, and what follows them is never run."""
+    from esolang_whitespace import analyze, assemble
+    code = assemble('push 1\nadd\noutn\nend')
+    assert [problem[:2] for problem in analyze(code).problems] == [
+        ('underflow', 5), ('unreachable', 9)]
+    assert analyze(code).problems[0].message == (
+        'Not enough values in stack for add: at most 1, needs 2.')
+
+
+def test_analyze_reports_undefined_labels_and_missing_exit():
+    """Test that jumps to undefined labels and running off the end are
+    reported."""
+    from esolang_whitespace import analyze, assemble
+    code = assemble('push 0\njz .t\npush 1\noutn')
+    assert analyze(code).problems == [
+        ('undefined label', 4, 'Label is not defined.'),
+        ('missing exit', len(code), 'Code must terminate with an exit command.')]
+
+
+def test_analyze_reports_unreachable_code_once():
+    """Test that a run of unreachable code is reported at its start."""
+    from esolang_whitespace import analyze, assemble
+    code = assemble('jump end\npush 1\noutn\nlabel end\nend')
+    assert analyze(code).problems == [('unreachable', 5, 'Code is never run.')]
+
+
+def test_analyze_takes_commented_source():
+    """Test that source with comments is cleaned before analysis."""
+    from esolang_whitespace import analyze
+    assert analyze(COMMENTED).problems == []
+
+
+@pytest.mark.parametrize('code', [FOREVER, COUNT_TO_THREE, ECHO_UNTIL_ZERO, TRACED])
+def test_analyze_finds_no_problems_in_working_programs(code):
+    """Test that programs that run fine have no problems."""
+    from esolang_whitespace import analyze
+    assert analyze(code).problems == []
+
+
+def test_transpile_skips_checks_proven_safe():
+    """Test that the fast path does not check the stack where analysis
+    proved it safe."""
+    from esolang_whitespace import SpaceProgram, analyze, assemble, transpile
+    program = SpaceProgram(assemble('push 1\ndup\nswap\ndrop\ndrop\ndrop\nend'), False)
+    safe = analyze(program).safe
+    assert safe == frozenset([0, 1, 2, 3, 4])
+    source = transpile(program, safe=safe)[0]
+    assert 'swap' not in source
+    assert source.count('Cannot discard from empty stack.') == 1
+    with pytest.raises(IndexError, match='Cannot discard from empty stack.'):
+        program.function(program, 0, [], [], {}, None, None, [], None,
+                         float('inf'), float('inf'), float('inf'), float('inf'), False)
+
+
+# Tests for basic blocks
+
+LOOP = ('push 3\nlabel top\ndup\noutn\npush 1\nsub\ndup\njz done\njump top\n'
+        'label done\nend')
+
+
+def test_basic_blocks_split_at_jumps_and_targets():
+    """Test that blocks start at every target and after every transfer."""
+    from esolang_whitespace import SpaceProgram, assemble
+    program = SpaceProgram(assemble(LOOP), False)
+    assert [(block.start, block.stop) for block in program.blocks] == [
+        (0, 1), (1, 7), (7, 8), (8, 9), (9, 10)]
+    assert [block.start for block in program.block_at if block] == [0, 1, 7, 8, 9]
+    assert program.block_at[2] is None
+
+
+def test_basic_blocks_hold_their_targets():
+    """Test that jumps refer to the block they go to, not its index."""
+    from esolang_whitespace import SpaceProgram, assemble
+    program = SpaceProgram(assemble(LOOP), False)
+    entry, body, back, done, eof = program.blocks
+    assert entry.target is None and entry.fall is body
+    assert body.target is done and body.fall is back
+    assert back.target is body and back.transfers
+    assert done.target is None and not done.transfers
+
+
+def test_basic_blocks_run_loops():
+    """Test that the block engine runs a loop to the same result."""
+    from esolang_whitespace import SpaceInterpreter, assemble
+    code = assemble(LOOP)
+    results = []
+    for engine in ('blocks', 'interpreter'):
+        i = SpaceInterpreter(code, engine=engine, optimize=False)
+        results.append((i.run(), i.steps, i.p, i.stack))
+    assert results[0] == results[1] == ('321', 22, len(code), [0])
+
+
+def test_basic_blocks_are_compiled_when_first_run():
+    """Test that blocks that never run are never compiled."""
+    from esolang_whitespace import SpaceInterpreter, assemble, program_cache
+    code = assemble('push 0\njz skip\npush 1\noutn\nlabel skip\nend')
+    i = SpaceInterpreter(code, engine='blocks', optimize=False)
+    assert i.run() == ''
+    entry, skipped, end, eof = program_cache.get(code, optimize=False).blocks
+    assert entry.function is not None and end.function is not None
+    assert skipped.function is None and eof.function is None
+
+
+def test_basic_blocks_pause_where_the_interpreter_does():
+    """Test that the step limit stops the block engine at the same place."""
+    from esolang_whitespace import ResourceLimitError, SpaceInterpreter
+    results = []
+    for engine in ('blocks', 'interpreter'):
+        i = SpaceInterpreter(FOREVER, step_limit=100, engine=engine)
+        with pytest.raises(ResourceLimitError) as error:
+            i.run()
+        results.append((error.value.state['steps'], i.p, i.stack))
+    assert results[0] == results[1]
+
+
+def test_basic_blocks_stop_at_call_limit():
+    """Test that the call limit stops the block engine before the call."""
+    from esolang_whitespace import ResourceLimitError, SpaceInterpreter
+    i = SpaceInterpreter(RECURSE, call_limit=10, engine='blocks')
+    with pytest.raises(ResourceLimitError) as error:
+        i.run()
+    assert error.value.state['call_depth'] == 10
+    assert error.value.state['position'] == 4
+
+
+def test_large_programs_run_in_basic_blocks():
+    """Test that the block engine is used past the transpile limit."""
+    from bench_esolang_whitespace import label_chain
+    from esolang_whitespace import SpaceInterpreter, program_cache
+    i = SpaceInterpreter(label_chain(10), optimize=False, engine='blocks')
+    i.TRANSPILE_LIMIT = 10
+    assert i.run() == ''
+    program = program_cache.get(i.code, optimize=False)
+    assert program._function is None
+    assert all(block.function is not None for block in program.blocks[:-1])
+
+
+# Tests for differential fuzzing
+
+def test_engines_agree_on_random_programs():
+    """Test that every engine agrees on a fixed round of random programs."""
+    from fuzz_esolang_whitespace import fuzz
+    assert fuzz(runs=150, seed=2024) == []
+
+
+def test_random_listings_assemble_the_same_for_a_seed():
+    """Test that random programs are well-formed and depend only on the seed."""
+    import random
+    from esolang_whitespace import assemble, scan
+    from fuzz_esolang_whitespace import random_listing
+    first = [random_listing(random.Random(5)) for _ in range(2)]
+    assert first[0] == first[1]
+    lines = random_listing(random.Random(5), size=50)
+    assert len(lines) >= 50
+    scan(assemble('\n'.join(lines)))
+
+
+def test_run_everywhere_gives_an_outcome_per_engine():
+    """Test that output and errors are recorded for every engine."""
+    from esolang_whitespace import assemble
+    from fuzz_esolang_whitespace import ENGINES, Outcome, run_everywhere
+    outcomes = run_everywhere(assemble('push 7\noutn\ndrop'), '')
+    assert set(outcomes) == set(name for name, _ in ENGINES)
+    assert set(outcomes.values()) == {Outcome('7', 'IndexError', False)}
+
+
+def test_disagreements_name_the_engines_that_differ():
+    """Test that engines are compared with the first engine."""
+    from fuzz_esolang_whitespace import Outcome, disagreements
+    engines = [('a', {}), ('b', {}), ('c', {'optimize': False})]
+    same, other = Outcome('1', None, False), Outcome('1', 'NameError', False)
+    assert disagreements({'a': same, 'b': same, 'c': same}, engines) == []
+    assert disagreements({'a': same, 'b': other, 'c': same}, engines) == ['b']
+
+
+def test_disagreements_after_step_limit_are_by_optimization():
+    """Test that hitting the step limit only compares runs optimized alike."""
+    from fuzz_esolang_whitespace import Outcome, disagreements
+    engines = [('a', {}), ('b', {}), ('c', {'optimize': False})]
+    limited = Outcome('12', 'ResourceLimitError', True)
+    longer = Outcome('123', 'ResourceLimitError', True)
+    assert disagreements({'a': limited, 'b': limited, 'c': longer}, engines) == []
+    assert disagreements({'a': limited, 'b': longer, 'c': longer}, engines) == ['b']
+
+
+def test_minimize_keeps_only_what_fails():
+    """Test that failing programs shrink to the lines and input needed."""
+    from fuzz_esolang_whitespace import minimize
+
+    def failing(lines, inp):
+        return 'outn' in lines and 'push 2' in lines and '7' in inp
+
+    lines = ['push 1', 'push 2', 'dup', 'outn', 'drop', 'end']
+    assert minimize(lines, '17\n', failing) == (['push 2', 'outn'], '7')
+
+
+# Tests for reusing interpreters
+
+def test_reset_runs_the_program_again_on_new_input():
+    """Test that reset clears the state left by the last run."""
+    from esolang_whitespace import SpaceInterpreter
+    i = SpaceInterpreter(ECHO_NUMBERS, '1\n2\n3\n')
+    assert i.run() == '123'
+    i.reset('4\n5\n6\n')
+    assert (i.stack, i.heap, i.p, i.steps, i.exited) == ([], {}, 0, 0, False)
+    assert i.run() == '456'
+
+
+def test_reset_keeps_the_compiled_program():
+    """Test that runs after a reset do not look the program up again."""
+    from esolang_whitespace import SpaceInterpreter, program_cache
+    i = SpaceInterpreter(ECHO_NUMBERS, '1\n2\n3\n')
+    i.run()
+    info = program_cache.info()
+    i.reset('4\n5\n6\n')
+    i.run()
+    assert program_cache.info()[:3] == info[:3]
+
+
+def test_reset_keeps_memory_model_and_clears_profile():
+    """Test that reset keeps the options the interpreter was created with."""
+    from esolang_whitespace import ArrayHeap, SpaceInterpreter
+    i = SpaceInterpreter(ECHO_NUMBERS, '1\n2\n3\n', memory='array',
+                         profile=True, track_memory=True)
+    i.run()
+    i.reset()
+    assert isinstance(i.heap, ArrayHeap) and len(i.heap) == 0
+    assert i.profile.report()['steps'] == 0
+    assert (i.peak_stack, i.peak_heap) == (0, 0)
+
+
+def test_reset_after_an_error():
+    """Test that an interpreter can run again after the program failed."""
+    from esolang_whitespace import SpaceInterpreter
+    i = SpaceInterpreter(ECHO_NUMBERS, 'x\n')
+    with pytest.raises(ValueError):
+        i.run()
+    i.reset('7\n8\n9\n')
+    assert i.run() == '789'
+
+
+def test_command_tables_are_built_on_first_use():
+    """Test that the exec_ command tables are only built when needed."""
+    from esolang_whitespace import SpaceInterpreter
+    i = SpaceInterpreter('   \t\n\t\n \t' + TERMINATE)
+    assert i.run() == '1'
+    assert not set(vars(i)) & set(SpaceInterpreter._COMMAND_TABLES)
+    stack = []
+    i.exec_manipulate_stack('  \t\n', stack, [0])
+    assert stack == [1]
+    assert set(SpaceInterpreter._COMMAND_TABLES) <= set(vars(i))
+    with pytest.raises(AttributeError):
+        i._MISSING_IMP
+
+
+def test_interpreter_pool_reuses_interpreters():
+    """Test that interpreters given back to the pool are handed out again."""
+    from esolang_whitespace import InterpreterPool
+    pool = InterpreterPool(ECHO_NUMBERS, maxsize=1)
+    with pool.interpreter('1\n2\n3\n') as first:
+        assert first.run() == '123'
+    with pool.interpreter('4\n5\n6\n') as second:
+        with pool.interpreter('7\n8\n9\n') as third:
+            assert third.run() == '789'
+        assert second.run() == '456'
+    assert second is first and third is not first
+    assert len(pool) == 1
+
+
+def test_interpreter_pool_run_passes_options():
+    """Test that pooled runs use the options of the pool."""
+    from esolang_whitespace import InterpreterPool, ResourceLimitError
+    pool = InterpreterPool(FOREVER, step_limit=50, engine='interpreter')
+    with pytest.raises(ResourceLimitError):
+        pool.run()
+    chunks = []
+    with pytest.raises(ResourceLimitError):
+        pool.run(output=chunks.append)
+    assert len(pool) == 1
+    assert set(''.join(chunks)) == {'1'}
+
+
+def test_interpreter_pool_is_thread_safe():
+    """Test that threads sharing a pool each get the output of their input."""
+    import threading
+    from esolang_whitespace import InterpreterPool
+    pool = InterpreterPool(ECHO_NUMBERS, maxsize=4)
+    results = {}
+
+    def work(n):
+        for k in range(50):
+            inp = '{0}\n{1}\n{0}\n'.format(n, k)
+            results[n, k] = pool.run(inp) == '{0}{1}{0}'.format(n, k)
+
+    threads = [threading.Thread(target=work, args=(n,)) for n in range(8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert len(results) == 400 and all(results.values())
+    assert len(pool) <= 4
+
+
+# Tests for tail calls
+
+def countdown(depth, tail=True):
+    """Build a program recursing depth calls deep. Unless tail is True,
+    each call adds one on returning and the program outputs depth."""
+    return [
+        'push {}'.format(depth), 'call down', 'outn', 'end',
+        'label down', 'dup', 'jz bottom', 'push 1', 'sub', 'call down'
+    ] + ([] if tail else ['push 1', 'add']) + ['label bottom', 'ret']
+
+
+# Outputs 0 after a loop in a subroutine called by a tail call, whose ret
+# the optimizer removes.
+LOOP_IN_TAIL_CALL = '\n'.join([
+    'push 1', 'call a', 'outn', 'end', 'label a', 'call b', 'ret',
+    'label b', 'push 9', 'label loop', 'push 1', 'sub', 'dup', 'jz done',
+    'jump loop', 'label done', 'ret'
+])
+
+
+@pytest.mark.parametrize('listing, expected', [
+    (['call a', 'ret'], [('jump', 'a', 0), ('ret', None, 1)]),
+    (['call a', 'label b', 'ret'], [('jump', 'a', 0), ('label', 'b', 1), ('ret', None, 2)]),
+    (['call a', 'jump b', 'label b', 'ret'],
+     [('jump', 'a', 0), ('jump', 'b', 1), ('label', 'b', 2), ('ret', None, 3)]),
+    (['call a', 'outn', 'ret'], [('call', 'a', 0), ('outn', None, 1), ('ret', None, 2)]),
+    (['call a', 'jump b', 'label b', 'end'],
+     [('call', 'a', 0), ('jump', 'b', 1), ('label', 'b', 2), ('end', None, 3)]),
+])
+def test_eliminate_tail_calls(listing, expected):
+    """Test that only calls returning straight to a ret become jumps."""
+    from esolang_whitespace import _eliminate_tail_calls
+    listing = [tuple(line.split() + [None])[:2] + (position,)
+               for position, line in enumerate(listing)]
+    assert _eliminate_tail_calls(listing) == expected
+
+
+@pytest.mark.parametrize('engine', ['python', 'blocks', 'interpreter'])
+def test_tail_recursion_does_not_grow_the_call_stack(engine):
+    """Test that tail recursion runs within a call limit of one."""
+    from esolang_whitespace import assemble, whitespace
+    code = assemble('\n'.join(countdown(10000)))
+    assert whitespace(code, engine=engine, call_limit=1) == '0'
+
+
+def test_tail_calls_count_without_the_optimizer():
+    """Test that unoptimized tail calls still count towards the call limit."""
+    from esolang_whitespace import ResourceLimitError, assemble, whitespace
+    code = assemble('\n'.join(countdown(100)))
+    with pytest.raises(ResourceLimitError):
+        whitespace(code, optimize=False, call_limit=10)
+
+
+@pytest.mark.parametrize('engine', ['python', 'blocks', 'interpreter'])
+def test_deep_recursion_runs(engine):
+    """Test that recursion far deeper than Python's runs on every engine."""
+    from esolang_whitespace import assemble, whitespace
+    code = assemble('\n'.join(countdown(50000, tail=False)))
+    assert whitespace(code, engine=engine) == '50000'
+
+
+def test_deep_recursion_takes_eight_bytes_a_frame():
+    """Test that the call stack is kept compactly while running."""
+    tracemalloc = pytest.importorskip('tracemalloc')
+    from esolang_whitespace import SpaceInterpreter, assemble
+    i = SpaceInterpreter(assemble('\n'.join(countdown(20000, tail=False))),
+                         engine='interpreter')
+    i.run()
+    tracemalloc.start()
+    try:
+        i.reset()
+        assert i.run() == '20000'
+        peak = tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+    assert peak < 20000 * 12
+
+
+def test_paused_run_keeps_call_stack_as_indexes():
+    """Test that resuming a paused run does not convert the call stack."""
+    from esolang_whitespace import SpaceInterpreter, assemble
+    i = SpaceInterpreter(assemble('\n'.join(countdown(5000, tail=False))),
+                         engine='interpreter')
+    list(i.iter_output(max_steps=3000))
+    calls = i._frames[0]
+    list(i.iter_output(max_steps=3000))
+    assert i._frames[0] is calls
+    assert len(i._call_stack) == len(calls) + 1
+    assert ''.join(i.iter_output()) == '5000'
+
+
+def test_trace_can_be_dropped_between_slices():
+    """Test that a run paused inside a tail call finishes untraced."""
+    from esolang_whitespace import SpaceInterpreter, assemble
+    i = SpaceInterpreter(assemble(LOOP_IN_TAIL_CALL), trace=lambda event: None)
+    list(i.iter_output(max_steps=10))
+    assert len(i._call_stack) == 3
+    i.trace = None
+    assert ''.join(i.iter_output()) == '0'
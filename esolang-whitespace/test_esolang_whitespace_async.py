@@ -0,0 +1,123 @@
+"""Tests for the esolang_whitespace_async module."""
+import asyncio
+
+import pytest
+
+
+TERMINATE = '\n\n\n'
+
+FOREVER = '\n  \n   \t\n\t\n \t\n \n\n'
+
+ECHO_UNTIL_ZERO = ('\n  \t\n' + '   \n\t\n\t\t' + '   \n\t\t\t' + ' \n ' +
+                   '\n\t \t \n' + '\t\n \t' + '\n \n\t\n' + '\n  \t \n' +
+                   TERMINATE)
+
+
+async def trickle(chunks):
+    """Yield each chunk after handing control back to the loop."""
+    for chunk in chunks:
+        await asyncio.sleep(0)
+        yield chunk
+
+
+class StreamReader(object):
+    """Reader with a coroutine read returning bytes, like asyncio's."""
+
+    def __init__(self, data):
+        self.data = data
+
+    async def read(self, size):
+        await asyncio.sleep(0)
+        chunk, self.data = self.data[:3], self.data[3:]
+        return chunk
+
+
+def test_run_async_gives_same_output_as_run():
+    """Test that running asynchronously gives the same output and steps."""
+    from esolang_whitespace import SpaceInterpreter
+    i = SpaceInterpreter(ECHO_UNTIL_ZERO, '12\n-3\n40\n0\n')
+    output = asyncio.run(i.run_async())
+    j = SpaceInterpreter(ECHO_UNTIL_ZERO, '12\n-3\n40\n0\n')
+    assert output == j.run() == '12-340'
+    assert i.steps == j.steps
+    assert i.exited
+
+
+def test_run_async_yields_to_other_tasks():
+    """Test that two programs that never exit share the event loop."""
+    from esolang_whitespace import ResourceLimitError, SpaceInterpreter
+    order = []
+
+    async def run(name):
+        i = SpaceInterpreter(FOREVER, step_limit=300)
+        try:
+            await i.run_async(output=lambda text: order.append(name),
+                              yield_every=30)
+        except ResourceLimitError:
+            pass
+
+    async def main():
+        await asyncio.gather(run('a'), run('b'))
+
+    asyncio.run(main())
+    assert order[:4] == ['a', 'b', 'a', 'b']
+
+
+def test_run_async_awaits_async_iterable_input():
+    """Test that input arriving in pieces is waited for."""
+    from esolang_whitespace import SpaceInterpreter
+    i = SpaceInterpreter(ECHO_UNTIL_ZERO)
+    source = trickle(['1', '2\n-', '3\n4', '0\n0', '\n'])
+    assert asyncio.run(i.run_async(inp=source, yield_every=3)) == '12-340'
+
+
+def test_run_async_keeps_step_count_while_waiting_for_input():
+    """Test that waiting for input does not count the input instruction twice."""
+    from esolang_whitespace import SpaceInterpreter
+    i = SpaceInterpreter(ECHO_UNTIL_ZERO)
+    asyncio.run(i.run_async(inp=trickle(list('12\n-3\n40\n0\n'))))
+    j = SpaceInterpreter(ECHO_UNTIL_ZERO, '12\n-3\n40\n0\n')
+    j.run()
+    assert i.steps == j.steps
+    assert i.input_position == j.input_position == 11
+
+
+def test_run_async_reads_bytes_from_stream_reader():
+    """Test that a reader with a read coroutine is decoded and read."""
+    from esolang_whitespace import SpaceInterpreter
+    i = SpaceInterpreter(ECHO_UNTIL_ZERO)
+    reader = StreamReader(b'12\n-3\n40\n0\n')
+    assert asyncio.run(i.run_async(inp=reader)) == '12-340'
+
+
+def test_run_async_raises_error_when_async_input_runs_out():
+    """Test that running out of async input raises the usual error."""
+    from esolang_whitespace import SpaceInterpreter
+    i = SpaceInterpreter(ECHO_UNTIL_ZERO)
+    with pytest.raises(SyntaxError):
+        asyncio.run(i.run_async(inp=trickle(['1', '2'])))
+
+
+def test_run_async_awaits_async_output():
+    """Test that output is passed to a coroutine sink."""
+    from esolang_whitespace import SpaceInterpreter
+    written = []
+
+    async def sink(text):
+        await asyncio.sleep(0)
+        written.append(text)
+
+    i = SpaceInterpreter(ECHO_UNTIL_ZERO, '12\n-3\n40\n0\n')
+    assert asyncio.run(i.run_async(output=sink, yield_every=1)) is None
+    assert ''.join(written) == '12-340'
+    assert len(written) > 1
+
+
+def test_run_async_writes_output_before_error():
+    """Test that output made before an error still reaches the sink."""
+    from esolang_whitespace import SpaceInterpreter
+    written = []
+    i = SpaceInterpreter('   \t\n\t\n \t\t\n  ')
+    with pytest.raises(IndexError):
+        asyncio.run(i.run_async(output=written.append))
+    assert written == ['1']
@@ -12,7 +12,8 @@ setup(
                 'hightest_word',
                 'proper-parenthetics',
                 'string-pyramid',
-                'esolang_whitespace'],
+                'esolang_whitespace',
+                'esolang_whitespace_async'],
     author='Megan Flood',
     author_email='mak.flood@comcast.net',
     description='Solutions to kata from Code Wars with the relevant tests.',